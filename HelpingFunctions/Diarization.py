@@ -5,7 +5,7 @@ import torch
 import filetype
 import argparse
 
-from pydub import AudioSegment
+from audio_io import AUDIO_EXTENSIONS, CODECS, export_segments, load_waveform, to_pyannote_input
 
 from pyannote.audio import Pipeline
 from pyannote.audio.pipelines.utils.hook import ProgressHook
@@ -42,49 +42,30 @@ def detect_file_type(file_path):
 
     return file_extension, file_type
 
-def extract_audio(file_path, file_extension, file_type):
-    extraction_status = {'extraction_audio_status': 'extraction_audio_ongoing', 'message': 'Extraction audio en cours ...'}
-    logging.info(extraction_status)
-
-    if file_extension in ['.mp3', '.wav', '.aac', '.ogg', '.flac', '.m4a']:
-        logging.info(f"fichier audio détecté: {file_extension}.")
-        audio = AudioSegment.from_file(file_path)
-    else:
-        raise ValueError("Format de fichier non supporté.")
-
-    return audio
-
-def diarize_audio(audio_path, diarization_model, output_dir):
+def diarize_audio(audio_path, diarization_model, output_dir, export_workers=4, codec="wav"):
     logging.info(f"Démarrage de la diarisation du fichier {audio_path}")
     file_name = os.path.basename(audio_path)
 
-    audio = AudioSegment.from_file(audio_path)
-
-    audio = audio.set_channels(1)
-    audio = audio.set_frame_rate(16000)
-
-    audio.export(audio_path, format="wav")
+    # Un seul décodage (mono, 16 kHz), gardé en mémoire : le fichier source n'est jamais réécrit
+    samples, sample_rate = load_waveform(audio_path)
 
     # Étape 1 : Diarisation
     with ProgressHook() as hook:
         logging.debug(f"Diarization démarrée")
-        diarization = diarization_model(audio_path, hook=hook)
+        diarization = diarization_model(to_pyannote_input(samples, sample_rate), hook=hook)
         logging.debug(f"Diarization terminée {diarization}")
 
     segments = []
+    exports = []
 
-    # total_turns = len(list(diarization.itertracks(yield_label=True))) 
-    # for turn, _, speaker in tqdm(diarization.itertracks(yield_label=True), total=total_turns, desc="Processing turns"):
     for turn, _, speaker in diarization.itertracks(yield_label=True):
 
         start_ms = int(turn.start * 1000)  # Convertir de secondes en millisecondes
         end_ms = int(turn.end * 1000)
 
-        # Extraire le segment audio correspondant au speaker
-        segment_audio = audio[start_ms:end_ms]
-
-        segment_path = f"{output_dir}/{file_name}_segment_{start_ms}_{end_ms}.wav"
-        segment_audio.export(segment_path, format="wav")
+        # Le segment audio correspondant au speaker est écrit plus bas, en parallèle
+        segment_path = f"{output_dir}/{file_name}_segment_{start_ms}_{end_ms}.{codec}"
+        exports.append((segment_path, start_ms, end_ms))
 
         segments.append({
             "speaker": speaker,
@@ -92,22 +73,26 @@ def diarize_audio(audio_path, diarization_model, output_dir):
             "end_time": turn.end,
             "file": segment_path
         })
-        logging.info("Diarization terminée.")
+
+    export_segments(samples, sample_rate, exports, workers=export_workers, codec=codec)
+    logging.info("Diarization terminée.")
     
     print(f"segments: {segments}")
 
     return {"segments": segments}
 
-def main(audio_path, output_dir):
+def main(audio_path, output_dir, codec="wav"):
     diarization_model = load_pipeline_diarization("pyannote/speaker-diarization-3.1")
     file_extension, file_type = detect_file_type(audio_path)
-    audio = extract_audio(audio_path, file_extension, file_type)
-    diarize_audio(audio_path, diarization_model, output_dir)
+    if file_extension not in AUDIO_EXTENSIONS:
+        raise ValueError("Format de fichier non supporté.")
+    diarize_audio(audio_path, diarization_model, output_dir, codec=codec)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process a file for audio extraction and diarization.")
     parser.add_argument("file_path", type=str, help="Path to the file to process")
     parser.add_argument("output_dir", type=str, help="Directory to save the output audio files")
+    parser.add_argument("--codec", type=str, choices=CODECS, default="wav", help="Output codec of the speaker segments")
     args = parser.parse_args()
 
-    main(args.file_path, args.output_dir)
+    main(args.file_path, args.output_dir, args.codec)
@@ -1,27 +1,36 @@
 import argparse
 
-from pydub import AudioSegment, silence
+from pydub import AudioSegment
 import numpy as np
 
 import numpy as np
-import hashlib
-import random
-import string
-
-def generate_random_hash(length=8):
-    # Générer une chaîne aléatoire de caractères
-    random_string = ''.join(random.choices(string.ascii_letters + string.digits, k=length))
-    # Créer un hash SHA-256 de la chaîne aléatoire
-    hash_object = hashlib.sha256(random_string.encode())
-    # Retourner les premiers 8 caractères du hash
-    return hash_object.hexdigest()[:length]
-
-def split_audio_on_silence(audio_path, output_path, silence_thresh=-40, min_silence_len=500, max_segment_duration=10000, min_segment_duration=1000):
-    # Charger le fichier audio
-    audio = AudioSegment.from_file(audio_path)
 
+from silence_detection import detect_silence
+from streaming_split import stream_split_on_silence
+from audio_io import CODECS, AudioWriter, codec_params
+from run_manifest import RunManifest, file_content_hash, generate_content_hash
+
+def split_params(silence_thresh, min_silence_len, max_segment_duration, min_segment_duration):
+    # Paramètres qui déterminent les segments produits (et donc leurs noms)
+    return {
+        "silence_thresh": silence_thresh,
+        "min_silence_len": min_silence_len,
+        "max_segment_duration": max_segment_duration,
+        "min_segment_duration": min_segment_duration
+    }
+
+def segment_file_name(source_hash, start_ms, end_ms, params, codec="wav"):
+    # Nom déterministe : même source, mêmes positions et mêmes paramètres => même fichier
+    return f"segment_{generate_content_hash(source_hash, start_ms, end_ms, params)}.{codec}"
+
+def split_chunks(audio, silence_thresh=-40, min_silence_len=500, max_segment_duration=10000, min_segment_duration=1000):
+    """
+    Découpe un AudioSegment déjà chargé sur les silences.
+
+    :return: Liste de (position de début en ms, segment).
+    """
     # Détecter les silences
-    silent_ranges = silence.detect_silence(audio, min_silence_len=min_silence_len, silence_thresh=silence_thresh)
+    silent_ranges = detect_silence(audio, min_silence_len=min_silence_len, silence_thresh=silence_thresh)
 
     # Diviser l'audio en fonction des silences
     chunks = []
@@ -33,7 +42,7 @@ def split_audio_on_silence(audio_path, output_path, silence_thresh=-40, min_sile
             for i in range(0, len(chunk), max_segment_duration):
                 segment = chunk[i:i+max_segment_duration]
                 if len(segment) >= min_segment_duration:
-                    chunks.append(segment)
+                    chunks.append((start + i, segment))
         start = end_silence
     # Ajouter le dernier morceau
     last_chunk = audio[start:]
@@ -41,12 +50,58 @@ def split_audio_on_silence(audio_path, output_path, silence_thresh=-40, min_sile
         for i in range(0, len(last_chunk), max_segment_duration):
             segment = last_chunk[i:i+max_segment_duration]
             if len(segment) >= min_segment_duration:
-                chunks.append(segment)
+                chunks.append((start + i, segment))
+
+    return chunks
+
+def split_audio_on_silence(audio_path, output_path, silence_thresh=-40, min_silence_len=500, max_segment_duration=10000, min_segment_duration=1000, manifest=None, codec="wav", encode_workers=4):
+    params = codec_params(split_params(silence_thresh, min_silence_len, max_segment_duration, min_segment_duration), codec)
+    source_hash = file_content_hash(audio_path)
+
+    # Ne rien refaire si cette source a déjà été découpée avec ces paramètres
+    manifest = manifest or RunManifest(output_path, "split")
+    if manifest.is_done(source_hash, params):
+        return None
+
+    # Charger le fichier audio
+    audio = AudioSegment.from_file(audio_path)
+
+    chunks = split_chunks(audio, silence_thresh, min_silence_len, max_segment_duration, min_segment_duration)
+
+    # Sauvegarder chaque segment sous un nom dérivé de la source et de sa position (encodage en parallèle)
+    with AudioWriter(encode_workers) as writer:
+        for offset, chunk in chunks:
+            segment_path = f"{output_path}/{segment_file_name(source_hash, offset, offset + len(chunk), params, codec)}"
+            writer.export(chunk, segment_path, codec)
+    outputs = writer.written
+
+    manifest.record(audio_path, source_hash, params, outputs)
+    return outputs
 
-    # Sauvegarder chaque segment avec un nom de fichier aléatoire
-    for i, chunk in enumerate(chunks):
-        random_hash = generate_random_hash()
-        chunk.export(f"{output_path}/segment_{random_hash}.wav", format="wav")
+def split_audio_on_silence_streaming(audio_path, output_path, silence_thresh=-40, min_silence_len=500, max_segment_duration=10000, min_segment_duration=1000, block_ms=10000, manifest=None, codec="wav", encode_workers=4):
+    params = codec_params(split_params(silence_thresh, min_silence_len, max_segment_duration, min_segment_duration), codec)
+    source_hash = file_content_hash(audio_path)
+
+    manifest = manifest or RunManifest(output_path, "split")
+    if manifest.is_done(source_hash, params):
+        return None
+
+    # Lire le fichier par blocs et écrire chaque segment dès qu'il est fermé
+    outputs = stream_split_on_silence(
+        audio_path,
+        output_path,
+        lambda start_ms, end_ms: segment_file_name(source_hash, start_ms, end_ms, params, codec),
+        silence_thresh,
+        min_silence_len,
+        max_segment_duration,
+        min_segment_duration,
+        block_ms,
+        codec,
+        encode_workers
+    )
+
+    manifest.record(audio_path, source_hash, params, outputs)
+    return outputs
 
 
 # Exemple d'utilisation
@@ -65,16 +120,36 @@ def main():
     parser.add_argument('--min_silence_len', type=int, default=500, help='Minimum silence length in ms')
     parser.add_argument('--max_segment_duration', type=int, default=10000, help='Maximum segment duration in ms')
     parser.add_argument('--min_segment_duration', type=int, default=1000, help='Minimum segment duration in ms')
+    parser.add_argument('--stream', action='store_true', help='Read the audio in blocks with constant memory (long recordings)')
+    parser.add_argument('--block_ms', type=int, default=10000, help='Block size in ms for --stream')
+    parser.add_argument('--codec', type=str, choices=CODECS, default="wav", help='Output codec of the segments (flac: lossless, opus: web serving)')
+    parser.add_argument('--encode_workers', type=int, default=4, help='Number of threads encoding segments')
 
     args = parser.parse_args()
 
+    if args.stream:
+        split_audio_on_silence_streaming(
+            args.audio_path,
+            args.output_path,
+            args.silence_thresh,
+            args.min_silence_len,
+            args.max_segment_duration,
+            args.min_segment_duration,
+            args.block_ms,
+            codec=args.codec,
+            encode_workers=args.encode_workers
+        )
+        return
+
     split_audio_on_silence(
         args.audio_path,
         args.output_path,
         args.silence_thresh,
         args.min_silence_len,
         args.max_segment_duration,
-        args.min_segment_duration
+        args.min_segment_duration,
+        codec=args.codec,
+        encode_workers=args.encode_workers
     )
 
 if __name__ == "__main__":
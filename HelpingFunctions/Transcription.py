@@ -1,7 +1,31 @@
-import whisper
+import argparse
 
-model = whisper.load_model("large-v3")
+from run_manifest import file_content_hash
+from transcription_cache import add_cache_arguments, cache_from_args, transcription_params
+from whisper_model import add_model_arguments, load_whisper_model, resolve_precision, set_threads
 
-result = model.transcribe("public/audio/segment_1fd85b7b.wav",language="ht")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Transcribe a single audio file with Whisper.')
+    parser.add_argument('audio_file', type=str, nargs='?', default="public/audio/segment_1fd85b7b.wav", help='Audio file to transcribe')
+    parser.add_argument('--language', type=str, default="ht", help='Language of the audio')
+    add_model_arguments(parser)
+    add_cache_arguments(parser)
 
-print(result["text"])
\ No newline at end of file
+    args = parser.parse_args()
+    set_threads(args.threads, args.interop_threads)
+
+    cache = cache_from_args(args)
+    result = None
+    if cache is not None:
+        # Même fichier déjà transcrit avec ce modèle : le modèle n'est même pas chargé
+        content_hash = file_content_hash(args.audio_file)
+        params = transcription_params(args.model, resolve_precision(args.device, args.precision)[1], args.language)
+        result = cache.get(content_hash, params)
+
+    if result is None:
+        model, fp16 = load_whisper_model(args.model, args.device, args.precision)
+        result = model.transcribe(args.audio_file, language=args.language, fp16=fp16)
+        if cache is not None:
+            cache.put(content_hash, params, result)
+
+    print(result["text"])
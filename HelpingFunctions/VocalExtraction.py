@@ -4,17 +4,33 @@ import os
 from spleeter.separator import Separator
 from spleeter.audio.adapter import AudioAdapter
 
-def extract_vocals(audio_path, output_dir):
+from chunked_separation import OVERLAP_SECONDS
+
+def extract_vocals(audio_path, output_dir, chunk_seconds=None, overlap_seconds=OVERLAP_SECONDS, workers=1):
     """
     Extrait la partie vocale d'un fichier MP3 et la sauvegarde dans un fichier WAV.
 
     :param input_audio_path: Chemin vers le fichier MP3 d'entrée.
     :param output_dir: Répertoire de sortie pour les fichiers séparés.
+    :param chunk_seconds: Si donné, séparation en flux par fenêtres de chunk_seconds secondes (mémoire bornée).
+    :param workers: Nombre de processus qui séparent les fenêtres en mode découpé.
     """
     # Créer le répertoire de sortie s'il n'existe pas
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
+    output_path = os.path.join(output_dir, os.path.basename(audio_path).replace('.mp3', '_vocals.wav'))
+
+    if chunk_seconds:
+        from batch_vocal_extract import SpleeterEngine
+
+        # Fenêtres qui se chevauchent, recollées par fondu enchaîné : l'émission n'est jamais entière en mémoire
+        engine = SpleeterEngine(44100, chunk_seconds=chunk_seconds, overlap_seconds=overlap_seconds)
+        with engine.chunked_separator(workers) as separator:
+            engine.separate_file(audio_path, output_path, separator)
+        print(f"La partie vocale a été extraite et sauvegardée dans le fichier '{output_dir}'.")
+        return
+
     # Initialiser le séparateur de sources
     separator = Separator('spleeter:2stems')
 
@@ -29,7 +45,6 @@ def extract_vocals(audio_path, output_dir):
     vocals = prediction['vocals']
 
     # Sauvegarder la partie vocale
-    output_path = os.path.join(output_dir, os.path.basename(audio_path).replace('.mp3', '_vocals.wav'))
     audio_loader.save(output_path, vocals, sample_rate)
 
     print(f"La partie vocale a été extraite et sauvegardée dans le fichier '{output_dir}'.")
@@ -44,7 +59,10 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Extraire la partie vocale d\'un fichier MP3.')
     parser.add_argument('audio_path', type=str, help='Chemin vers le fichier MP3 d\'entrée.')
     parser.add_argument('output_dir', type=str, help='Répertoire de sortie pour les fichiers séparés.')
+    parser.add_argument('--chunk_seconds', type=float, default=None, help='Séparer en flux par fenêtres de cette durée (mémoire bornée pour les longues émissions).')
+    parser.add_argument('--overlap_seconds', type=float, default=OVERLAP_SECONDS, help='Recouvrement entre deux fenêtres, recollées par fondu enchaîné.')
+    parser.add_argument('--workers', type=int, default=1, help='Nombre de processus qui séparent les fenêtres (un modèle chargé par processus).')
 
     args = parser.parse_args()
     
-    extract_vocals(args.audio_path, args.output_dir)
\ No newline at end of file
+    extract_vocals(args.audio_path, args.output_dir, args.chunk_seconds, args.overlap_seconds, args.workers)
\ No newline at end of file
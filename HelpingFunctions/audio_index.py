@@ -0,0 +1,150 @@
+import argparse
+import os
+import sqlite3
+from datetime import datetime
+
+import soundfile as sf
+from pydub.utils import mediainfo
+
+from audio_io import AUDIO_EXTENSIONS
+from run_manifest import file_content_hash
+
+INDEX_FILE = ".audio_index.sqlite"
+
+
+def read_header(file_path):
+    """
+    Lit durée, fréquence d'échantillonnage et nombre de canaux depuis l'en-tête, sans décoder l'audio.
+    """
+    try:
+        info = sf.info(file_path)
+        return info.duration, info.samplerate, info.channels
+    except RuntimeError:
+        # Formats non gérés par cette version de libsndfile (mp3, m4a, opus...) : ffprobe ne lit que les métadonnées
+        info = mediainfo(file_path)
+        return float(info['duration']), int(info['sample_rate']), int(info['channels'])
+
+class AudioIndex:
+    """
+    Index persistant (SQLite) des fichiers audio d'un répertoire.
+
+    Chaque fichier est identifié par son nom, sa taille et sa date de modification :
+    un fichier inchangé n'est jamais relu, seuls les fichiers nouveaux ou
+    modifiés sont analysés lors d'un nouveau scan.
+    """
+
+    def __init__(self, directory, index_path=None):
+        self.directory = directory
+        self.index_path = index_path or os.path.join(directory, INDEX_FILE)
+        self.connection = sqlite3.connect(self.index_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                duration REAL,
+                sample_rate INTEGER,
+                channels INTEGER,
+                content_hash TEXT,
+                created_at REAL
+            )
+        """)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def scan(self, extensions=AUDIO_EXTENSIONS, with_hash=True):
+        """
+        Met l'index à jour avec le contenu actuel du répertoire.
+
+        :return: Nombre de fichiers (ré)analysés.
+        """
+        known = {row["name"]: (row["size"], row["mtime_ns"]) for row in self.connection.execute("SELECT name, size, mtime_ns FROM files")}
+        seen = set()
+        updated = 0
+
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.lower().endswith(extensions):
+                    continue
+                seen.add(entry.name)
+
+                stat = entry.stat()
+                if known.get(entry.name) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+
+                try:
+                    duration, sample_rate, channels = read_header(entry.path)
+                except Exception as e:
+                    print(f"Erreur lors de la lecture de l'en-tête de {entry.name}: {e}")
+                    duration, sample_rate, channels = None, None, None
+
+                content_hash = file_content_hash(entry.path) if with_hash else None
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (entry.name, stat.st_size, stat.st_mtime_ns, duration, sample_rate, channels, content_hash, stat.st_ctime)
+                )
+                updated += 1
+
+        # Oublier les fichiers qui ont disparu du répertoire
+        removed = [(name,) for name in known if name.lower().endswith(extensions) and name not in seen]
+        self.connection.executemany("DELETE FROM files WHERE name = ?", removed)
+        self.connection.commit()
+
+        return updated
+
+    def get(self, name):
+        return self.connection.execute("SELECT * FROM files WHERE name = ?", (name,)).fetchone()
+
+    def files(self, min_duration=None, max_duration=None, created_after=None, created_before=None, extensions=None):
+        """
+        Fichiers indexés, filtrés par durée (secondes) et date de création (datetime).
+        """
+        query = "SELECT * FROM files WHERE 1 = 1"
+        params = []
+        if min_duration is not None:
+            query += " AND duration >= ?"
+            params.append(min_duration)
+        if max_duration is not None:
+            query += " AND duration < ?"
+            params.append(max_duration)
+        if created_after is not None:
+            query += " AND created_at >= ?"
+            params.append(created_after.timestamp())
+        if created_before is not None:
+            query += " AND created_at <= ?"
+            params.append(created_before.timestamp())
+        query += " ORDER BY name"
+
+        rows = self.connection.execute(query, params).fetchall()
+        if extensions is not None:
+            rows = [row for row in rows if row["name"].lower().endswith(extensions)]
+        return rows
+
+    def remove(self, name):
+        self.connection.execute("DELETE FROM files WHERE name = ?", (name,))
+        self.connection.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description='Indexer les fichiers audio d\'un répertoire.')
+    parser.add_argument('directory', type=str, help='Répertoire à indexer')
+    parser.add_argument('--no_hash', action='store_true', help='Ne pas calculer le hash du contenu')
+
+    args = parser.parse_args()
+
+    with AudioIndex(args.directory) as index:
+        start = datetime.now()
+        updated = index.scan(with_hash=not args.no_hash)
+        total = len(index.files())
+        print(f"{total} fichiers indexés, {updated} (ré)analysés en {(datetime.now() - start).total_seconds():.2f} s")
+
+if __name__ == "__main__":
+    main()
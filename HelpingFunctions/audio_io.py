@@ -0,0 +1,300 @@
+import argparse
+import os
+import subprocess
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import soundfile as sf
+from pydub import AudioSegment
+from pydub.utils import get_encoder_name
+
+SAMPLE_RATE = 16000
+
+# Formats d'écriture : WAV (par défaut), FLAC sans perte, Opus pour la copie servie sur le web
+CODECS = ("wav", "flac", "opus")
+# Copie web : parole en mono, 32 kb/s
+OPUS_BITRATE = "32k"
+
+# Formats acceptés en lecture par toutes les étapes
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.opus', '.ogg', '.m4a', '.aac')
+
+# Type d'échantillon libsndfile selon la largeur en octets
+_SUBTYPES = {2: "PCM_16", 3: "PCM_24", 4: "PCM_32"}
+# Le FLAC s'arrête à 24 bits : libsndfile garde les 24 bits de poids fort des entiers 32 bits
+_FLAC_SUBTYPES = {**_SUBTYPES, 4: "PCM_24"}
+
+
+def load_waveform(audio_path, sample_rate=SAMPLE_RATE):
+    """
+    Décode un fichier une seule fois en mono 16 bits à sample_rate, sans rien réécrire sur disque.
+
+    :return: Échantillons int16 (tableau NumPy 1D) et fréquence d'échantillonnage.
+    """
+    audio = AudioSegment.from_file(audio_path)
+    audio = audio.set_channels(1).set_frame_rate(sample_rate).set_sample_width(2)
+    return np.frombuffer(audio.raw_data, dtype='<i2'), sample_rate
+
+def to_pyannote_input(samples, sample_rate):
+    """
+    Entrée en mémoire pour un pipeline pyannote : {"waveform": (canal, temps), "sample_rate"}.
+    """
+    import torch
+
+    waveform = torch.from_numpy(samples.astype(np.float32) / 32768.0).unsqueeze(0)
+    return {"waveform": waveform, "sample_rate": sample_rate}
+
+def duration_ms(samples, sample_rate):
+    # Même arrondi que len(AudioSegment)
+    return round(1000 * (len(samples) / sample_rate))
+
+def slice_ms(samples, sample_rate, start_ms, end_ms):
+    """
+    Extrait [start_ms, end_ms[ comme audio[start_ms:end_ms] avec pydub, silence de fin compris.
+    """
+    length_ms = duration_ms(samples, sample_rate)
+    start = int(min(start_ms, length_ms) * sample_rate / 1000.0)
+    end = int(min(end_ms, length_ms) * sample_rate / 1000.0)
+    segment = samples[start:end]
+    missing = (end - start) - len(segment)
+    if missing > 0:
+        segment = np.concatenate([segment, np.zeros(missing, dtype=samples.dtype)])
+    return segment
+
+def with_codec(path, codec="wav"):
+    """
+    Remplace l'extension de path par celle du codec.
+    """
+    return f"{os.path.splitext(path)[0]}.{codec}"
+
+def codec_params(params, codec="wav"):
+    """
+    Ajoute le codec aux paramètres d'une étape, sauf pour le WAV : les noms et journaux existants restent valides.
+    """
+    return params if codec == "wav" else dict(params, codec=codec)
+
+def write_audio(path, samples, sample_rate, codec="wav", subtype="PCM_16"):
+    """
+    Écrit un signal (n,) ou (n, canaux) dans le codec demandé.
+
+    :param samples: Entiers (int16, ou int32 pour PCM_24/PCM_32) ou flottants dans [-1, 1].
+    """
+    if codec == "opus":
+        # libopus via ffmpeg, qui rééchantillonne si la fréquence n'est pas acceptée par Opus
+        if samples.dtype != np.int16:
+            samples = np.clip(np.rint(samples * 32768.0), -32768, 32767).astype(np.int16) if samples.dtype.kind == "f" else (samples >> 16).astype(np.int16)
+        channels = 1 if samples.ndim == 1 else samples.shape[1]
+        segment = AudioSegment(samples.tobytes(), frame_rate=sample_rate, sample_width=2, channels=channels)
+        segment.set_channels(1).export(path, format="opus", codec="libopus", bitrate=OPUS_BITRATE)
+    else:
+        sf.write(path, samples, sample_rate, format=codec.upper(), subtype=subtype)
+    return path
+
+def export_audio_segment(segment, path, codec="wav"):
+    """
+    Écrit un AudioSegment pydub dans le codec demandé (export pydub inchangé pour le WAV).
+    """
+    if codec == "wav":
+        segment.export(path, format="wav")
+    elif codec == "opus":
+        segment.set_channels(1).export(path, format="opus", codec="libopus", bitrate=OPUS_BITRATE)
+    else:
+        if segment.sample_width == 1:
+            segment = segment.set_sample_width(2)
+        data = np.frombuffer(segment.raw_data, dtype={2: '<i2', 3: np.uint8, 4: '<i4'}[segment.sample_width])
+        if segment.sample_width == 3:
+            # 24 bits : placer chaque échantillon dans les octets de poids fort d'un int32
+            padded = np.zeros((len(data) // 3, 4), dtype=np.uint8)
+            padded[:, 1:] = data.reshape(-1, 3)
+            data = padded.view('<i4').reshape(-1)
+        subtypes = _FLAC_SUBTYPES if codec == "flac" else _SUBTYPES
+        sf.write(path, data.reshape(-1, segment.channels), segment.frame_rate, format=codec.upper(), subtype=subtypes[segment.sample_width])
+    return path
+
+class AudioWriter:
+    """
+    Encode et écrit les fichiers sur un pool de threads pendant que l'appelant continue.
+
+    libsndfile et ffmpeg travaillent hors GIL : l'encodage FLAC/Opus se répartit
+    réellement sur les cœurs. Au-delà de max_pending écritures en attente,
+    submit attend la plus ancienne, ce qui borne la mémoire retenue.
+    """
+
+    def __init__(self, workers=4, max_pending=None):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.max_pending = max_pending or 4 * max(1, workers)
+        self.pending = deque()
+        self.written = []
+
+    def submit(self, func, *args):
+        while len(self.pending) >= self.max_pending:
+            self.written.append(self.pending.popleft().result())
+        future = self.executor.submit(func, *args)
+        self.pending.append(future)
+        return future
+
+    def write(self, path, samples, sample_rate, codec="wav", subtype="PCM_16"):
+        return self.submit(write_audio, path, samples, sample_rate, codec, subtype)
+
+    def export(self, segment, path, codec="wav"):
+        return self.submit(export_audio_segment, segment, path, codec)
+
+    def close(self):
+        """
+        Attend toutes les écritures ; une erreur d'écriture est relevée ici.
+
+        :return: Chemins écrits, dans l'ordre des soumissions.
+        """
+        try:
+            while self.pending:
+                self.written.append(self.pending.popleft().result())
+        finally:
+            self.executor.shutdown(wait=True)
+        return self.written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+def export_segments(samples, sample_rate, segments, workers=4, codec="wav"):
+    """
+    Écrit des extraits d'un même signal en parallèle.
+
+    :param segments: Liste de (chemin, début en ms, fin en ms).
+    :return: Chemins écrits, dans l'ordre de segments.
+    """
+    for path, _, _ in segments:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    # Les extraits sont des vues du tableau : seul l'encodage et l'écriture (hors GIL) sont répartis sur les threads
+    with AudioWriter(workers, max_pending=len(segments) or None) as writer:
+        for path, start_ms, end_ms in segments:
+            writer.write(path, slice_ms(samples, sample_rate, start_ms, end_ms), sample_rate, codec)
+    return writer.written
+
+def read_float_blocks(audio_path, sample_rate, channels, block_frames):
+    """
+    Décode un fichier avec ffmpeg en float32 à sample_rate et channels canaux, par blocs de block_frames trames.
+
+    Seul le bloc courant est en mémoire, quelle que soit la durée du fichier.
+    Un échec de ffmpeg (fichier absent, corrompu, tronqué) ou un flux vide lève
+    RuntimeError après le dernier bloc : l'appelant ne doit rien enregistrer
+    comme terminé avant d'avoir épuisé le générateur.
+
+    :return: Générateur de tableaux float32 (trames, canaux).
+    """
+    command = [get_encoder_name(), '-v', 'error', '-i', audio_path,
+               '-f', 'f32le', '-ar', str(sample_rate), '-ac', str(channels), '-']
+    # Erreurs dans un fichier temporaire : un tube stderr plein bloquerait ffmpeg pendant qu'on lit stdout
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors)
+        frame_bytes = 4 * channels
+        frames = 0
+        try:
+            pending = b""
+            while True:
+                data = process.stdout.read(block_frames * frame_bytes - len(pending))
+                if not data:
+                    break
+                pending += data
+                # Ne rendre que des blocs complets, sauf le dernier
+                if len(pending) == block_frames * frame_bytes:
+                    frames += block_frames
+                    yield np.frombuffer(pending, dtype='<f4').reshape(-1, channels)
+                    pending = b""
+            usable = len(pending) - len(pending) % frame_bytes
+            if usable:
+                frames += usable // frame_bytes
+                yield np.frombuffer(pending[:usable], dtype='<f4').reshape(-1, channels)
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+
+        # Atteint seulement si tout le flux a été lu (pas après un arrêt anticipé de l'appelant)
+        if returncode != 0 or not frames:
+            errors.seek(0)
+            message = errors.read().decode("utf-8", errors="replace").strip()
+            reason = f"code {returncode}" if returncode != 0 else "aucune trame décodée"
+            raise RuntimeError(f"ffmpeg n'a pas pu décoder {audio_path} ({reason}){' : ' + message if message else ''}")
+
+class AudioStreamWriter:
+    """
+    Écrit un fichier bloc par bloc (WAV/FLAC avec libsndfile, Opus avec ffmpeg), sans garder le signal en mémoire.
+    """
+
+    def __init__(self, path, sample_rate, channels, codec="wav"):
+        self.path = path
+        self.process = None
+        self.file = None
+        if codec == "opus":
+            command = [get_encoder_name(), '-v', 'error', '-y', '-f', 'f32le', '-ar', str(sample_rate), '-ac', str(channels),
+                       '-i', '-', '-ac', '1', '-c:a', 'libopus', '-b:a', OPUS_BITRATE, path]
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        else:
+            self.file = sf.SoundFile(path, "w", sample_rate, channels, subtype="PCM_16", format=codec.upper())
+
+    def write(self, frames):
+        # Écrêtage explicite : le signal ne peut pas être renormalisé globalement en flux
+        frames = np.clip(frames, -1.0, 1.0).astype(np.float32)
+        if self.process is not None:
+            self.process.stdin.write(frames.astype('<f4').tobytes())
+        else:
+            self.file.write(frames)
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            if self.process.wait() != 0:
+                raise RuntimeError(f"ffmpeg n'a pas pu écrire {self.path}")
+        else:
+            self.file.close()
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+            return
+        # Écriture interrompue : ne pas laisser un fichier tronqué qui passerait pour une sortie
+        try:
+            self.close()
+        except Exception:
+            pass
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def transcode_directory(input_dir, output_dir, codec="opus", workers=4):
+    """
+    Copie les fichiers audio d'un répertoire dans un autre codec (par exemple la copie Opus servie sur le web).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    names = sorted(f for f in os.listdir(input_dir) if f.lower().endswith(AUDIO_EXTENSIONS))
+    with AudioWriter(workers) as writer:
+        for name in names:
+            output_path = os.path.join(output_dir, with_codec(name, codec))
+            if not os.path.exists(output_path):
+                writer.submit(lambda source, target: export_audio_segment(AudioSegment.from_file(source), target, codec), os.path.join(input_dir, name), output_path)
+    return writer.written
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcode a directory of audio files (e.g. an Opus copy for web serving).')
+    parser.add_argument('input_dir', type=str, help='Directory containing the audio files')
+    parser.add_argument('output_dir', type=str, help='Directory for the transcoded files')
+    parser.add_argument('--codec', type=str, choices=CODECS, default="opus", help='Output codec')
+    parser.add_argument('--workers', type=int, default=4, help='Number of encoding threads')
+
+    args = parser.parse_args()
+
+    written = transcode_directory(args.input_dir, args.output_dir, args.codec, args.workers)
+    print(f"✅ {len(written)} fichiers écrits dans {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,19 @@
 import os
 import json
 import logging
+import shutil
 import torch
 import filetype
 import argparse
 
 from tqdm import tqdm
 
-from pydub import AudioSegment
+from audio_io import AUDIO_EXTENSIONS, CODECS, export_segments, load_waveform, to_pyannote_input
+from diarization_cache import CACHE_DIR, CACHE_MAX_MB, DiarizationCache
+from fingerprint_index import FingerprintIndex
+from instrumentation import Metrics, add_metrics_arguments
 
+import pyannote.audio
 from pyannote.audio import Pipeline
 from pyannote.audio.pipelines.utils.hook import ProgressHook
 
@@ -44,47 +49,33 @@ def detect_file_type(file_path):
 
     return file_extension, file_type
 
-def extract_audio(file_path, file_extension, file_type):
-    extraction_status = {'extraction_audio_status': 'extraction_audio_ongoing', 'message': 'Extraction audio en cours ...'}
-    logging.info(extraction_status)
-
-    if file_extension in ['.mp3', '.wav', '.aac', '.ogg', '.flac', '.m4a']:
-        logging.info(f"fichier audio détecté: {file_extension}.")
-        audio = AudioSegment.from_file(file_path)
-    else:
-        raise ValueError("Format de fichier non supporté.")
-
-    return audio
-
-def diarize_audio(audio_path, diarization_model, output_dir):
+def diarize_audio(audio_path, diarization_model, output_dir, export_workers=4, metrics=None, codec="wav"):
+    metrics = metrics or Metrics("batch_diarization")
     logging.info(f"Démarrage de la diarisation du fichier {audio_path}")
     file_name = os.path.basename(audio_path)
 
-    audio = AudioSegment.from_file(audio_path)
-
-    audio = audio.set_channels(1)
-    audio = audio.set_frame_rate(16000)
-
-    audio.export(audio_path, format="wav")
+    # Un seul décodage (mono, 16 kHz), gardé en mémoire : le fichier source n'est jamais réécrit
+    with metrics.stage("decode", audio_path) as record:
+        samples, sample_rate = load_waveform(audio_path)
+        record["audio_seconds"] = audio_seconds = len(samples) / sample_rate
 
     # Étape 1 : Diarisation
-    with ProgressHook() as hook:
+    with ProgressHook() as hook, metrics.stage("diarize", audio_path, audio_seconds):
         logging.debug(f"Diarization démarrée")
-        diarization = diarization_model(audio_path, hook=hook)
+        diarization = diarization_model(to_pyannote_input(samples, sample_rate), hook=hook)
         logging.debug(f"Diarization terminée {diarization}")
 
     segments = []
+    exports = []
 
     for turn, _, speaker in diarization.itertracks(yield_label=True):
 
         start_ms = int(turn.start * 1000)  # Convertir de secondes en millisecondes
         end_ms = int(turn.end * 1000)
 
-        # Extraire le segment audio correspondant au speaker
-        segment_audio = audio[start_ms:end_ms]
-
-        segment_path = f"{output_dir}/{file_name}_segment_{start_ms}_{end_ms}.wav"
-        segment_audio.export(segment_path, format="wav")
+        # Le segment audio correspondant au speaker est écrit plus bas, en parallèle
+        segment_path = f"{output_dir}/{file_name}_segment_{start_ms}_{end_ms}.{codec}"
+        exports.append((segment_path, start_ms, end_ms))
 
         segments.append({
             "speaker": speaker,
@@ -92,19 +83,63 @@ def diarize_audio(audio_path, diarization_model, output_dir):
             "end_time": turn.end,
             "file": segment_path
         })
-        logging.info("Diarization terminée.")
+
+    with metrics.stage("export", audio_path, audio_seconds):
+        export_segments(samples, sample_rate, exports, workers=export_workers, codec=codec)
+    logging.info("Diarization terminée.")
 
     logging.info(f"segments: {segments}")
 
     return {"segments": segments}
 
-def process_audio_files(input_dir, output_dir):
-    diarization_model = load_pipeline_diarization("pyannote/speaker-diarization-3.1")
+def link_duplicate_segments(file_name, source_name, output_dir, codec="wav"):
+    """
+    Reprend les segments d'un enregistrement déjà diarisé pour son quasi-doublon, par liens physiques (copie à défaut).
+
+    :return: Nombre de segments repris (0 si source_name n'a pas encore de segments).
+    """
+    prefix = f"{source_name}_segment_"
+    linked = 0
+    for segment_name in sorted(os.listdir(output_dir)):
+        if not segment_name.startswith(prefix) or not segment_name.endswith(f".{codec}"):
+            continue
+        target = os.path.join(output_dir, f"{file_name}_segment_{segment_name[len(prefix):]}")
+        if not os.path.exists(target):
+            try:
+                os.link(os.path.join(output_dir, segment_name), target)
+            except OSError:
+                shutil.copyfile(os.path.join(output_dir, segment_name), target)
+        linked += 1
+    return linked
+
+def process_audio_files(input_dir, output_dir, cache_dir=None, cache_max_mb=CACHE_MAX_MB, clustering_threshold=None, metrics=None, codec="wav", dedup=False):
+    metrics = metrics or Metrics("batch_diarization")
+    model_name = "pyannote/speaker-diarization-3.1"
+    with metrics.stage("model_load"):
+        diarization_model = load_pipeline_diarization(model_name)
+
+    if clustering_threshold is not None:
+        # Seul le clustering change : segmentation et embeddings restent valides dans le cache
+        params = diarization_model.parameters(instantiated=True)
+        params["clustering"]["threshold"] = clustering_threshold
+        diarization_model.instantiate(params)
+
+    cache = None
+    if cache_dir:
+        cache = DiarizationCache(cache_dir, cache_max_mb * 1024 * 1024, model_version=f"{model_name}|pyannote.audio {pyannote.audio.__version__}")
+        cache.attach(diarization_model)
 
     # Créer le répertoire de sortie s'il n'existe pas
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
+    # Quasi-doublons d'enregistrements déjà diarisés : segments repris au lieu de relancer pyannote
+    fingerprints = None
+    if dedup:
+        with metrics.stage("fingerprint"):
+            fingerprints = FingerprintIndex(input_dir)
+            fingerprints.scan()
+
     # Parcourir tous les fichiers du répertoire d'entrée
     for file_name in tqdm(os.listdir(input_dir)):
         file_path = os.path.join(input_dir, file_name)
@@ -114,20 +149,41 @@ def process_audio_files(input_dir, output_dir):
             file_extension, file_type = detect_file_type(file_path)
 
             # Vérifier si c'est un fichier audio
-            if file_extension in ['.mp3', '.wav', '.aac', '.ogg', '.flac', '.m4a']:
+            if file_extension in AUDIO_EXTENSIONS:
+                if fingerprints is not None:
+                    sources = [name for name in fingerprints.group(file_name) if name != file_name]
+                    linked = next((count for count in (link_duplicate_segments(file_name, name, output_dir, codec) for name in sources) if count), 0)
+                    if linked:
+                        logging.info(f"{file_name} : quasi-doublon déjà diarisé, {linked} segments repris")
+                        continue
                 try:
-                    audio = extract_audio(file_path, file_extension, file_type)
-                    diarize_audio(file_path, diarization_model, output_dir)
+                    diarize_audio(file_path, diarization_model, output_dir, metrics=metrics, codec=codec)
                 except Exception as e:
                     logging.error(f"Erreur lors du traitement du fichier {file_name}: {e}")
 
-def main(input_dir, output_dir):
-    process_audio_files(input_dir, output_dir)
+    if fingerprints is not None:
+        fingerprints.close()
+
+    if cache is not None:
+        logging.info(f"Cache de diarisation : {cache.hits} réutilisations, {cache.misses} calculs")
+
+    metrics.close()
+
+def main(input_dir, output_dir, cache_dir=None, cache_max_mb=CACHE_MAX_MB, clustering_threshold=None, metrics=None, codec="wav", dedup=False):
+    process_audio_files(input_dir, output_dir, cache_dir, cache_max_mb, clustering_threshold, metrics, codec, dedup)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process all audio files in a directory for audio extraction and diarization.")
     parser.add_argument("input_dir", type=str, help="Directory containing the audio files to process")
     parser.add_argument("output_dir", type=str, help="Directory to save the output audio files")
+    parser.add_argument("--cache_dir", type=str, default=None, help=f"Directory of the segmentation/embedding cache (default: <output_dir>/{CACHE_DIR})")
+    parser.add_argument("--cache_max_mb", type=int, default=CACHE_MAX_MB, help="Maximum size of the cache in MB (least recently used entries are evicted)")
+    parser.add_argument("--no_cache", action="store_true", help="Recompute segmentation and embeddings for every file")
+    parser.add_argument("--clustering_threshold", type=float, default=None, help="Override the clustering threshold of the pretrained pipeline")
+    parser.add_argument("--codec", type=str, choices=CODECS, default="wav", help="Output codec of the speaker segments")
+    parser.add_argument("--dedup", action="store_true", help="Link the segments of an already diarized near-duplicate recording instead of diarizing it again")
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    main(args.input_dir, args.output_dir)
+    cache_dir = None if args.no_cache else (args.cache_dir or os.path.join(args.output_dir, CACHE_DIR))
+    main(args.input_dir, args.output_dir, cache_dir, args.cache_max_mb, args.clustering_threshold, Metrics("batch_diarization", args.metrics, args.prom_file), args.codec, args.dedup)
@@ -1,64 +1,87 @@
 import argparse
 import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-from pydub import AudioSegment, silence
-import numpy as np
-import hashlib
-import random
-import string
 from tqdm import tqdm
 
+from SplitOnSilence import split_audio_on_silence, split_audio_on_silence_streaming
+from instrumentation import Metrics, add_metrics_arguments, audio_duration, measure
+from audio_io import AUDIO_EXTENSIONS, CODECS
+from run_manifest import RunManifest
+
+# Journal de l'étape, chargé une fois par processus du pool
+_manifest = None
+
+
+def _init_worker(output_dir):
+    global _manifest
+    _manifest = RunManifest(output_dir, "split")
+
+def _split_file(audio_path, output_dir, silence_thresh, min_silence_len, max_segment_duration, min_segment_duration, stream, block_ms, codec, encode_workers, manifest=None):
+    # Exécuté dans un processus du pool : chaque fichier est isolé, une erreur n'arrête pas les autres.
+    # La mesure est renvoyée au processus principal, qui l'enregistre.
+    # Le journal est partagé par tous les fichiers (celui du processus dans le pool) : il n'est relu qu'une fois.
+    manifest = manifest or _manifest
+    record = None
+    try:
+        with measure("split", audio_path, audio_duration(audio_path)) as record:
+            if stream:
+                outputs = split_audio_on_silence_streaming(audio_path, output_dir, silence_thresh, min_silence_len, max_segment_duration, min_segment_duration, block_ms, manifest=manifest, codec=codec, encode_workers=encode_workers)
+            else:
+                outputs = split_audio_on_silence(audio_path, output_dir, silence_thresh, min_silence_len, max_segment_duration, min_segment_duration, manifest=manifest, codec=codec, encode_workers=encode_workers)
+            record["outputs"] = None if outputs is None else len(outputs)
+        return outputs, None, record
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}", record
+
+def process_directory(input_dir, output_dir, silence_thresh=-40, min_silence_len=500, max_segment_duration=10000, min_segment_duration=1000, stream=False, block_ms=10000, workers=1, metrics=None, codec="wav", encode_workers=4):
+    metrics = metrics or Metrics("batch_splitonsilence")
 
-def generate_random_hash(length=8):
-    # Générer une chaîne aléatoire de caractères
-    random_string = ''.join(random.choices(string.ascii_letters + string.digits, k=length))
-    # Créer un hash SHA-256 de la chaîne aléatoire
-    hash_object = hashlib.sha256(random_string.encode())
-    # Retourner les premiers 8 caractères du hash
-    return hash_object.hexdigest()[:length]
-
-def split_audio_on_silence(audio_path, output_path, silence_thresh=-40, min_silence_len=500, max_segment_duration=10000, min_segment_duration=1000):
-    # Charger le fichier audio
-    audio = AudioSegment.from_file(audio_path)
-
-    # Détecter les silences
-    silent_ranges = silence.detect_silence(audio, min_silence_len=min_silence_len, silence_thresh=silence_thresh)
-
-    # Diviser l'audio en fonction des silences
-    chunks = []
-    start = 0
-    for start_silence, end_silence in silent_ranges:
-        chunk = audio[start:start_silence]
-        if len(chunk) > 0:
-            # Diviser le morceau en segments de max_segment_duration
-            for i in range(0, len(chunk), max_segment_duration):
-                segment = chunk[i:i+max_segment_duration]
-                if len(segment) >= min_segment_duration:
-                    chunks.append(segment)
-        start = end_silence
-    # Ajouter le dernier morceau
-    last_chunk = audio[start:]
-    if len(last_chunk) > 0:
-        for i in range(0, len(last_chunk), max_segment_duration):
-            segment = last_chunk[i:i+max_segment_duration]
-            if len(segment) >= min_segment_duration:
-                chunks.append(segment)
-
-    # Sauvegarder chaque segment avec un nom de fichier aléatoire
-    for i, chunk in enumerate(chunks):
-        random_hash = generate_random_hash()
-        chunk.export(f"{output_path}/segment_{random_hash}.wav", format="wav")
-
-def process_directory(input_dir, output_dir, silence_thresh=-40, min_silence_len=500, max_segment_duration=10000, min_segment_duration=1000):
     # Créer le répertoire de sortie s'il n'existe pas
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # Parcourir tous les fichiers dans le répertoire d'entrée
-    for file_name in tqdm(os.listdir(input_dir)):
-        if filename.endswith(".wav") or filename.endswith(".mp3"):  # Ajoutez d'autres extensions si nécessaire
-            audio_path = os.path.join(input_dir, filename)
-            split_audio_on_silence(audio_path, output_dir, silence_thresh, min_silence_len, max_segment_duration, min_segment_duration)
+    # Parcourir tous les fichiers dans le répertoire d'entrée, dans un ordre stable
+    file_names = sorted(f for f in os.listdir(input_dir) if f.lower().endswith(AUDIO_EXTENSIONS))
+    audio_paths = [os.path.join(input_dir, file_name) for file_name in file_names]
+    split_args = (output_dir, silence_thresh, min_silence_len, max_segment_duration, min_segment_duration, stream, block_ms, codec, encode_workers)
+
+    if workers <= 1:
+        manifest = RunManifest(output_dir, "split")
+        results = (_split_file(audio_path, *split_args, manifest) for audio_path in audio_paths)
+        _report(file_names, results, metrics)
+        return
+
+    # Répartir les fichiers sur plusieurs cœurs ; les résultats sont rapportés dans l'ordre des fichiers
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(output_dir,)) as executor:
+        futures = [executor.submit(_split_file, audio_path, *split_args) for audio_path in audio_paths]
+        _report(file_names, _pool_results(futures), metrics)
+
+def _pool_results(futures):
+    # Un processus tué (mémoire, signal) casse le pool : ses fichiers et ceux encore en attente sont
+    # rapportés en erreur, sans empêcher le rapport des fichiers déjà terminés
+    for future in futures:
+        try:
+            yield future.result()
+        except BrokenProcessPool as e:
+            yield None, f"{type(e).__name__}: {e}", None
+
+def _report(file_names, results, metrics):
+    errors = 0
+    progress = tqdm(zip(file_names, results), total=len(file_names))
+    for file_name, (outputs, error, record) in progress:
+        if record is not None:
+            metrics.add(record)
+        if error is not None:
+            errors += 1
+            tqdm.write(f"❌ {file_name} : {error}")
+        elif outputs is None:
+            tqdm.write(f"⏭️ {file_name} : déjà découpé")
+        else:
+            tqdm.write(f"✅ {file_name} : {len(outputs)} segments")
+        progress.set_postfix(errors=errors)
+    metrics.close()
 
 def main():
     parser = argparse.ArgumentParser(description='Split audio on silence.')
@@ -68,6 +91,12 @@ def main():
     parser.add_argument('--min_silence_len', type=int, default=500, help='Minimum silence length in ms')
     parser.add_argument('--max_segment_duration', type=int, default=10000, help='Maximum segment duration in ms')
     parser.add_argument('--min_segment_duration', type=int, default=1000, help='Minimum segment duration in ms')
+    parser.add_argument('--stream', action='store_true', help='Read the audio in blocks with constant memory (long recordings)')
+    parser.add_argument('--block_ms', type=int, default=10000, help='Block size in ms for --stream')
+    parser.add_argument('--codec', type=str, choices=CODECS, default="wav", help='Output codec of the segments (flac: lossless, opus: web serving)')
+    parser.add_argument('--encode_workers', type=int, default=4, help='Number of threads encoding segments')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes splitting files in parallel')
+    add_metrics_arguments(parser)
 
     args = parser.parse_args()
 
@@ -77,7 +106,13 @@ def main():
         args.silence_thresh,
         args.min_silence_len,
         args.max_segment_duration,
-        args.min_segment_duration
+        args.min_segment_duration,
+        args.stream,
+        args.block_ms,
+        args.workers,
+        Metrics("batch_splitonsilence", args.metrics, args.prom_file),
+        args.codec,
+        args.encode_workers
     )
 
 if __name__ == "__main__":
@@ -1,67 +1,230 @@
-import whisper
 import os
-import json
 from datetime import datetime, time
 from tqdm import tqdm
 import argparse
-import torch
 
-# Vérifie si CUDA est disponible
-device = "cuda" if torch.cuda.is_available() else "cpu"
-
-# Affiche le device sélectionné
-print(f"Using device: {device}")
+from audio_index import AUDIO_EXTENSIONS, AudioIndex
+from run_manifest import file_content_hash
+from transcription_store import TranscriptionStore
+from instrumentation import Metrics, add_metrics_arguments
+from transcription_cache import add_cache_arguments, cache_from_args, transcription_params
+from whisper_model import DEFAULT_MODEL, add_model_arguments, load_whisper_model, resolve_precision, set_threads
+from whisper_cascade import COMPRESSION_RATIO_THRESHOLD, LOGPROB_THRESHOLD, NO_SPEECH_THRESHOLD
 
 OUTPUT_FILE = "transcription_batch.json"
+STORE_FILE = "transcription_batch.jsonl"
+
+def save_transcription(store, filename, result, model_name):
+    entry = {
+        "name": filename,
+        "transcription": result["text"],
+        # Modèle qui a réellement produit le texte (utile en mode cascade)
+        "author": f"whisper-{result.get('model', model_name)}",
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+    # Sauvegarder immédiatement après chaque transcription (une ligne ajoutée)
+    store.append(entry)
+
+    print(f"✅ Fichier traité : {filename}")
+    print(f"📄 Transcription : {entry['transcription']}\n")
+
+def reuse_transcriptions(store, reuse):
+    """
+    Enregistre pour chaque quasi-doublon la transcription du clip dont il est la copie.
+
+    :param reuse: dict nom du doublon -> nom du clip déjà transcrit.
+    """
+    latest = {entry["name"]: entry for entry in store.latest()}
+    for filename, source in reuse.items():
+        entry = latest.get(source)
+        if entry is None:
+            # La transcription de l'original a échoué dans ce passage : le doublon sera repris au prochain
+            print(f"⚠️ {filename} : {source} n'a pas de transcription à reprendre")
+            continue
+        store.append(dict(entry, name=filename, timestamp=datetime.utcnow().isoformat(), duplicate_of=source))
+        print(f"🔗 {filename} : transcription reprise de {source}")
 
-model = whisper.load_model("large-v3")
+def cache_params(model_name, precision, device=None, pack=False, cascade=None, thresholds=None):
+    """
+    Paramètres qui indexent les résultats de ce passage dans le cache de transcription.
 
-def main(audio_dir, start_datetime=None, end_datetime=None):
+    Les modes fichier par fichier, par lots et pipeline produisent le même
+    texte et partagent donc leurs entrées ; le regroupement par fenêtres et la
+    cascade ont les leurs.
+    """
+    options = {}
+    if pack:
+        from packed_transcribe import GAP_SECONDS, WINDOW_SECONDS
+        options["packed"] = [WINDOW_SECONDS, GAP_SECONDS]
+    if cascade:
+        options["cascade"] = [cascade, *(thresholds or (LOGPROB_THRESHOLD, COMPRESSION_RATIO_THRESHOLD, NO_SPEECH_THRESHOLD))]
+    return transcription_params(model_name, resolve_precision(device, precision)[1], "ht", **options)
+
+def load_database(store, database_url=None):
+    from bulk_load import bulk_load
+
+    # COPY dans une table temporaire puis un seul INSERT ... ON CONFLICT, au lieu d'une requête par ligne
+    sent, inserted = bulk_load(store.latest(), database_url)
+    print(f"📦 {sent} transcriptions envoyées en base, {inserted} insérées")
+
+def main(audio_dir, start_datetime=None, end_datetime=None, *, batch_size=1, model_name=DEFAULT_MODEL, device=None, precision=None, pipeline=False, decode_workers=2, prefetch=8, metrics=None, load_db=False, database_url=None, pack=False, cascade=None, thresholds=None, dedup=False, cache=None):
+    metrics = metrics or Metrics("batch_transcribe")
     try:
-        # Charger les transcriptions existantes si elles existent
-        if os.path.exists(OUTPUT_FILE):
-            with open(OUTPUT_FILE, "r", encoding="utf-8") as f:
-                results = json.load(f)
-        else:
-            results = []
+        # Charger les transcriptions existantes (JSONL en ajout seul, avec l'index des fichiers déjà traités)
+        store = TranscriptionStore(STORE_FILE, legacy_json=OUTPUT_FILE)
+
+        # Dates de création lues dans l'index du répertoire plutôt qu'un stat par fichier
+        with AudioIndex(audio_dir) as index:
+            index.scan()
+            if start_datetime is None or end_datetime is None:
+                candidates = index.files(extensions=AUDIO_EXTENSIONS)
+            else:
+                candidates = index.files(created_after=start_datetime, created_before=end_datetime, extensions=AUDIO_EXTENSIONS)
 
-        # Conserver une liste des fichiers déjà traités
-        existing = {entry["name"] for entry in results}
+        pending = [entry["name"] for entry in candidates if entry["name"] not in store]
+        durations = {entry["name"]: entry["duration"] for entry in candidates}
+        hashes = {entry["name"]: entry["content_hash"] for entry in candidates}
 
-        for filename in tqdm(os.listdir(audio_dir)):
-            if (filename.endswith(".wav") or filename.endswith(".mp3")) and filename not in existing:
+        # Quasi-doublons d'un clip déjà transcrit (ou d'un autre clip de ce passage) : transcription reprise, pas recalculée
+        reuse = {}
+        if dedup and pending:
+            from fingerprint_index import FingerprintIndex, plan_reuse
+
+            with metrics.stage("fingerprint"), FingerprintIndex(audio_dir) as fingerprints:
+                fingerprints.scan()
+                pending, reuse = plan_reuse(fingerprints, pending, store)
+            print(f"🔗 {len(reuse)} quasi-doublons, {len(pending)} clips distincts")
+
+        # Contenu déjà transcrit avec les mêmes paramètres (autre nom, autre répertoire, passage précédent)
+        cached = 0
+        copies = []
+        if cache is not None and pending:
+            params = cache_params(model_name, precision, device, pack, cascade, thresholds)
+            misses = {}
+            for filename in pending:
+                if hashes.get(filename) is None:
+                    hashes[filename] = file_content_hash(os.path.join(audio_dir, filename))
+                result = cache.get(hashes[filename], params)
+                if result is not None:
+                    save_transcription(store, filename, result, model_name)
+                    cached += 1
+                elif hashes[filename] in misses:
+                    # Même contenu qu'un autre clip de ce passage : repris du cache une fois celui-ci transcrit
+                    copies.append(filename)
+                else:
+                    misses[hashes[filename]] = filename
+            pending = list(misses.values())
+            print(f"💾 {cached} transcriptions reprises du cache, {len(copies)} copies exactes en attente")
+
+        def save(filename, result):
+            save_transcription(store, filename, result, model_name)
+            if cache is not None:
+                cache.put(hashes[filename], params, result)
+
+        # Rien à transcrire : inutile de charger le modèle
+        if not pending:
+            print("✅ Aucun nouveau fichier à transcrire.")
+            if reuse:
+                reuse_transcriptions(store, reuse)
+            if reuse or cached:
+                store.export_json(OUTPUT_FILE)
+            if load_db:
+                load_database(store, database_url)
+            return
+
+        print(f"🔊 {len(pending)} fichiers à transcrire")
+        with metrics.stage("model_load"):
+            # En mode cascade, seul le petit modèle est chargé d'avance
+            model, fp16 = load_whisper_model(cascade or model_name, device, precision)
+
+        if cascade:
+            from whisper_cascade import CascadeTranscriber
+
+            # Petit modèle d'abord, model_name seulement pour les clips douteux
+            transcriber = CascadeTranscriber(model, cascade, fp16, model_name, device, precision, "ht", *(thresholds or ()), metrics=metrics)
+            for filename in tqdm(pending):
                 filepath = os.path.join(audio_dir, filename)
-                file_creation_time = os.path.getctime(filepath)
-                file_creation_datetime = datetime.fromtimestamp(file_creation_time)
+                try:
+                    result = transcriber.transcribe(filepath, durations.get(filename), filepath)
+                    if "escalated" in result:
+                        print(f"🔁 {filename} relancé avec {model_name} ({result['escalated']})")
+                    save(filename, result)
+                except Exception as e:
+                    print(f"❌ Erreur pour {filename} : {e}")
+            print(transcriber.summary())
+        elif pack:
+            from packed_transcribe import PackedTranscriber
 
-                if start_datetime is None or end_datetime is None or (start_datetime <= file_creation_datetime <= end_datetime):
-                    print(f"🔊 Transcription de : {filename}")
-                    try:
-                        result = model.transcribe(filepath, language="ht")
+            # Plusieurs clips courts séparés par des silences dans une seule fenêtre de 30 s
+            transcriber = PackedTranscriber(model, language="ht", fp16=fp16)
+            filepaths = [os.path.join(audio_dir, filename) for filename in pending]
+            progress = tqdm(transcriber.transcribe_paths(filepaths, metrics, decode_workers), total=len(filepaths))
+            for filepath, result, error in progress:
+                filename = os.path.basename(filepath)
+                if error is not None:
+                    print(f"❌ Erreur pour {filename} : {error}")
+                else:
+                    save(filename, result)
+        elif pipeline:
+            from transcription_pipeline import TranscriptionPipeline
+            from whisper_batch import BatchedTranscriber
 
-                        entry = {
-                            "name": filename,
-                            "transcription": result["text"],
-                            "author": "whisper-large-v3",
-                            "timestamp": datetime.utcnow().isoformat()
-                        }
+            def on_result(filepath, result, error):
+                filename = os.path.basename(filepath)
+                if error is not None:
+                    print(f"❌ Erreur pour {filename} : {error}")
+                else:
+                    save(filename, result)
 
-                        results.append(entry)
+            # Décodage et log-mel en avance dans des threads, écriture dans un thread séparé
+            transcriber = BatchedTranscriber(model, language="ht", fp16=fp16)
+            filepaths = [os.path.join(audio_dir, filename) for filename in pending]
+            stats = TranscriptionPipeline(transcriber, batch_size, decode_workers, prefetch, metrics).run(filepaths, on_result)
+            print(f"⏱️ {stats['files']} fichiers en {stats['elapsed']:.1f} s, modèle en attente {stats['model_idle']:.1f} s")
+        elif batch_size > 1:
+            from whisper_batch import BatchedTranscriber
 
-                        # Sauvegarder immédiatement après chaque transcription
-                        with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-                            json.dump(results, f, ensure_ascii=False, indent=2)
+            # Plusieurs clips par passage de l'encodeur, texte identique au chemin fichier par fichier
+            transcriber = BatchedTranscriber(model, language="ht", fp16=fp16)
+            filepaths = [os.path.join(audio_dir, filename) for filename in pending]
+            progress = tqdm(transcriber.transcribe_paths(filepaths, batch_size, metrics), total=len(filepaths))
+            for filepath, result, error in progress:
+                filename = os.path.basename(filepath)
+                if error is not None:
+                    print(f"❌ Erreur pour {filename} : {error}")
+                else:
+                    save(filename, result)
+        else:
+            for filename in tqdm(pending):
+                filepath = os.path.join(audio_dir, filename)
+                print(f"🔊 Transcription de : {filename}")
+                try:
+                    with metrics.stage("transcribe", filepath, durations.get(filename)):
+                        result = model.transcribe(filepath, language="ht", fp16=fp16)
+                    save(filename, result)
+                except Exception as e:
+                    print(f"❌ Erreur pour {filename} : {e}")
 
-                        print(f"✅ Fichier traité : {filename}")
-                        print(f"📄 Transcription : {entry['transcription']}\n")
+        for filename in copies:
+            result = cache.get(hashes[filename], params)
+            if result is not None:
+                save_transcription(store, filename, result, model_name)
 
-                    except Exception as e:
-                        print(f"❌ Erreur pour {filename} : {e}")
+        if reuse:
+            reuse_transcriptions(store, reuse)
 
+        # Exporter le tableau JSON attendu par update-batch.cjs
+        store.export_json(OUTPUT_FILE)
         print("\n📄 Transcriptions sauvegardées dans :", OUTPUT_FILE)
 
+        if load_db:
+            load_database(store, database_url)
+
     except Exception as e:
         print(f"❌ Une erreur est survenue lors de l'exécution du script : {e}")
+    finally:
+        metrics.close()
 
 if __name__ == "__main__":
     try:
@@ -69,12 +232,50 @@ if __name__ == "__main__":
         parser.add_argument('--audio_dir', type=str, default="public/audio", help='Directory containing audio files to transcribe')
         parser.add_argument('--start_datetime', type=str, help='Start datetime of files to transcribe (YYYY-MM-DD HH:MM:SS)')
         parser.add_argument('--end_datetime', type=str, help='End datetime of files to transcribe (YYYY-MM-DD HH:MM:SS)')
+        parser.add_argument('--batch_size', '--batch-size', type=int, default=1, help='Number of clips decoded together in one encoder pass (1 = file by file)')
+        parser.add_argument('--pipeline', action='store_true', help='Decode and featurize upcoming files in background threads while the model runs')
+        parser.add_argument('--pack', action='store_true', help='Pack several short clips, separated by silence, into one 30 s window per Whisper call')
+        parser.add_argument('--decode_workers', type=int, default=2, help='Number of decoding threads in --pipeline and --pack modes')
+        parser.add_argument('--prefetch', type=int, default=8, help='Maximum number of decoded files waiting for the model in --pipeline mode')
+        parser.add_argument('--cascade', type=str, default=None, help='Transcribe with this smaller model first (e.g. small, medium) and re-run doubtful clips with --model')
+        parser.add_argument('--escalate_logprob', type=float, default=LOGPROB_THRESHOLD, help='--cascade: re-run when a segment avg_logprob is below this value')
+        parser.add_argument('--escalate_compression', type=float, default=COMPRESSION_RATIO_THRESHOLD, help='--cascade: re-run when a segment compression_ratio is above this value')
+        parser.add_argument('--escalate_no_speech', type=float, default=NO_SPEECH_THRESHOLD, help='--cascade: re-run when a segment no_speech_prob is above this value')
+        parser.add_argument('--dedup', action='store_true', help='Reuse the transcription of acoustic near-duplicates (fingerprint index) instead of transcribing them again')
+        add_model_arguments(parser)
+        add_metrics_arguments(parser)
+        add_cache_arguments(parser)
+        parser.add_argument('--load_db', action='store_true', help='Load the transcriptions into Postgres (COPY + single merge) at the end of the run')
+        parser.add_argument('--database_url', type=str, default=None, help='Postgres URL for --load_db (default: $DATABASE_URL)')
 
         args = parser.parse_args()
+        # Un seul mode de transcription par passage : les autres options seraient ignorées sans le dire
+        if args.cascade and (args.pack or args.pipeline or args.batch_size > 1):
+            parser.error("--cascade transcrit fichier par fichier : il ne se combine pas avec --pack, --pipeline ou --batch_size > 1")
+        if args.pack and (args.pipeline or args.batch_size > 1):
+            parser.error("--pack regroupe déjà les clips par fenêtre : il ne se combine pas avec --pipeline ou --batch_size > 1")
+        set_threads(args.threads, args.interop_threads)
 
         start_datetime = datetime.strptime(args.start_datetime, '%Y-%m-%d %H:%M:%S') if args.start_datetime else None
         end_datetime = datetime.strptime(args.end_datetime, '%Y-%m-%d %H:%M:%S') if args.end_datetime else None
 
-        main(args.audio_dir, start_datetime, end_datetime)
+        main(
+            args.audio_dir, start_datetime, end_datetime,
+            batch_size=args.batch_size,
+            model_name=args.model,
+            device=args.device,
+            precision=args.precision,
+            pipeline=args.pipeline,
+            decode_workers=args.decode_workers,
+            prefetch=args.prefetch,
+            metrics=Metrics("batch_transcribe", args.metrics, args.prom_file),
+            load_db=args.load_db,
+            database_url=args.database_url,
+            pack=args.pack,
+            cascade=args.cascade,
+            thresholds=(args.escalate_logprob, args.escalate_compression, args.escalate_no_speech),
+            dedup=args.dedup,
+            cache=cache_from_args(args)
+        )
     except Exception as e:
         print(f"❌ Une erreur est survenue lors de l'analyse des arguments : {e}")
@@ -1,88 +1,308 @@
 import argparse
 import os
-import hashlib
-import random
-import string
+import queue
+import threading
 from tqdm import tqdm
+import numpy as np
 from spleeter.separator import Separator
 from spleeter.audio.adapter import AudioAdapter
+from spleeter.audio.convertor import to_stereo
 import gc
-import tensorflow as tf
 import torch
 
-def generate_random_hash(length=8):
-    # Générer une chaîne aléatoire de caractères
-    random_string = ''.join(random.choices(string.ascii_letters + string.digits, k=length))
-    # Créer un hash SHA-256 de la chaîne aléatoire
-    hash_object = hashlib.sha256(random_string.encode())
-    # Retourner les premiers 8 caractères du hash
-    return hash_object.hexdigest()[:length]
+from audio_io import AUDIO_EXTENSIONS, CODECS, AudioStreamWriter, AudioWriter, codec_params, read_float_blocks, write_audio
+from chunked_separation import OVERLAP_SECONDS, ChunkedSeparator, chunk_params
+from instrumentation import Metrics, add_metrics_arguments
+from run_manifest import RunManifest, file_content_hash, generate_content_hash
 
-def extract_vocals(audio_path, output_dir):
+SAMPLE_RATE = 16000
+PARAMS_DESCRIPTOR = 'spleeter:2stems'
+# Durée des blocs décodés en flux en mode découpé
+BLOCK_SECONDS = 10
+
+def separation_params(params_descriptor=PARAMS_DESCRIPTOR, sample_rate=SAMPLE_RATE):
+    # Paramètres qui déterminent la piste vocale produite (et donc son nom)
+    return {"model": params_descriptor, "sample_rate": sample_rate}
+
+class SpleeterEngine:
+    """
+    Moteur de séparation Spleeter qui garde le modèle 2 stems chargé en mémoire.
+
+    Le modèle est chargé une seule fois à la création du moteur puis réutilisé
+    pour tous les fichiers. Les fichiers d'un même lot sont concaténés et
+    séparés en un seul appel : chaque morceau est complété par des zéros
+    jusqu'à un multiple de la taille des segments internes de Spleeter, de sorte
+    qu'un segment du lot ne contient jamais deux fichiers différents.
+
+    Avec load_model=False, le moteur ne fait que décoder et écrire en mode
+    découpé : ce sont les processus de ChunkedSeparator qui chargent le modèle.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, params_descriptor=PARAMS_DESCRIPTOR, codec="wav", chunk_seconds=None, overlap_seconds=OVERLAP_SECONDS, load_model=True):
+        self.sample_rate = sample_rate
+        self.codec = codec
+        self.chunk_seconds = chunk_seconds
+        self.overlap_seconds = overlap_seconds
+        self.params = chunk_params(codec_params(separation_params(params_descriptor, sample_rate), codec), chunk_seconds, overlap_seconds)
+        self.params_descriptor = params_descriptor
+        self.audio_loader = AudioAdapter.default()
+        self.separator = None
+        if not load_model:
+            return
+
+        # Initialiser le séparateur de sources une seule fois
+        self.separator = Separator(params_descriptor)
+        params = self.separator._params
+        self.segment_samples = params['T'] * params['frame_step']
+
+        # Préchauffer le modèle pour charger le graphe et les poids dès maintenant
+        self.separator.separate(np.zeros((self.segment_samples, 2), dtype=np.float32))
+
+    def load(self, audio_path):
+        waveform, _ = self.audio_loader.load(audio_path, sample_rate=self.sample_rate)
+        return to_stereo(waveform)
+
+    def separate_batch(self, waveforms):
+        """
+        Sépare un lot de formes d'onde en un seul passage du modèle.
+
+        :param waveforms: Liste de tableaux (n_samples, 2).
+        :return: Liste des pistes vocales, dans le même ordre que l'entrée.
+        """
+        padded = []
+        offsets = []
+        position = 0
+        for waveform in waveforms:
+            length = waveform.shape[0]
+            padded_length = -(-length // self.segment_samples) * self.segment_samples
+            padding = np.zeros((padded_length - length, waveform.shape[1]), dtype=waveform.dtype)
+            padded.extend([waveform, padding])
+            offsets.append((position, position + length))
+            position += padded_length
+
+        prediction = self.separator.separate(np.concatenate(padded, axis=0))
+        vocals = prediction['vocals']
+
+        return [vocals[start:end] for start, end in offsets]
+
+    def separate_chunk(self, chunk, context=None):
+        # Une fenêtre du mode découpé (ChunkedSeparator)
+        return self.separator.separate(chunk)['vocals']
+
+    def chunked_separator(self, workers=1):
+        """
+        ChunkedSeparator aux dimensions du moteur ; avec workers > 1, chaque processus charge son propre modèle.
+        """
+        return ChunkedSeparator(
+            int(self.chunk_seconds * self.sample_rate),
+            int(self.overlap_seconds * self.sample_rate),
+            engine=self,
+            workers=workers,
+            engine_factory=SpleeterEngine,
+            engine_kwargs={"sample_rate": self.sample_rate, "params_descriptor": self.params_descriptor}
+        )
+
+    def separate_file(self, audio_path, output_path, separator):
+        """
+        Sépare un fichier en flux, fenêtre par fenêtre, et écrit la piste vocale au fur et à mesure.
+
+        La mémoire utilisée ne dépend pas de la durée du fichier.
+
+        :return: Durée traitée en secondes.
+        """
+        blocks = read_float_blocks(audio_path, self.sample_rate, 2, BLOCK_SECONDS * self.sample_rate)
+        with AudioStreamWriter(output_path, self.sample_rate, 2, self.codec) as writer:
+            frames = separator.separate_stream(blocks, writer.write)
+        return frames / self.sample_rate
+
+    def output_name(self, source_hash):
+        # Nom déterministe : même source et mêmes paramètres => même fichier
+        return f'{generate_content_hash(source_hash, self.params)}_vocals.{self.codec}'
+
+    def save(self, output_path, vocals):
+        if self.codec == "wav":
+            self.audio_loader.save(output_path, vocals, self.sample_rate)
+        else:
+            write_audio(output_path, vocals, self.sample_rate, self.codec)
+
+def _load_worker(engine, sources, loaded, metrics):
+    # Décoder les fichiers à l'avance pendant que le modèle sépare le lot courant
+    for audio_path, source_hash in sources:
+        try:
+            with metrics.stage("decode", audio_path) as record:
+                waveform = engine.load(audio_path)
+                record["audio_seconds"] = waveform.shape[0] / engine.sample_rate
+            loaded.put((audio_path, source_hash, waveform, None))
+        except Exception as e:
+            loaded.put((audio_path, source_hash, None, e))
+    loaded.put(None)
+
+def _save(engine, output_path, vocals, audio_path, metrics):
+    # Exécuté sur le pool d'écriture : l'encodage du lot se fait en parallèle
+    with metrics.stage("export", audio_path, vocals.shape[0] / engine.sample_rate):
+        engine.save(output_path, vocals)
+    return output_path
+
+def extract_vocals(audio_path, output_dir, engine=None, manifest=None):
     """
     Extrait la partie vocale d'un fichier MP3 et la sauvegarde dans un fichier WAV.
 
     :param input_audio_path: Chemin vers le fichier MP3 d'entrée.
     :param output_dir: Répertoire de sortie pour les fichiers séparés.
+    :param engine: Moteur SpleeterEngine déjà chargé (créé si absent).
+    :param manifest: Journal RunManifest de l'étape (celui de output_dir si absent).
     """
     # Créer le répertoire de sortie s'il n'existe pas
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # Initialiser le séparateur de sources
-    separator = Separator('spleeter:2stems')
+    if engine is None:
+        engine = SpleeterEngine()
 
-    # Charger l'audio
-    audio_loader = AudioAdapter.default()
-    waveform, sample_rate = audio_loader.load(audio_path, sample_rate=16000)
+    # Ne rien refaire si cette source a déjà été extraite avec ces paramètres
+    manifest = manifest or RunManifest(output_dir, "vocals")
+    source_hash = file_content_hash(audio_path)
+    if manifest.is_done(source_hash, engine.params):
+        return
 
     # Séparer les sources
     try:
-        with tf.Graph().as_default(), tf.compat.v1.Session() as sess:
-            prediction = separator.separate(waveform)
-
-            # Sauvegarder les sources séparées
-            vocals = prediction['vocals']
+        vocals = engine.separate_batch([engine.load(audio_path)])[0]
 
-            # Sauvegarder la partie vocale
-            random_hash = generate_random_hash()
-            output_path = os.path.join(output_dir, f'{random_hash}_vocals.wav')
-            audio_loader.save(output_path, vocals, sample_rate)
+        # Sauvegarder la partie vocale
+        output_path = os.path.join(output_dir, engine.output_name(source_hash))
+        engine.save(output_path, vocals)
+        manifest.record(audio_path, source_hash, engine.params, [output_path])
 
-            print(f"La partie vocale a été extraite et sauvegardée dans le fichier '{output_path}'.")
+        print(f"La partie vocale a été extraite et sauvegardée dans le fichier '{output_path}'.")
 
     except Exception as e:
         print(f"i pa ka maché: {e}")
 
-    # Libérer la mémoire
-    del waveform, sample_rate, prediction, vocals
-    gc.collect()
-    if torch.cuda.is_available():
-        torch.cuda.empty_cache()
+def process_chunked(sources, output_dir, engine, manifest, metrics, workers=1):
+    """
+    Mode découpé : chaque fichier est séparé en flux par fenêtres qui se chevauchent, réparties sur workers processus.
+    """
+    with engine.chunked_separator(workers) as separator:
+        for audio_path, source_hash in tqdm(sources, desc="Processing files"):
+            output_path = os.path.join(output_dir, engine.output_name(source_hash))
+            try:
+                with metrics.stage("separate", audio_path) as record:
+                    record["audio_seconds"] = engine.separate_file(audio_path, output_path, separator)
+                manifest.record(audio_path, source_hash, engine.params, [output_path])
+            except Exception as e:
+                print(f"i pa ka maché: {audio_path}: {e}")
 
-def process_directory(input_dir, output_dir, batch_size=5):
+def process_directory(input_dir, output_dir, batch_size=5, queue_size=None, metrics=None, codec="wav", encode_workers=4,
+                      chunk_seconds=None, overlap_seconds=OVERLAP_SECONDS, separation_workers=1):
     """
     Traite tous les fichiers MP3 dans un répertoire donné par lots.
 
     :param input_dir: Répertoire contenant les fichiers MP3.
     :param output_dir: Répertoire de sortie pour les fichiers séparés.
-    :param batch_size: Nombre de fichiers à traiter par lot.
+    :param batch_size: Nombre de fichiers séparés en un seul passage du modèle.
+    :param queue_size: Nombre de fichiers décodés gardés en attente (2 lots par défaut).
+    :param metrics: Metrics qui reçoit les temps de chargement, décodage, séparation et écriture.
+    :param codec: Format des pistes vocales (wav, flac ou opus).
+    :param chunk_seconds: Si donné, séparation en flux par fenêtres de chunk_seconds secondes (mémoire bornée).
+    :param separation_workers: Nombre de processus qui séparent les fenêtres en mode découpé.
     """
+    metrics = metrics or Metrics("batch_vocal_extract")
+
+    # Créer le répertoire de sortie s'il n'existe pas
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
     # Lister tous les fichiers dans le répertoire d'entrée
-    files = [f for f in os.listdir(input_dir) if f.lower().endswith(('.mp3', '.wav'))]
+    files = [f for f in os.listdir(input_dir) if f.lower().endswith(AUDIO_EXTENSIONS)]
+    audio_paths = [os.path.join(input_dir, f) for f in files]
+
+    # Ignorer les sources déjà extraites lors d'une exécution précédente
+    manifest = RunManifest(output_dir, "vocals")
+    params = chunk_params(codec_params(separation_params(), codec), chunk_seconds, overlap_seconds)
+    sources = []
+    for audio_path in audio_paths:
+        source_hash = file_content_hash(audio_path)
+        if not manifest.is_done(source_hash, params):
+            sources.append((audio_path, source_hash))
+
+    if not sources:
+        # Passage sans travail : le fichier Prometheus est tout de même écrit
+        metrics.close()
+        return
+
+    # Un seul chargement du modèle pour tout le répertoire, aucun ici si chaque processus de séparation charge le sien
+    with metrics.stage("model_load"):
+        engine = SpleeterEngine(codec=codec, chunk_seconds=chunk_seconds, overlap_seconds=overlap_seconds,
+                                load_model=not chunk_seconds or separation_workers <= 1)
+
+    if chunk_seconds:
+        process_chunked(sources, output_dir, engine, manifest, metrics, separation_workers)
+        metrics.close()
+        return
+
+    loaded = queue.Queue(maxsize=queue_size or 2 * batch_size)
+    loader = threading.Thread(target=_load_worker, args=(engine, sources, loaded, metrics), daemon=True)
+    loader.start()
+
+    progress = tqdm(total=len(sources), desc="Processing files")
+    finished = False
+    while not finished:
+        batch = []
+        while len(batch) < batch_size:
+            item = loaded.get()
+            if item is None:
+                finished = True
+                break
+
+            audio_path, source_hash, waveform, error = item
+            if error is not None:
+                print(f"i pa ka maché: {audio_path}: {error}")
+                progress.update(1)
+                continue
+            batch.append((audio_path, source_hash, waveform))
+
+        if not batch:
+            continue
+
+        try:
+            with metrics.stage("separate", audio_seconds=sum(waveform.shape[0] for _, _, waveform in batch) / engine.sample_rate):
+                vocals_batch = engine.separate_batch([waveform for _, _, waveform in batch])
+            with AudioWriter(encode_workers) as writer:
+                for (audio_path, source_hash, _), vocals in zip(batch, vocals_batch):
+                    output_path = os.path.join(output_dir, engine.output_name(source_hash))
+                    writer.submit(_save, engine, output_path, vocals, audio_path, metrics)
+            for (audio_path, source_hash, _), output_path in zip(batch, writer.written):
+                manifest.record(audio_path, source_hash, engine.params, [output_path])
+        except Exception as e:
+            print(f"i pa ka maché: {e}")
+
+        progress.update(len(batch))
+
+        # Libérer la mémoire
+        del batch
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
 
-    for i in tqdm(range(0, len(files), batch_size), desc="Processing files"):
-        batch_files = files[i:i + batch_size]
-        for filename in batch_files:
-            audio_path = os.path.join(input_dir, filename)
-            extract_vocals(audio_path, output_dir)
+    progress.close()
+    loader.join()
+    metrics.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Extraire la partie vocale de tous les fichiers MP3 dans un répertoire.')
     parser.add_argument('input_dir', type=str, help='Répertoire contenant les fichiers MP3 d\'entrée.')
     parser.add_argument('output_dir', type=str, help='Répertoire de sortie pour les fichiers séparés.')
-    parser.add_argument('--batch_size', type=int, default=10, help='Nombre de fichiers à traiter par lot.')
+    parser.add_argument('--batch_size', type=int, default=10, help='Nombre de fichiers séparés en un seul passage du modèle.')
+    parser.add_argument('--queue_size', type=int, default=None, help='Nombre de fichiers décodés à l\'avance (2 lots par défaut).')
+    parser.add_argument('--codec', type=str, choices=CODECS, default="wav", help='Format des pistes vocales (flac : sans perte, opus : diffusion web).')
+    parser.add_argument('--encode_workers', type=int, default=4, help='Nombre de threads d\'encodage des pistes.')
+    parser.add_argument('--chunk_seconds', type=float, default=None, help='Séparer en flux par fenêtres de cette durée (mémoire bornée pour les longues émissions).')
+    parser.add_argument('--overlap_seconds', type=float, default=OVERLAP_SECONDS, help='Recouvrement entre deux fenêtres, recollées par fondu enchaîné.')
+    parser.add_argument('--separation_workers', type=int, default=1, help='Nombre de processus qui séparent les fenêtres (un modèle chargé par processus).')
+    add_metrics_arguments(parser)
 
     args = parser.parse_args()
 
-    process_directory(args.input_dir, args.output_dir, args.batch_size)
+    process_directory(args.input_dir, args.output_dir, args.batch_size, args.queue_size, Metrics("batch_vocal_extract", args.metrics, args.prom_file), args.codec, args.encode_workers,
+                      args.chunk_seconds, args.overlap_seconds, args.separation_workers)
@@ -1,91 +1,286 @@
 import argparse
 import os
-import hashlib
-import random
-import string
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import gc
+import numpy as np
 import torch
-import demucs.separate
-import shlex
+from demucs.apply import apply_model
+from demucs.audio import prevent_clip, save_audio
+from demucs.pretrained import get_model
+from demucs.separate import load_track
+
+from audio_io import AUDIO_EXTENSIONS, CODECS, AudioStreamWriter, AudioWriter, codec_params, read_float_blocks, write_audio
+from chunked_separation import OVERLAP_SECONDS, ChunkedSeparator, chunk_params
+from instrumentation import Metrics, add_metrics_arguments
+from run_manifest import RunManifest, file_content_hash, generate_content_hash
 
 
 # Détecte automatiquement GPU ou CPU
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 print(f"💻 Utilisation de : {DEVICE.upper()}")
 
+# Durée des blocs décodés en flux en mode découpé
+BLOCK_SECONDS = 10
+# Format des modèles Demucs préentraînés, connu sans les charger
+MODEL_SAMPLE_RATE = 44100
+MODEL_CHANNELS = 2
+
+
+def separation_params(model_name="mdx_extra"):
+    # Paramètres qui déterminent la piste vocale produite (et donc son nom)
+    return {"model": model_name, "stem": "vocals"}
+
+class DemucsEngine:
+    """
+    Garde le modèle Demucs (mdx_extra par défaut) en mémoire entre les fichiers
+    et n'écrit que la piste vocale, directement dans le répertoire de sortie.
+
+    Avec load_model=False, le moteur ne fait que décoder et écrire en mode
+    découpé : ce sont les processus de ChunkedSeparator qui chargent le modèle.
+    """
+
+    def __init__(self, model_name="mdx_extra", device=DEVICE, codec="wav", chunk_seconds=None, overlap_seconds=OVERLAP_SECONDS, load_model=True):
+        self.model_name = model_name
+        self.device = device
+        self.codec = codec
+        self.chunk_seconds = chunk_seconds
+        self.overlap_seconds = overlap_seconds
+        self.params = chunk_params(codec_params(separation_params(model_name), codec), chunk_seconds, overlap_seconds)
+        self.model = None
+        self.samplerate = MODEL_SAMPLE_RATE
+        self.audio_channels = MODEL_CHANNELS
+        if not load_model:
+            return
+
+        self.model = get_model(name=model_name)
+        self.model.cpu()
+        self.model.eval()
+        self.samplerate = self.model.samplerate
+        self.audio_channels = self.model.audio_channels
+        self.vocals_index = self.model.sources.index("vocals")
+
+    def load(self, audio_path):
+        # Même décodage que la commande demucs : canaux et fréquence du modèle
+        return load_track(audio_path, self.audio_channels, self.samplerate)
+
+    def separate(self, wav):
+        # Normalisation identique à demucs.separate.main
+        ref = wav.mean(0)
+        return self._separate(wav, ref.mean(), ref.std())
 
-def generate_random_hash(file_path, length=8):
-    # Extraire le nom de fichier à partir du chemin complet
-    file_name = os.path.basename(file_path)
+    def _separate(self, wav, mean, std):
+        wav = (wav - mean) / std
 
-    # Créer un objet hash SHA-256 à partir du nom du fichier
-    hash_object = hashlib.sha256(file_name.encode())
+        with torch.no_grad():
+            sources = apply_model(self.model, wav[None], device=self.device, split=True, overlap=0.25)[0]
 
-    # Retourner le hash sous forme hexadécimale, tronqué à la longueur spécifiée
-    return hash_object.hexdigest()[:length]
+        vocals = sources[self.vocals_index]
+        vocals = vocals * std + mean
+        return vocals
 
-def extract_vocals(audio_path, output_dir):
+    def stream(self, audio_path):
+        return read_float_blocks(audio_path, self.samplerate, self.audio_channels, BLOCK_SECONDS * self.samplerate)
+
+    def normalization(self, audio_path):
+        """
+        Moyenne et écart-type du mixage mono sur tout le fichier, calculés en flux (première passe).
+
+        Ce sont les statistiques que separate calcule sur le fichier entier :
+        toutes les fenêtres sont normalisées de la même façon.
+        """
+        count = total = squares = 0.0
+        for block in self.stream(audio_path):
+            mono = block.mean(axis=1, dtype=np.float64)
+            count += len(mono)
+            total += mono.sum()
+            squares += np.square(mono).sum()
+        mean = total / count
+        # Écart-type non biaisé, comme torch.std
+        std = np.sqrt(max(squares - count * mean * mean, 0.0) / max(count - 1, 1))
+        return float(mean), float(std)
+
+    def separate_chunk(self, chunk, context):
+        # Une fenêtre du mode découpé (ChunkedSeparator), normalisée avec les statistiques du fichier entier
+        mean, std = context
+        vocals = self._separate(torch.from_numpy(np.ascontiguousarray(chunk.T)), mean, std)
+        return vocals.cpu().numpy().T
+
+    def chunked_separator(self, workers=1):
+        """
+        ChunkedSeparator aux dimensions du moteur ; avec workers > 1, chaque processus charge son propre modèle.
+        """
+        return ChunkedSeparator(
+            int(self.chunk_seconds * self.samplerate),
+            int(self.overlap_seconds * self.samplerate),
+            engine=self,
+            workers=workers,
+            engine_factory=DemucsEngine,
+            engine_kwargs={"model_name": self.model_name, "device": self.device}
+        )
+
+    def separate_file(self, audio_path, output_path, separator):
+        """
+        Sépare un fichier en flux, fenêtre par fenêtre, et écrit la piste vocale au fur et à mesure.
+
+        :return: Durée traitée en secondes.
+        """
+        context = self.normalization(audio_path)
+        with AudioStreamWriter(output_path, self.samplerate, self.audio_channels, self.codec) as writer:
+            frames = separator.separate_stream(self.stream(audio_path), writer.write, context)
+        return frames / self.samplerate
+
+    def save(self, vocals, output_path):
+        if self.codec == "opus":
+            # Même écrêtage que save_audio, puis encodage libopus
+            vocals = prevent_clip(vocals.cpu(), mode="rescale")
+            write_audio(output_path, vocals.t().numpy(), self.samplerate, "opus")
+        else:
+            # save_audio choisit WAV ou FLAC selon l'extension
+            save_audio(vocals.cpu(), output_path, samplerate=self.samplerate, clip="rescale", bits_per_sample=16)
+
+def extract_vocals(audio_path, output_dir, engine=None, wav=None, manifest=None, source_hash=None, metrics=None, writer=None):
     """
     Extrait la partie vocale d'un fichier audio à l'aide de Demucs et sauvegarde uniquement la piste vocale.
+
+    :param engine: Moteur DemucsEngine déjà chargé (créé si absent).
+    :param wav: Audio déjà décodé par engine.load (décodé ici si absent).
+    :param manifest: Journal RunManifest de l'étape (celui de output_dir si absent).
+    :param source_hash: Hash du contenu de audio_path s'il est déjà connu.
+    :param metrics: Metrics qui reçoit les temps de séparation et d'écriture.
+    :param writer: AudioWriter sur lequel encoder la piste en arrière-plan (écriture immédiate si absent).
     """
+    metrics = metrics or Metrics("batch_vocal_extract_demucs")
+    if engine is None:
+        engine = DemucsEngine()
+
+    # Ne rien refaire si cette source a déjà été extraite avec ces paramètres
+    manifest = manifest or RunManifest(output_dir, "vocals_demucs")
+    source_hash = source_hash or file_content_hash(audio_path)
+    if manifest.is_done(source_hash, engine.params):
+        return
+
     # Lancer la séparation avec Demucs
     try:
-        #command = f'--two-stems vocals -n mdx_extra "{audio_path}"'
-        command = f'--two-stems vocals -n mdx_extra --device {DEVICE} "{audio_path}"'
-
-        demucs.separate.main(shlex.split(command))
+        if wav is None:
+            wav = engine.load(audio_path)
+        audio_seconds = wav.shape[-1] / engine.samplerate
+        with metrics.stage("separate", audio_path, audio_seconds):
+            vocals = engine.separate(wav)
     except Exception as e:
         print(f"Erreur lors de la séparation de {audio_path} : {e}")
         return
 
-    # Récupérer le nom de base
-    base_name = os.path.splitext(os.path.basename(audio_path))[0]
-
-    # Dossier où Demucs a exporté les résultats
-    demucs_output_path = os.path.join("separated", "mdx_extra", base_name)
-    vocals_path = os.path.join(demucs_output_path, "vocals.wav")
-
-    if not os.path.exists(vocals_path):
-        print(f"⚠️ Vocaux non trouvés pour {audio_path}")
-        return
-
-    # Générer un nom de fichier de sortie unique
-    random_hash = generate_random_hash(audio_path)
-    final_output_path = os.path.join(output_dir, f'{random_hash}_vocals.wav')
+    # Nom déterministe : même source et mêmes paramètres => même fichier
+    content_hash = generate_content_hash(source_hash, engine.params)
+    final_output_path = os.path.join(output_dir, f'{content_hash}_vocals.{engine.codec}')
 
     # Créer le dossier de sortie s’il n’existe pas
     os.makedirs(output_dir, exist_ok=True)
 
-    # Déplacer la piste vocale
-    shutil.move(vocals_path, final_output_path)
-    print(f"✔️ Vocaux extraits : {final_output_path}")
+    # Écrire directement la piste vocale, sans passer par separated/
+    def save():
+        with metrics.stage("export", audio_path, audio_seconds):
+            engine.save(vocals, final_output_path)
+        manifest.record(audio_path, source_hash, engine.params, [final_output_path])
+        print(f"✔️ Vocaux extraits : {final_output_path}")
 
-    # Nettoyer
-    try:
-        shutil.rmtree(demucs_output_path)
-    except Exception:
-        pass
+    if writer is None:
+        save()
+    else:
+        # Le fichier suivant est séparé pendant l'encodage de celui-ci
+        writer.submit(save)
 
+    del vocals
     gc.collect()
     if torch.cuda.is_available():
         torch.cuda.empty_cache()
 
-def process_directory(input_dir, output_dir, batch_size=5):
-    files = [f for f in os.listdir(input_dir) if f.lower().endswith(('.mp3', '.wav', '.flac', '.m4a'))]
+def _safe_load(engine, audio_path, metrics):
+    try:
+        with metrics.stage("decode", audio_path) as record:
+            wav = engine.load(audio_path)
+            record["audio_seconds"] = wav.shape[-1] / engine.samplerate
+        return wav, None
+    except Exception as e:
+        return None, e
+
+def process_chunked(audio_paths, source_hashes, output_dir, engine, manifest, metrics, workers=1):
+    """
+    Mode découpé : chaque fichier est séparé en flux par fenêtres qui se chevauchent, réparties sur workers processus.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with engine.chunked_separator(workers) as separator:
+        for audio_path, source_hash in tqdm(list(zip(audio_paths, source_hashes)), desc="Traitement en cours"):
+            content_hash = generate_content_hash(source_hash, engine.params)
+            output_path = os.path.join(output_dir, f'{content_hash}_vocals.{engine.codec}')
+            try:
+                with metrics.stage("separate", audio_path) as record:
+                    record["audio_seconds"] = engine.separate_file(audio_path, output_path, separator)
+                manifest.record(audio_path, source_hash, engine.params, [output_path])
+                print(f"✔️ Vocaux extraits : {output_path}")
+            except Exception as e:
+                print(f"Erreur lors de la séparation de {audio_path} : {e}")
+
+def process_directory(input_dir, output_dir, metrics=None, codec="wav", encode_workers=2, chunk_seconds=None, overlap_seconds=OVERLAP_SECONDS, separation_workers=1):
+    metrics = metrics or Metrics("batch_vocal_extract_demucs")
+    files = [f for f in os.listdir(input_dir) if f.lower().endswith(AUDIO_EXTENSIONS)]
+    # Ignorer les sources déjà extraites lors d'une exécution précédente
+    manifest = RunManifest(output_dir, "vocals_demucs")
+    params = chunk_params(codec_params(separation_params(), codec), chunk_seconds, overlap_seconds)
+    audio_paths = []
+    source_hashes = []
+    for f in files:
+        audio_path = os.path.join(input_dir, f)
+        source_hash = file_content_hash(audio_path)
+        if not manifest.is_done(source_hash, params):
+            audio_paths.append(audio_path)
+            source_hashes.append(source_hash)
+
+    if not audio_paths:
+        # Passage sans travail : le fichier Prometheus est tout de même écrit
+        metrics.close()
+        return
+
+    # Un seul chargement du modèle pour tout le répertoire, aucun ici si chaque processus de séparation charge le sien
+    with metrics.stage("model_load"):
+        engine = DemucsEngine(codec=codec, chunk_seconds=chunk_seconds, overlap_seconds=overlap_seconds,
+                              load_model=not chunk_seconds or separation_workers <= 1)
+
+    # Longues émissions : séparation en flux, mémoire bornée
+    if chunk_seconds:
+        process_chunked(audio_paths, source_hashes, output_dir, engine, manifest, metrics, separation_workers)
+        metrics.close()
+        return
+
+    # Décoder le fichier suivant pendant la séparation du fichier courant
+    with ThreadPoolExecutor(max_workers=1) as decoder, AudioWriter(encode_workers) as writer:
+        pending = decoder.submit(_safe_load, engine, audio_paths[0], metrics)
+        for i in tqdm(range(len(audio_paths)), desc="Traitement en cours"):
+            wav, error = pending.result()
+            if i + 1 < len(audio_paths):
+                pending = decoder.submit(_safe_load, engine, audio_paths[i + 1], metrics)
+
+            if error is not None:
+                print(f"Erreur lors de la séparation de {audio_paths[i]} : {error}")
+                continue
+
+            extract_vocals(audio_paths[i], output_dir, engine=engine, wav=wav, manifest=manifest, source_hash=source_hashes[i], metrics=metrics, writer=writer)
 
-    for i in tqdm(range(0, len(files), batch_size), desc="Traitement en cours"):
-        batch_files = files[i:i + batch_size]
-        for filename in batch_files:
-            audio_path = os.path.join(input_dir, filename)
-            extract_vocals(audio_path, output_dir)
+    metrics.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Extraire les vocaux des fichiers audio avec Demucs.')
     parser.add_argument('input_dir', type=str, help='Répertoire contenant les fichiers audio.')
     parser.add_argument('output_dir', type=str, help='Répertoire de sortie pour les vocaux.')
-    parser.add_argument('--batch_size', type=int, default=10, help='Nombre de fichiers à traiter par lot.')
+    parser.add_argument('--batch_size', type=int, default=10, help='Conservé pour compatibilité : les fichiers sont séparés un par un.')
+    parser.add_argument('--codec', type=str, choices=CODECS, default="wav", help='Format des pistes vocales (flac : sans perte, opus : diffusion web).')
+    parser.add_argument('--encode_workers', type=int, default=2, help='Nombre de threads d\'encodage des pistes.')
+    parser.add_argument('--chunk_seconds', type=float, default=None, help='Séparer en flux par fenêtres de cette durée (mémoire bornée pour les longues émissions).')
+    parser.add_argument('--overlap_seconds', type=float, default=OVERLAP_SECONDS, help='Recouvrement entre deux fenêtres, recollées par fondu enchaîné.')
+    parser.add_argument('--separation_workers', type=int, default=1, help='Nombre de processus qui séparent les fenêtres (un modèle chargé par processus).')
+    add_metrics_arguments(parser)
 
     args = parser.parse_args()
-    process_directory(args.input_dir, args.output_dir, args.batch_size)
+    process_directory(args.input_dir, args.output_dir, Metrics("batch_vocal_extract_demucs", args.metrics, args.prom_file), args.codec, args.encode_workers,
+                      args.chunk_seconds, args.overlap_seconds, args.separation_workers)
@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import soundfile as sf
+
+from instrumentation import peak_memory
+
+SAMPLE_RATE = 16000
+STAGES = ("split", "remove_short", "diarization_export", "transcription")
+
+
+def synthetic_speech(duration, rng, sample_rate=SAMPLE_RATE):
+    """
+    Signal « type parole » : voyelles harmoniques modulées en syllabes (~4 Hz), séparées par des pauses.
+
+    Les pauses (0,2 à 1,2 s) sont assez longues pour être détectées comme silences
+    avec les paramètres par défaut du découpage.
+    """
+    n = int(duration * sample_rate)
+    signal = np.zeros(n, dtype=np.float32)
+    position = 0
+    while position < n:
+        # Une « phrase » de 1 à 6 s
+        length = min(n - position, int(rng.uniform(1.0, 6.0) * sample_rate))
+        t = np.arange(length) / sample_rate
+        f0 = rng.uniform(90, 220)
+        voiced = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 6))
+        envelope = np.clip(np.sin(2 * np.pi * rng.uniform(3, 5) * t), 0, None) ** 2
+        noise = rng.normal(0, 0.05, length)
+        signal[position:position + length] = (0.3 * voiced * envelope + noise * envelope).astype(np.float32)
+        position += length + int(rng.uniform(0.2, 1.2) * sample_rate)
+
+    # Plancher de bruit très faible pour que les silences ne soient pas numériquement nuls
+    signal += rng.normal(0, 1e-4, n).astype(np.float32)
+    return np.clip(signal, -1, 1)
+
+def write_corpus(directory, durations, files, seed):
+    """
+    Écrit files fichiers WAV 16 bits par durée demandée, de façon reproductible.
+
+    :return: Liste des chemins et durée totale en secondes.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    total = 0.0
+    for duration in durations:
+        for i in range(files):
+            path = os.path.join(directory, f"synth_{duration:g}s_{i:04d}.wav")
+            sf.write(path, synthetic_speech(duration, rng), SAMPLE_RATE, subtype="PCM_16")
+            paths.append(path)
+            total += duration
+    return paths, total
+
+def bench_split(work_dir, durations, files, seed):
+    from SplitOnSilence import split_audio_on_silence
+
+    paths, audio_seconds = write_corpus(os.path.join(work_dir, "in"), durations, files, seed)
+    output_dir = os.path.join(work_dir, "segments")
+    os.makedirs(output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    segments = 0
+    for path in paths:
+        segments += len(split_audio_on_silence(path, output_dir) or [])
+    elapsed = time.perf_counter() - start
+
+    return {"files": len(paths), "audio_seconds": audio_seconds, "elapsed": elapsed, "outputs": segments}
+
+def bench_remove_short(work_dir, durations, files, seed):
+    from remove_short_wav import SEGMENT_EXTENSIONS, remove_short_wav_files
+
+    # Moitié de fichiers trop courts (0,1 à 0,5 s), moitié de fichiers gardés
+    directory = os.path.join(work_dir, "short")
+    paths, audio_seconds = write_corpus(directory, durations, files, seed)
+    short_paths, short_seconds = write_corpus(directory, [0.1, 0.3], len(paths) // 2 or 1, seed + 1)
+
+    start = time.perf_counter()
+    remove_short_wav_files(directory)
+    elapsed = time.perf_counter() - start
+
+    # Deuxième passage : index chaud, rien à supprimer
+    start = time.perf_counter()
+    remove_short_wav_files(directory)
+    rescan = time.perf_counter() - start
+
+    return {
+        "files": len(paths) + len(short_paths),
+        "audio_seconds": audio_seconds + short_seconds,
+        "elapsed": elapsed,
+        "rescan_elapsed": rescan,
+        # Clips restants seulement : l'index créé dans le répertoire n'en est pas un
+        "outputs": sum(name.lower().endswith(SEGMENT_EXTENSIONS) for name in os.listdir(directory))
+    }
+
+def bench_diarization_export(work_dir, durations, files, seed):
+    from audio_io import export_segments, load_waveform
+
+    paths, audio_seconds = write_corpus(os.path.join(work_dir, "in"), durations, files, seed)
+    output_dir = os.path.join(work_dir, "turns")
+    rng = np.random.default_rng(seed)
+
+    start = time.perf_counter()
+    turns = 0
+    for path in paths:
+        samples, sample_rate = load_waveform(path)
+        length_ms = len(samples) * 1000 // sample_rate
+
+        # Tours de parole synthétiques de 0,5 à 8 s, comme en sortie de pyannote
+        exports = []
+        position = 0
+        while position < length_ms:
+            end = min(length_ms, position + int(rng.uniform(500, 8000)))
+            exports.append((f"{output_dir}/{os.path.basename(path)}_segment_{position}_{end}.wav", position, end))
+            position = end
+        export_segments(samples, sample_rate, exports)
+        turns += len(exports)
+    elapsed = time.perf_counter() - start
+
+    return {"files": len(paths), "audio_seconds": audio_seconds, "elapsed": elapsed, "outputs": turns}
+
+class StubModel:
+    """
+    Modèle factice : décode le fichier et renvoie un texte fixe, pour mesurer la boucle sans inférence.
+
+    Il n'a que transcribe : le chemin par lots (whisper.decode) lui est fermé.
+    """
+
+    def transcribe(self, audio, language=None, fp16=None):
+        if isinstance(audio, str):
+            audio, _ = sf.read(audio, dtype="float32")
+        return {"text": f" {len(audio)} échantillons"}
+
+def bench_transcription(work_dir, durations, files, seed, whisper_model="stub", batch_size=1):
+    import batch_transcribe
+    from transcription_store import TranscriptionStore
+
+    if whisper_model == "stub" and batch_size > 1:
+        raise ValueError("Le modèle factice ne transcrit que fichier par fichier (batch_size 1)")
+
+    audio_dir = os.path.join(work_dir, "audio")
+    paths, audio_seconds = write_corpus(audio_dir, durations, files, seed)
+
+    if whisper_model == "stub":
+        batch_transcribe.load_whisper_model = lambda *args, **kwargs: (StubModel(), False)
+        model_name = "stub"
+    else:
+        model_name = whisper_model
+
+    # Le stockage des transcriptions est relatif au répertoire courant
+    os.chdir(work_dir)
+    start = time.perf_counter()
+    batch_transcribe.main(audio_dir, batch_size=batch_size, model_name=model_name)
+    elapsed = time.perf_counter() - start
+
+    # main n'affiche que ses erreurs : un passage incomplet ne doit pas passer pour une mesure
+    outputs = len(TranscriptionStore(batch_transcribe.STORE_FILE, legacy_json=None))
+    if outputs < len(paths):
+        raise RuntimeError(f"Transcription incomplète : {outputs} transcriptions pour {len(paths)} fichiers")
+
+    return {"files": len(paths), "audio_seconds": audio_seconds, "elapsed": elapsed, "outputs": outputs, "model": model_name, "batch_size": batch_size}
+
+BENCHMARKS = {
+    "split": bench_split,
+    "remove_short": bench_remove_short,
+    "diarization_export": bench_diarization_export,
+    "transcription": bench_transcription
+}
+
+def _run_isolated(stage, durations, files, seed, options):
+    # Exécuté dans un processus neuf : le pic de mémoire mesuré est celui de cette étape seule
+    sys.stdout = open(os.devnull, "w")
+    # Les étapes changent de répertoire courant : les imports différés doivent encore trouver les scripts voisins
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as work_dir:
+        result = BENCHMARKS[stage](work_dir, durations, files, seed, **options)
+    result.update(peak_memory())
+    return result
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def run_benchmarks(stages, durations, files, seed, repeat=1, whisper_model="stub", batch_size=1):
+    """
+    Lance chaque étape repeat fois, chacune dans un processus séparé.
+
+    :return: Générateur de dicts (une ligne JSON par exécution).
+    """
+    revision = git_revision()
+    context = get_context("spawn")
+    for stage in stages:
+        options = {"whisper_model": whisper_model, "batch_size": batch_size} if stage == "transcription" else {}
+        for run in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(_run_isolated, stage, durations, files, seed, options).result()
+
+            elapsed = result["elapsed"]
+            yield {
+                "stage": stage,
+                "run": run,
+                "revision": revision,
+                "python": platform.python_version(),
+                "durations": durations,
+                "seed": seed,
+                **result,
+                "rtf": elapsed / result["audio_seconds"],
+                "files_per_s": result["files"] / elapsed if elapsed > 0 else None
+            }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the HelpingFunctions stages on reproducible synthetic audio.')
+    parser.add_argument('--stages', type=str, default=",".join(STAGES), help=f'Comma-separated stages to run ({", ".join(STAGES)})')
+    parser.add_argument('--durations', type=str, default="5,30,120", help='Comma-separated file durations in seconds')
+    parser.add_argument('--files', type=int, default=10, help='Number of files per duration')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic corpus')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of runs per stage')
+    parser.add_argument('--whisper_model', type=str, default="stub", help='Whisper model for the transcription stage ("stub" = no inference)')
+    parser.add_argument('--batch_size', type=int, default=1, help='Batch size for the transcription stage')
+    parser.add_argument('--output', type=str, default=None, help='Append JSON lines to this file (default: stdout)')
+
+    args = parser.parse_args()
+
+    stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = [stage for stage in stages if stage not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Étapes inconnues : {', '.join(unknown)}")
+    durations = [float(duration) for duration in args.durations.split(",")]
+    if "transcription" in stages and args.whisper_model == "stub" and args.batch_size > 1:
+        parser.error("--batch_size > 1 demande un vrai modèle Whisper (--whisper_model), le modèle factice n'a pas de chemin par lots")
+
+    output = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for result in run_benchmarks(stages, durations, args.files, args.seed, args.repeat, args.whisper_model, args.batch_size):
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            print(f"⏱️ {result['stage']} : RTF {result['rtf']:.4f}, {result['files_per_s']:.1f} fichiers/s, pic RSS {result['peak_rss_mb']:.0f} Mo", file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+if __name__ == "__main__":
+    main()
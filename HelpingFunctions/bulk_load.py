@@ -0,0 +1,140 @@
+import argparse
+import csv
+import io
+import json
+import os
+import time
+
+from transcription_store import EXPORT_FILE, STORE_FILE, TranscriptionStore
+
+DEFAULT_AUTHOR = "whisper-large-v3"
+
+STAGING_TABLE = """
+    CREATE TEMP TABLE transcriptions_staging (
+        position BIGSERIAL,
+        filename TEXT NOT NULL,
+        transcription TEXT NOT NULL,
+        timestamp TIMESTAMPTZ,
+        author TEXT
+    ) ON COMMIT DROP
+"""
+
+COPY_STAGING = """
+    COPY transcriptions_staging (filename, transcription, timestamp, author)
+    FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (filename, transcription))
+"""
+
+# Même règle que update-batch.cjs : la première ligne d'un couple (filename, transcription) gagne,
+# un couple déjà en base est ignoré
+MERGE_STAGING = """
+    INSERT INTO transcriptions (filename, transcription, timestamp, author)
+    SELECT filename, transcription, timestamp, COALESCE(author, %s)
+    FROM transcriptions_staging
+    ORDER BY position
+    ON CONFLICT (filename, transcription) DO NOTHING
+"""
+
+
+class CsvStream(io.RawIOBase):
+    """
+    Fichier en lecture seule qui produit le CSV des transcriptions au fur et à mesure de la lecture.
+
+    COPY consomme ce flux par blocs : les lignes ne sont jamais toutes en mémoire.
+    """
+
+    def __init__(self, entries):
+        self.rows = iter(entries)
+        self.buffer = b""
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def _row(self, entry):
+        line = io.StringIO()
+        # None s'écrit comme un champ vide non cité, soit NULL pour COPY
+        csv.writer(line, lineterminator="\n").writerow([
+            entry["name"],
+            entry["transcription"],
+            entry.get("timestamp"),
+            entry.get("author")
+        ])
+        return line.getvalue().encode("utf-8")
+
+    def readinto(self, target):
+        while len(self.buffer) < len(target):
+            entry = next(self.rows, None)
+            if entry is None:
+                break
+            self.buffer += self._row(entry)
+            self.count += 1
+
+        size = min(len(target), len(self.buffer))
+        target[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+def connect(database_url=None):
+    """
+    Connexion à Postgres depuis DATABASE_URL, avec SSL pour une base Render comme update-batch.cjs.
+    """
+    try:
+        import psycopg2
+    except ImportError:
+        raise RuntimeError("psycopg2 est nécessaire pour le chargement en base (pip install psycopg2-binary)")
+
+    database_url = database_url or os.getenv("DATABASE_URL")
+    if not database_url:
+        raise RuntimeError("DATABASE_URL n'est pas défini")
+
+    if "render.com" in database_url and "sslmode" not in database_url:
+        return psycopg2.connect(database_url, sslmode="require")
+    return psycopg2.connect(database_url)
+
+def bulk_load(entries, database_url=None, default_author=DEFAULT_AUTHOR):
+    """
+    Charge des transcriptions dans la table transcriptions en une transaction.
+
+    Les lignes sont envoyées par COPY dans une table temporaire, puis fusionnées
+    par un seul INSERT ... ON CONFLICT (filename, transcription) DO NOTHING.
+
+    :param entries: Itérable de dicts {"name", "transcription", "timestamp", "author"}.
+    :return: Nombre de lignes envoyées et nombre de lignes réellement insérées.
+    """
+    stream = CsvStream(entries)
+    connection = connect(database_url)
+    try:
+        with connection:
+            with connection.cursor() as cursor:
+                cursor.execute(STAGING_TABLE)
+                cursor.copy_expert(COPY_STAGING, io.BufferedReader(stream, buffer_size=1 << 20))
+                cursor.execute(MERGE_STAGING, (default_author,))
+                inserted = cursor.rowcount
+    finally:
+        connection.close()
+
+    return stream.count, inserted
+
+def load_entries(store_file=STORE_FILE, json_file=None):
+    """
+    Transcriptions à charger : le tableau JSON donné, sinon la dernière version de chaque fichier du stockage JSONL.
+    """
+    if json_file:
+        with open(json_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return TranscriptionStore(store_file, legacy_json=EXPORT_FILE).latest()
+
+def main():
+    parser = argparse.ArgumentParser(description='Load transcriptions into Postgres with COPY and a single set-based merge.')
+    parser.add_argument('--store', type=str, default=STORE_FILE, help='JSONL transcription store to load')
+    parser.add_argument('--json', type=str, default=None, help='Load this JSON array (transcription_batch.json format) instead of the store')
+    parser.add_argument('--database_url', type=str, default=None, help='Postgres URL (default: $DATABASE_URL)')
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    sent, inserted = bulk_load(load_entries(args.store, args.json), args.database_url)
+    print(f"📦 {sent} transcriptions envoyées, {inserted} insérées ({sent - inserted} doublons ignorés) en {time.perf_counter() - start:.1f} s")
+
+if __name__ == "__main__":
+    main()
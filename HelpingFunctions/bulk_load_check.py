@@ -0,0 +1,118 @@
+import argparse
+import os
+import sys
+import tempfile
+from urllib.parse import quote
+
+from bulk_load import DEFAULT_AUTHOR, bulk_load, connect, load_entries
+from transcription_store import TranscriptionStore
+
+# Même table que db-init.sql et les colonnes ajoutées ensuite (author, rating), avec la contrainte dont dépend ON CONFLICT
+SCHEMA_TABLE = """
+    CREATE TABLE transcriptions (
+        id SERIAL PRIMARY KEY,
+        filename TEXT NOT NULL,
+        transcription TEXT NOT NULL,
+        timestamp TIMESTAMPTZ DEFAULT now(),
+        author TEXT DEFAULT 'whisper-large-v3',
+        rating SMALLINT DEFAULT 0 CHECK (rating BETWEEN 0 AND 5),
+        UNIQUE (filename, transcription)
+    )
+"""
+
+STORE_ENTRIES = [
+    {"name": "a.wav", "transcription": "bonjou", "timestamp": "2024-01-01T10:00:00", "author": None},
+    # Même fichier retranscrit : seule la dernière version part en base
+    {"name": "b.wav", "transcription": "premye", "timestamp": "2024-01-01T10:00:01", "author": "whisper-small"},
+    {"name": "b.wav", "transcription": "dezyèm", "timestamp": "2024-01-01T10:00:02", "author": "whisper-large-v3"},
+    # Virgules, guillemets et retour à la ligne : le CSV doit les transporter tels quels
+    {"name": "c.wav", "transcription": 'li di "wi", epi\nli ale', "timestamp": None, "author": None},
+    # Texte vide : FORCE_NOT_NULL le garde vide au lieu de NULL
+    {"name": "d.wav", "transcription": "", "timestamp": "2024-01-01T10:00:03", "author": "whisper-large-v3"},
+    # Déjà en base avant le chargement : ignoré
+    {"name": "e.wav", "transcription": "deja la", "timestamp": "2024-01-01T10:00:04", "author": None}
+]
+
+# Doublons dans un même envoi (format transcription_batch.json) : la première ligne gagne
+JSON_ENTRIES = [
+    {"name": "f.wav", "transcription": "menm", "timestamp": "2024-01-02T10:00:00", "author": "premye"},
+    {"name": "f.wav", "transcription": "menm", "timestamp": "2024-01-02T10:00:01", "author": "dezyèm"},
+    {"name": "a.wav", "transcription": "bonjou", "timestamp": "2024-01-02T10:00:02", "author": None}
+]
+
+
+def _expect(label, actual, expected):
+    if actual != expected:
+        raise AssertionError(f"{label} : {actual!r} au lieu de {expected!r}")
+    print(f"✅ {label} : {actual!r}")
+
+def run_check(database_url):
+    """
+    Charge un stockage avec doublons et auteurs absents dans un schéma jetable, puis vérifie le contenu de la table.
+
+    Rien n'est écrit hors de ce schéma : la base pointée par DATABASE_URL peut être celle de production.
+    """
+    schema = f"bulk_load_check_{os.getpid()}"
+    admin = connect(database_url)
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA {schema}")
+        cursor.execute(f"SET search_path TO {schema}")
+        cursor.execute(SCHEMA_TABLE)
+        cursor.execute("INSERT INTO transcriptions (filename, transcription) VALUES ('e.wav', 'deja la')")
+
+    # bulk_load ouvre sa propre connexion : le schéma lui est imposé par l'URL
+    separator = "&" if "?" in database_url else "?"
+    scoped_url = f"{database_url}{separator}options={quote(f'-csearch_path={schema}')}"
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            store = TranscriptionStore(os.path.join(directory, "store.jsonl"), legacy_json=None)
+            for entry in STORE_ENTRIES:
+                store.append(entry)
+
+            sent, inserted = bulk_load(load_entries(store.path), scoped_url)
+            _expect("Lignes envoyées depuis le stockage", sent, 5)
+            _expect("Lignes insérées depuis le stockage", inserted, 4)
+
+            sent, inserted = bulk_load(load_entries(store.path), scoped_url)
+            _expect("Lignes insérées au second chargement", inserted, 0)
+
+        sent, inserted = bulk_load(JSON_ENTRIES, scoped_url)
+        _expect("Lignes insérées depuis un envoi avec doublons", (sent, inserted), (3, 1))
+
+        with admin.cursor() as cursor:
+            cursor.execute("SELECT filename, transcription, author, timestamp IS NULL FROM transcriptions ORDER BY filename, id")
+            rows = cursor.fetchall()
+        _expect("Contenu de la table", rows, [
+            ("a.wav", "bonjou", DEFAULT_AUTHOR, False),
+            ("b.wav", "dezyèm", "whisper-large-v3", False),
+            ("c.wav", 'li di "wi", epi\nli ale', DEFAULT_AUTHOR, True),
+            ("d.wav", "", "whisper-large-v3", False),
+            ("e.wav", "deja la", "whisper-large-v3", False),
+            ("f.wav", "menm", "premye", False)
+        ])
+    finally:
+        with admin.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA {schema} CASCADE")
+        admin.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Check bulk_load (COPY, staging table, ON CONFLICT merge) against a real Postgres, in a throwaway schema.')
+    parser.add_argument('--database_url', type=str, default=None, help='Postgres URL (default: $DATABASE_URL; skipped when unset)')
+
+    args = parser.parse_args()
+
+    database_url = args.database_url or os.getenv("DATABASE_URL")
+    if not database_url:
+        print("⏭️ DATABASE_URL n'est pas défini : vérification ignorée")
+        return
+
+    try:
+        run_check(database_url)
+    except AssertionError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print("📦 bulk_load vérifié")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+CHUNK_SECONDS = 60.0
+OVERLAP_SECONDS = 2.0
+
+# Moteur de séparation propre à chaque processus du pool
+_engine = None
+
+
+def chunk_params(params, chunk_seconds=None, overlap_seconds=OVERLAP_SECONDS):
+    """
+    Ajoute le découpage aux paramètres d'une étape de séparation (les fondus changent légèrement la piste produite).
+    """
+    if not chunk_seconds:
+        return params
+    return dict(params, chunk_seconds=chunk_seconds, overlap_seconds=overlap_seconds)
+
+def iter_windows(blocks, chunk_frames, overlap_frames):
+    """
+    Fenêtres de chunk_frames trames qui se chevauchent de overlap_frames, à partir d'un flux de blocs.
+
+    La dernière fenêtre peut être plus courte ; elle n'est produite que si elle
+    apporte des trames absentes de la fenêtre précédente.
+    """
+    hop = chunk_frames - overlap_frames
+    buffer = None
+    produced = False
+    for block in blocks:
+        buffer = block if buffer is None else np.concatenate([buffer, block])
+        while len(buffer) >= chunk_frames:
+            yield buffer[:chunk_frames]
+            produced = True
+            buffer = buffer[hop:]
+    if buffer is not None and (len(buffer) > overlap_frames or (not produced and len(buffer))):
+        yield buffer
+
+def _init_worker(engine_factory, engine_kwargs):
+    global _engine
+    _engine = engine_factory(**engine_kwargs)
+
+def _separate_chunk(chunk, context):
+    return _engine.separate_chunk(chunk, context)
+
+class ChunkedSeparator:
+    """
+    Sépare un flux audio par fenêtres de longueur fixe qui se chevauchent, recollées par fondu enchaîné.
+
+    Seules les fenêtres en cours de séparation et la fin de la précédente sont
+    en mémoire : la mémoire ne dépend pas de la durée de l'entrée. Avec
+    workers > 1, chaque processus du pool charge son propre moteur (Spleeter
+    comme Demucs gardent un état interne non partagé entre threads) et les
+    fenêtres y sont réparties ; les résultats sont recollés dans l'ordre.
+
+    Le moteur fournit separate_chunk(fenêtre (trames, canaux) float32, contexte)
+    qui renvoie la piste vocale de même forme.
+    """
+
+    def __init__(self, chunk_frames, overlap_frames, engine=None, workers=1, engine_factory=None, engine_kwargs=None):
+        """
+        :param engine: Moteur déjà chargé, utilisé directement si workers <= 1.
+        :param engine_factory: Classe ou fonction qui crée le moteur dans chaque processus du pool.
+        """
+        if overlap_frames >= chunk_frames:
+            raise ValueError("Le recouvrement doit être plus court que les fenêtres")
+        self.chunk_frames = chunk_frames
+        self.overlap_frames = overlap_frames
+        self.engine = engine
+        self.workers = workers
+        self.executor = None
+        if workers > 1:
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(engine_factory, engine_kwargs or {})
+            )
+
+    def _results(self, windows, context):
+        if self.executor is None:
+            for window in windows:
+                yield self.engine.separate_chunk(window, context)
+            return
+
+        # Au plus deux fenêtres par processus en attente : le flux d'entrée n'est pas lu plus vite que la séparation
+        pending = deque()
+        for window in windows:
+            if len(pending) >= 2 * self.workers:
+                yield pending.popleft().result()
+            pending.append(self.executor.submit(_separate_chunk, window, context))
+        while pending:
+            yield pending.popleft().result()
+
+    def separate_stream(self, blocks, write, context=None):
+        """
+        Sépare un flux de blocs et passe la piste vocale recollée à write, au fur et à mesure.
+
+        :param blocks: Itérable de tableaux float32 (trames, canaux).
+        :param write: Fonction appelée avec chaque portion terminée de la piste vocale.
+        :param context: Valeur transmise telle quelle à separate_chunk (statistiques de normalisation...).
+        :return: Nombre de trames écrites.
+        """
+        written = 0
+        tail = None
+        for vocals in self._results(iter_windows(blocks, self.chunk_frames, self.overlap_frames), context):
+            vocals = np.asarray(vocals, dtype=np.float32)
+            if tail is not None:
+                # Fondu linéaire : les deux estimations se recouvrent sur tout le recouvrement
+                length = min(len(tail), len(vocals))
+                fade_in = np.linspace(0.0, 1.0, length + 2, dtype=np.float32)[1:-1, None]
+                vocals = vocals.copy()
+                vocals[:length] = tail[:length] * (1.0 - fade_in) + vocals[:length] * fade_in
+
+            keep = max(0, len(vocals) - self.overlap_frames)
+            if keep:
+                write(vocals[:keep])
+                written += keep
+            tail = vocals[keep:]
+
+        if tail is not None and len(tail):
+            write(tail)
+            written += len(tail)
+        return written
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+CACHE_DIR = ".diarization_cache"
+CACHE_MAX_MB = 2048
+
+
+def array_hash(array):
+    """
+    Hash SHA-256 du contenu d'un tableau NumPy (forme et type compris).
+    """
+    array = np.ascontiguousarray(array)
+    hash_object = hashlib.sha256(f"{array.dtype.str}{array.shape}".encode())
+    hash_object.update(array.data)
+    return hash_object.hexdigest()
+
+def audio_hash(file):
+    """
+    Hash du contenu audio d'une entrée pyannote (forme en mémoire ou chemin de fichier).
+    """
+    if "content_hash" not in file:
+        if "waveform" in file:
+            file["content_hash"] = array_hash(file["waveform"].numpy()) + f"@{file['sample_rate']}"
+        else:
+            from run_manifest import file_content_hash
+            file["content_hash"] = file_content_hash(file["audio"])
+
+    # Gardé dans l'entrée : calculé une seule fois pour la segmentation et les embeddings
+    return file["content_hash"]
+
+class DiarizationCache:
+    """
+    Cache disque des étapes coûteuses d'un pipeline pyannote SpeakerDiarization.
+
+    Les scores de segmentation sont indexés par le hash du contenu audio et la
+    version du modèle ; les embeddings le sont en plus par le hash de la
+    segmentation binarisée qui les a produits. Seul le clustering est donc
+    recalculé quand on relance avec d'autres seuils, ou après un arrêt
+    brutal. Les fichiers les moins récemment utilisés sont supprimés dès que
+    le cache dépasse max_bytes.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_MB * 1024 * 1024, model_version=""):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.model_version = model_version
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, stage, *parts):
+        payload = json.dumps([stage, self.model_version, *parts], sort_keys=True, separators=(",", ":"))
+        return os.path.join(self.cache_dir, f"{stage}_{hashlib.sha256(payload.encode()).hexdigest()}.npz")
+
+    def load(self, path):
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except Exception:
+            # Fichier incomplet ou illisible : le recalculer
+            self.misses += 1
+            return None
+
+        # La date de modification sert d'horodatage d'utilisation pour l'éviction
+        os.utime(path)
+        self.hits += 1
+        return arrays
+
+    def save(self, path, **arrays):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Supprime les entrées les moins récemment utilisées jusqu'à repasser sous max_bytes.
+        """
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".npz"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+    def attach(self, pipeline):
+        """
+        Remplace get_segmentations et get_embeddings de l'instance par des versions mises en cache.
+        """
+        from pyannote.core import SlidingWindow, SlidingWindowFeature
+
+        get_segmentations = pipeline.get_segmentations
+        get_embeddings = pipeline.get_embeddings
+
+        def cached_segmentations(file, hook=None):
+            if pipeline.training:
+                return get_segmentations(file, hook=hook)
+
+            path = self._path("segmentation", audio_hash(file), pipeline.segmentation_step)
+            cached = self.load(path)
+            if cached is not None:
+                window = SlidingWindow(start=float(cached["start"]), duration=float(cached["duration"]), step=float(cached["step"]))
+                return SlidingWindowFeature(cached["data"], window)
+
+            segmentations = get_segmentations(file, hook=hook)
+            window = segmentations.sliding_window
+            self.save(path, data=segmentations.data, start=window.start, duration=window.duration, step=window.step)
+            return segmentations
+
+        def cached_embeddings(file, binary_segmentations, exclude_overlap=False, hook=None):
+            if pipeline.training:
+                return get_embeddings(file, binary_segmentations, exclude_overlap=exclude_overlap, hook=hook)
+
+            window = binary_segmentations.sliding_window
+            path = self._path(
+                "embeddings",
+                audio_hash(file),
+                str(pipeline.embedding),
+                exclude_overlap,
+                array_hash(binary_segmentations.data),
+                [window.start, window.duration, window.step]
+            )
+            cached = self.load(path)
+            if cached is not None:
+                return cached["embeddings"]
+
+            embeddings = get_embeddings(file, binary_segmentations, exclude_overlap=exclude_overlap, hook=hook)
+            self.save(path, embeddings=embeddings)
+            return embeddings
+
+        pipeline.get_segmentations = cached_segmentations
+        pipeline.get_embeddings = cached_embeddings
+        return pipeline
@@ -0,0 +1,414 @@
+import argparse
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from audio_io import AUDIO_EXTENSIONS, read_float_blocks
+
+INDEX_FILE = ".fingerprint_index.sqlite"
+# Version du format des empreintes : un index d'une autre version est reconstruit
+INDEX_VERSION = 2
+
+SAMPLE_RATE = 16000
+FRAME_SIZE = 1024
+HOP_SIZE = 256
+# 33 bandes logarithmiques sur la bande utile de la parole : 32 bits par pas de temps
+BAND_EDGES = np.geomspace(250, 4000, 34)
+TIME_STEPS = 64
+# Compartiments de trames gardés en mémoire pendant le calcul en flux, et taille des blocs décodés
+MAX_BUCKETS = 1024
+BLOCK_SECONDS = 10
+FINGERPRINT_BITS = TIME_STEPS * (len(BAND_EDGES) - 2)
+# Pas de temps plus faibles que le plus fort de ce nombre de dB : leurs bits (bruit de fond) sont mis à zéro et ignorés à la comparaison
+QUIET_DB = 20
+
+# LSH par échantillonnage de bits : 128 bandes de 16 bits tirés au hasard (graine fixe) dans l'empreinte
+LSH_BANDS = 128
+LSH_ROWS = FINGERPRINT_BITS // LSH_BANDS
+LSH_PERMUTATION = np.random.default_rng(0).permutation(FINGERPRINT_BITS)
+
+# Taux de bits différents en dessous duquel deux clips sont des quasi-doublons (~45-50 % entre clips sans rapport,
+# pauses comprises, et moins de 5 % pour un réencodage)
+BER_THRESHOLD = 0.25
+# Écart de durée toléré entre deux quasi-doublons
+DURATION_TOLERANCE = 0.05
+MIN_DURATION_TOLERANCE = 0.25
+# En dessous de ce niveau (RMS), un clip est considéré comme du silence et n'est pas indexé
+SILENCE_RMS = 1e-3
+
+
+class FingerprintAccumulator:
+    """
+    Calcule une empreinte en flux : les blocs de signal sont analysés au fur et à mesure de leur arrivée.
+
+    Les énergies de bandes ne sont gardées que dans au plus 2 * MAX_BUCKETS
+    compartiments de trames consécutives ; quand ils sont tous remplis, ils
+    sont fusionnés deux à deux. La mémoire ne dépend donc pas de la durée du
+    fichier, et le résultat ne dépend pas du découpage en blocs. Jusqu'à
+    2 * MAX_BUCKETS trames (~65 s), chaque compartiment est une seule trame et
+    la mise en commun sur les pas de temps est exacte.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        bins = np.fft.rfftfreq(FRAME_SIZE, 1.0 / sample_rate)
+        band_index = np.digitize(bins, BAND_EDGES) - 1
+        self.valid = (band_index >= 0) & (band_index < len(BAND_EDGES) - 1)
+        self.band_index = band_index[self.valid]
+        self.window = np.hanning(FRAME_SIZE).astype(np.float32)
+        self.carry = np.zeros(0, dtype=np.float32)
+        self.bucket_size = 1
+        self.sums = []
+        self.counts = []
+        self.frames = 0
+        self.samples = 0
+        self.squares = 0.0
+
+    def _add_frames(self, energies):
+        for row in energies:
+            if self.counts and self.counts[-1] < self.bucket_size:
+                self.sums[-1] += row
+                self.counts[-1] += 1
+            else:
+                self.sums.append(row.copy())
+                self.counts.append(1)
+                if len(self.counts) > 2 * MAX_BUCKETS:
+                    self._merge()
+
+    def _merge(self):
+        # Compartiments deux fois plus larges : le dernier, incomplet, le reste
+        self.sums = [sum(self.sums[i:i + 2]) for i in range(0, len(self.sums), 2)]
+        self.counts = [sum(self.counts[i:i + 2]) for i in range(0, len(self.counts), 2)]
+        self.bucket_size *= 2
+
+    def update(self, block):
+        """
+        :param block: Signal mono float32 dans [-1, 1], suite du précédent.
+        """
+        block = np.asarray(block, dtype=np.float32).reshape(-1)
+        self.samples += len(block)
+        self.squares += float(np.square(block, dtype=np.float64).sum())
+
+        samples = np.concatenate([self.carry, block])
+        if len(samples) < FRAME_SIZE:
+            self.carry = samples
+            return
+        frame_count = 1 + (len(samples) - FRAME_SIZE) // HOP_SIZE
+        frames = np.lib.stride_tricks.as_strided(
+            samples, shape=(frame_count, FRAME_SIZE), strides=(samples.strides[0] * HOP_SIZE, samples.strides[0])
+        )
+        spectrum = np.abs(np.fft.rfft(frames * self.window, axis=1)) ** 2
+        energies = np.zeros((frame_count, len(BAND_EDGES) - 1))
+        np.add.at(energies.T, self.band_index, spectrum[:, self.valid].T)
+        self._add_frames(energies)
+        self.frames += frame_count
+        # La trame suivante commence frame_count pas plus loin
+        self.carry = samples[frame_count * HOP_SIZE:].copy()
+
+    def steps(self):
+        """
+        Énergies moyennes des bandes sur TIME_STEPS + 1 tranches égales du clip, (pas, bandes).
+        """
+        cumulative_frames = np.concatenate([[0], np.cumsum(self.counts)])
+        cumulative = np.vstack([np.zeros(len(BAND_EDGES) - 1), np.cumsum(self.sums, axis=0)])
+        # Énergie cumulée interpolée aux bornes des tranches : exacte quand chaque compartiment est une trame,
+        # et une tranche plus courte qu'une trame (clip très court) prend l'énergie de cette trame
+        edges = np.linspace(0, self.frames, TIME_STEPS + 2)
+        at_edges = np.stack([np.interp(edges, cumulative_frames, band) for band in cumulative.T], axis=1)
+        return np.diff(at_edges, axis=0) / np.diff(edges)[:, None]
+
+    def digest(self):
+        """
+        :return: Empreinte (bytes), ou None pour un clip silencieux ou trop court.
+        """
+        if not self.frames or np.sqrt(self.squares / self.samples) < SILENCE_RMS:
+            return None
+
+        steps = self.steps()
+        totals = steps.sum(axis=1)
+        loud_steps = totals > totals.max() * 10 ** (-QUIET_DB / 10)
+        # Un bit compare deux pas de temps consécutifs : il n'a de sens que si les deux sont au-dessus du bruit de fond
+        loud = loud_steps[1:] & loud_steps[:-1]
+
+        log_steps = np.log(steps + 1e-10)
+        band_difference = log_steps[:, :-1] - log_steps[:, 1:]
+        # Bit de Haitsma et Kalker : différence entre bandes voisines, comparée à celle du pas de temps précédent
+        bits = ((band_difference[1:] - band_difference[:-1]) > 0) & loud[:, None]
+        return np.packbits(bits.reshape(-1)).tobytes() + np.packbits(loud).tobytes()
+
+def fingerprint(samples, sample_rate=SAMPLE_RATE):
+    """
+    Empreinte spectrale compacte d'un clip (2048 bits et le masque des 64 pas de temps sonores, 264 octets), à la manière de Haitsma et Kalker.
+
+    Les énergies de 33 bandes sont moyennées sur 65 tranches réparties sur
+    toute la durée du clip ; chaque bit est le signe de la différence
+    d'énergie entre deux bandes voisines, moins la même différence à la tranche
+    précédente. Les pas de temps silencieux, qui ne dépendent que du bruit de
+    fond, ont leurs bits à zéro et sont marqués dans le masque : la
+    comparaison (bit_error_rate) les ignore. Un réencodage, un changement de
+    gain ou un léger décalage de découpe ne change que quelques bits.
+
+    :param samples: Signal mono float32 dans [-1, 1].
+    :return: Empreinte (bytes), ou None pour un clip silencieux ou trop court.
+    """
+    accumulator = FingerprintAccumulator(sample_rate)
+    accumulator.update(samples)
+    return accumulator.digest()
+
+def _split(fingerprint_bytes):
+    data = np.frombuffer(fingerprint_bytes, dtype=np.uint8)
+    bits = np.unpackbits(data[:FINGERPRINT_BITS // 8]).reshape(TIME_STEPS, -1)
+    loud = np.unpackbits(data[FINGERPRINT_BITS // 8:])[:TIME_STEPS].astype(bool)
+    return bits, loud
+
+def lsh_keys(fingerprint_bytes):
+    """
+    Clés LSH d'une empreinte : (bande, valeur de 16 bits).
+
+    Les clés nulles, qui viennent surtout des passages silencieux, sont
+    communes à trop de clips pour servir à la recherche et sont écartées.
+    """
+    bits = _split(fingerprint_bytes)[0].reshape(-1)[LSH_PERMUTATION]
+    packed = np.packbits(bits.reshape(LSH_BANDS, LSH_ROWS), axis=1)
+    keys = [(band, int.from_bytes(row.tobytes(), "big")) for band, row in enumerate(packed)]
+    return [(band, key) for band, key in keys if key]
+
+def bit_error_rate(first, second):
+    """
+    Taux de bits différents sur les pas de temps sonores dans l'un au moins des deux clips.
+
+    Les bits des silences valent zéro dans les deux empreintes : les compter
+    rapprocherait deux clips sans rapport dès qu'ils ont des pauses. Sans
+    aucun pas sonore commun, les clips sont jugés différents (1.0).
+    """
+    first_bits, first_loud = _split(first)
+    second_bits, second_loud = _split(second)
+    loud = first_loud | second_loud
+    if not loud.any():
+        return 1.0
+    return (first_bits[loud] != second_bits[loud]).mean()
+
+def file_fingerprint(file_path):
+    """
+    Empreinte et durée (secondes) d'un fichier audio, décodé en flux par blocs de BLOCK_SECONDS.
+    """
+    accumulator = FingerprintAccumulator(SAMPLE_RATE)
+    for block in read_float_blocks(file_path, SAMPLE_RATE, 1, BLOCK_SECONDS * SAMPLE_RATE):
+        accumulator.update(block)
+    return accumulator.digest(), accumulator.samples / SAMPLE_RATE
+
+class FingerprintIndex:
+    """
+    Index persistant (SQLite) des empreintes acoustiques des clips d'un répertoire.
+
+    Comme AudioIndex, un fichier inchangé (nom, taille, date de modification)
+    n'est jamais relu : un nouveau scan n'empreinte que les clips arrivés
+    depuis. Chaque clip est relié à son original (duplicate_of) s'il est le
+    quasi-doublon d'un clip déjà indexé ; la recherche passe par les bandes LSH
+    puis vérifie le taux de bits différents sur l'empreinte complète. Seuls
+    les originaux ont des bandes LSH : un doublon est trouvé par son original.
+    """
+
+    def __init__(self, directory, index_path=None, threshold=BER_THRESHOLD):
+        self.directory = directory
+        self.threshold = threshold
+        self.index_path = index_path or os.path.join(directory, INDEX_FILE)
+        self.connection = sqlite3.connect(self.index_path)
+        self.connection.row_factory = sqlite3.Row
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            # Empreintes d'un autre format : incomparables aux nouvelles, tout est recalculé
+            self.connection.executescript("DROP TABLE IF EXISTS clips; DROP TABLE IF EXISTS bands;")
+            self.connection.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS clips (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                duration REAL,
+                fingerprint BLOB,
+                duplicate_of TEXT
+            );
+            CREATE TABLE IF NOT EXISTS bands (
+                band INTEGER NOT NULL,
+                key INTEGER NOT NULL,
+                name TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS bands_key ON bands (band, key);
+            CREATE INDEX IF NOT EXISTS bands_name ON bands (name);
+            CREATE INDEX IF NOT EXISTS clips_duplicate_of ON clips (duplicate_of);
+        """)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def find(self, fingerprint_bytes, duration, exclude=None):
+        """
+        Clip indexé le plus proche parmi les candidats LSH de durée voisine.
+
+        :return: (nom de l'original, taux de bits différents), ou None s'il n'y a pas de quasi-doublon.
+        """
+        keys = lsh_keys(fingerprint_bytes)
+        if not keys:
+            return None
+        tolerance = max(MIN_DURATION_TOLERANCE, duration * DURATION_TOLERANCE)
+        placeholders = " OR ".join("(b.band = ? AND b.key = ?)" for _ in keys)
+        params = [value for band, key in keys for value in (band, key)]
+        rows = self.connection.execute(f"""
+            SELECT DISTINCT c.name, c.fingerprint, c.duplicate_of FROM bands b JOIN clips c ON c.name = b.name
+            WHERE ({placeholders}) AND c.duration BETWEEN ? AND ?
+        """, params + [duration - tolerance, duration + tolerance]).fetchall()
+
+        best = None
+        for row in rows:
+            if row["name"] == exclude:
+                continue
+            ber = bit_error_rate(fingerprint_bytes, row["fingerprint"])
+            if ber <= self.threshold and (best is None or ber < best[1]):
+                best = (row["duplicate_of"] or row["name"], ber)
+        return best
+
+    def add(self, name, size, mtime_ns, duration, fingerprint_bytes):
+        """
+        Ajoute ou remplace un clip et le relie à son original s'il en a un dans l'index.
+
+        :return: Nom de l'original, ou None si le clip est nouveau.
+        """
+        if self.connection.execute("SELECT 1 FROM clips WHERE name = ?", (name,)).fetchone():
+            self.remove(name)
+        original = None
+        if fingerprint_bytes is not None:
+            match = self.find(fingerprint_bytes, duration, exclude=name)
+            original = match[0] if match else None
+            if original is None:
+                self._index_bands(name, fingerprint_bytes)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO clips VALUES (?, ?, ?, ?, ?, ?)",
+            (name, size, mtime_ns, duration, fingerprint_bytes, original)
+        )
+        return original
+
+    def _index_bands(self, name, fingerprint_bytes):
+        self.connection.executemany("INSERT INTO bands VALUES (?, ?, ?)", [(band, key, name) for band, key in lsh_keys(fingerprint_bytes)])
+
+    def remove(self, name):
+        # Les doublons d'un original supprimé sont rattachés au premier d'entre eux, qui devient l'original
+        duplicates = self.connection.execute("SELECT name, fingerprint FROM clips WHERE duplicate_of = ? ORDER BY name", (name,)).fetchall()
+        if duplicates:
+            promoted = duplicates[0]["name"]
+            self.connection.execute("UPDATE clips SET duplicate_of = NULL WHERE name = ?", (promoted,))
+            self.connection.execute("UPDATE clips SET duplicate_of = ? WHERE duplicate_of = ?", (promoted, name))
+            self._index_bands(promoted, duplicates[0]["fingerprint"])
+        self.connection.execute("DELETE FROM bands WHERE name = ?", (name,))
+        self.connection.execute("DELETE FROM clips WHERE name = ?", (name,))
+
+    def scan(self, extensions=AUDIO_EXTENSIONS, workers=4):
+        """
+        Met l'index à jour : empreinte des clips nouveaux ou modifiés, oubli des clips disparus.
+
+        Le décodage et les FFT sont faits sur workers threads ; les clips sont
+        ajoutés dans l'ordre des noms, de sorte que l'original d'un groupe de
+        doublons est toujours le premier indexé.
+
+        :return: Nombre de clips (ré)analysés.
+        """
+        known = {row["name"]: (row["size"], row["mtime_ns"]) for row in self.connection.execute("SELECT name, size, mtime_ns FROM clips")}
+        seen = set()
+        changed = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.lower().endswith(extensions):
+                    continue
+                seen.add(entry.name)
+                stat = entry.stat()
+                if known.get(entry.name) != (stat.st_size, stat.st_mtime_ns):
+                    changed.append((entry.name, entry.path, stat.st_size, stat.st_mtime_ns))
+
+        for name in known:
+            if name.lower().endswith(extensions) and name not in seen:
+                self.remove(name)
+
+        def compute(item):
+            try:
+                return file_fingerprint(item[1])
+            except Exception as e:
+                print(f"Erreur lors du calcul de l'empreinte de {item[0]}: {e}")
+                return None, None
+
+        changed.sort()
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for (name, _, size, mtime_ns), (fingerprint_bytes, duration) in zip(changed, executor.map(compute, changed)):
+                self.add(name, size, mtime_ns, duration, fingerprint_bytes)
+        self.connection.commit()
+
+        return len(changed)
+
+    def original(self, name):
+        """
+        Nom de l'original du groupe de doublons de name (name lui-même s'il n'est le doublon de rien).
+        """
+        row = self.connection.execute("SELECT duplicate_of FROM clips WHERE name = ?", (name,)).fetchone()
+        return row["duplicate_of"] if row is not None and row["duplicate_of"] else name
+
+    def group(self, name):
+        """
+        Tous les clips du groupe de doublons de name, original en premier.
+        """
+        original = self.original(name)
+        rows = self.connection.execute("SELECT name FROM clips WHERE duplicate_of = ? ORDER BY name", (original,))
+        return [original] + [row["name"] for row in rows]
+
+    def duplicate_count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM clips WHERE duplicate_of IS NOT NULL").fetchone()[0]
+
+def plan_reuse(index, pending, done):
+    """
+    Répartit les fichiers à traiter entre ceux qu'il faut vraiment traiter et les doublons dont le résultat sera repris.
+
+    :param pending: Noms des fichiers à traiter.
+    :param done: Ensemble (ou conteneur) des noms qui ont déjà un résultat.
+    :return: (noms à traiter, dict doublon -> nom dont reprendre le résultat).
+    """
+    to_process = []
+    reuse = {}
+    representatives = {}
+    for name in pending:
+        group = index.group(name)
+        existing = next((member for member in group if member != name and member in done), None)
+        if existing is not None:
+            reuse[name] = existing
+        elif group[0] in representatives:
+            # Un autre doublon du groupe est déjà prévu dans ce passage
+            reuse[name] = representatives[group[0]]
+        else:
+            representatives[group[0]] = name
+            to_process.append(name)
+    return to_process, reuse
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or update the acoustic fingerprint index of a directory and report near-duplicate clips.')
+    parser.add_argument('directory', type=str, help='Directory to index')
+    parser.add_argument('--threshold', type=float, default=BER_THRESHOLD, help='Maximum bit error rate between two near-duplicates')
+    parser.add_argument('--workers', type=int, default=4, help='Number of fingerprinting threads')
+    parser.add_argument('--list', action='store_true', help='Print every duplicate with its original')
+
+    args = parser.parse_args()
+
+    with FingerprintIndex(args.directory, threshold=args.threshold) as index:
+        start = datetime.now()
+        updated = index.scan(workers=args.workers)
+        print(f"🔎 {updated} clips (ré)analysés en {(datetime.now() - start).total_seconds():.2f} s, {index.duplicate_count()} quasi-doublons dans l'index")
+        if args.list:
+            for row in index.connection.execute("SELECT name, duplicate_of FROM clips WHERE duplicate_of IS NOT NULL ORDER BY duplicate_of, name"):
+                print(f"{row['name']} -> {row['duplicate_of']}")
+
+if __name__ == "__main__":
+    main()
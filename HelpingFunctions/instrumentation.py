@@ -0,0 +1,230 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+PROM_PREFIX = "potomitan"
+
+# Plus haut pic de RSS relevé avant une remise à zéro de VmHWM : ru_maxrss est remis à zéro avec lui
+_run_peak_rss_mb = 0.0
+
+
+def peak_memory():
+    """
+    Pic de mémoire de tout le processus depuis son démarrage (RSS) et, si torch utilise CUDA, pic de mémoire GPU allouée, en Mo.
+    """
+    # ru_maxrss est en Ko sous Linux
+    memory = {"peak_rss_mb": max(_run_peak_rss_mb, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)}
+    torch = _cuda()
+    if torch is not None:
+        memory["cuda_peak_mb"] = torch.cuda.max_memory_allocated() / (1024.0 * 1024.0)
+    return memory
+
+def current_rss_mb():
+    """
+    Mémoire résidente actuelle du processus en Mo, ou None hors Linux.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (OSError, ValueError, IndexError):
+        return None
+
+def peak_rss_mb():
+    """
+    Pic de mémoire résidente (VmHWM) depuis le démarrage ou la dernière remise à zéro, en Mo, ou None hors Linux.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def reset_peak_rss():
+    """
+    Remet le pic de mémoire résidente (VmHWM) au niveau actuel, pour mesurer celui d'une étape.
+
+    :return: False si le noyau ne le permet pas (hors Linux, /proc en lecture seule).
+    """
+    global _run_peak_rss_mb
+    peak = peak_rss_mb()
+    if peak is None:
+        return False
+    _run_peak_rss_mb = max(_run_peak_rss_mb, peak)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+def _cuda():
+    torch = sys.modules.get("torch")
+    return torch if torch is not None and torch.cuda.is_available() else None
+
+def audio_duration(audio_path):
+    """
+    Durée d'un fichier audio lue dans l'en-tête, ou None si elle est illisible.
+    """
+    from audio_index import read_header
+    try:
+        return read_header(audio_path)[0]
+    except Exception:
+        return None
+
+@contextmanager
+def measure(stage, file=None, audio_seconds=None):
+    """
+    Mesure une étape sans l'enregistrer : le dict produit peut être renvoyé par un autre processus.
+
+    L'appelant peut compléter record["audio_seconds"] à l'intérieur du bloc.
+    La mémoire est propre à l'étape : RSS à la fin, variation et pic pendant
+    l'étape (VmHWM remis à zéro à son début, sous Linux seulement), pic GPU
+    remis à zéro de même. Des étapes simultanées dans des threads se
+    partagent ces compteurs.
+    """
+    record = {"stage": stage, "file": os.path.basename(file) if file else None, "audio_seconds": audio_seconds}
+    rss_start = current_rss_mb()
+    peak_reset = reset_peak_rss()
+    torch = _cuda()
+    if torch is not None:
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record["wall_seconds"] = time.perf_counter() - start
+        rss_end = current_rss_mb()
+        if rss_end is not None:
+            record["rss_mb"] = rss_end
+            record["rss_delta_mb"] = rss_end - rss_start
+        if peak_reset:
+            record["peak_rss_mb"] = peak_rss_mb()
+        if torch is not None:
+            record["cuda_peak_mb"] = torch.cuda.max_memory_allocated() / (1024.0 * 1024.0)
+
+class Metrics:
+    """
+    Mesures par fichier et par étape (durée, durée audio, facteur temps réel, mémoire).
+
+    Chaque mesure est ajoutée en une ligne au fichier JSONL dès qu'elle est prise ;
+    les totaux par étape sont écrits à la fin dans un fichier texte Prometheus
+    (collecteur textfile de node_exporter). Sans fichier de sortie, rien n'est
+    écrit et les étapes ne sont pas mesurées.
+    """
+
+    def __init__(self, script, jsonl_path=None, prom_file=None):
+        self.script = script
+        self.jsonl_path = jsonl_path
+        self.prom_file = prom_file
+        self.started = time.time()
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.jsonl_path or self.prom_file)
+
+    @contextmanager
+    def stage(self, stage, file=None, audio_seconds=None):
+        if not self.enabled:
+            # Mesure perdue : ne pas remettre à zéro les pics de mémoire du processus pour rien
+            yield {}
+            return
+        record = None
+        try:
+            with measure(stage, file, audio_seconds) as record:
+                yield record
+        finally:
+            if record is not None:
+                self.add(record)
+
+    def add(self, record):
+        """
+        Enregistre une mesure prise par measure (éventuellement dans un autre processus).
+        """
+        if not self.enabled:
+            return
+
+        record = dict(record, script=self.script, timestamp=datetime.utcnow().isoformat())
+        if record.get("audio_seconds"):
+            record["rtf"] = record["wall_seconds"] / record["audio_seconds"]
+
+        with self._lock:
+            totals = self.totals.setdefault(record["stage"], {"files": 0, "errors": 0, "wall_seconds": 0.0, "audio_seconds": 0.0, "max_wall_seconds": 0.0})
+            totals["files"] += 1
+            totals["errors"] += 1 if "error" in record else 0
+            totals["wall_seconds"] += record["wall_seconds"]
+            totals["audio_seconds"] += record.get("audio_seconds") or 0.0
+            totals["max_wall_seconds"] = max(totals["max_wall_seconds"], record["wall_seconds"])
+
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def summary(self):
+        lines = []
+        for stage, totals in self.totals.items():
+            rtf = f", RTF {totals['wall_seconds'] / totals['audio_seconds']:.3f}" if totals["audio_seconds"] else ""
+            lines.append(f"⏱️ {stage} : {totals['files']} mesures, {totals['wall_seconds']:.1f} s{rtf}, max {totals['max_wall_seconds']:.1f} s")
+        return "\n".join(lines)
+
+    def write_prometheus(self):
+        labels = lambda stage: f'script="{self.script}",stage="{stage}"'
+        metrics = [
+            ("stage_runs_total", "counter", "Number of measured files or batches per stage", "files"),
+            ("stage_errors_total", "counter", "Number of failed files or batches per stage", "errors"),
+            ("stage_wall_seconds_total", "counter", "Wall time spent in each stage", "wall_seconds"),
+            ("stage_audio_seconds_total", "counter", "Audio duration processed by each stage", "audio_seconds"),
+            ("stage_max_wall_seconds", "gauge", "Slowest single file or batch of each stage", "max_wall_seconds")
+        ]
+
+        lines = []
+        for name, kind, help_text, key in metrics:
+            lines.append(f"# HELP {PROM_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PROM_PREFIX}_{name} {kind}")
+            for stage, totals in self.totals.items():
+                lines.append(f"{PROM_PREFIX}_{name}{{{labels(stage)}}} {totals[key]}")
+
+        memory = peak_memory()
+        lines += [
+            f"# HELP {PROM_PREFIX}_peak_rss_bytes Peak resident memory of the run",
+            f"# TYPE {PROM_PREFIX}_peak_rss_bytes gauge",
+            f'{PROM_PREFIX}_peak_rss_bytes{{script="{self.script}"}} {int(memory["peak_rss_mb"] * 1024 * 1024)}',
+            f"# HELP {PROM_PREFIX}_run_duration_seconds Wall time of the whole run",
+            f"# TYPE {PROM_PREFIX}_run_duration_seconds gauge",
+            f'{PROM_PREFIX}_run_duration_seconds{{script="{self.script}"}} {time.time() - self.started}',
+            f"# HELP {PROM_PREFIX}_run_end_timestamp_seconds End of the last run",
+            f"# TYPE {PROM_PREFIX}_run_end_timestamp_seconds gauge",
+            f'{PROM_PREFIX}_run_end_timestamp_seconds{{script="{self.script}"}} {time.time()}'
+        ]
+
+        # Écriture atomique : node_exporter ne doit jamais lire un fichier à moitié écrit
+        tmp_file = self.prom_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_file, self.prom_file)
+
+    def close(self):
+        if not self.enabled:
+            return
+        if self.prom_file:
+            self.write_prometheus()
+        print(self.summary())
+
+def add_metrics_arguments(parser):
+    """
+    Options communes des scripts instrumentés.
+    """
+    parser.add_argument('--metrics', type=str, default=None, help='Append per-file/per-stage timing records to this JSONL file')
+    parser.add_argument('--prom_file', type=str, default=None, help='Write stage totals to this Prometheus textfile at the end of the run')
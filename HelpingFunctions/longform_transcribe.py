@@ -0,0 +1,255 @@
+import argparse
+import os
+from datetime import datetime
+
+import numpy as np
+from pydub import AudioSegment
+from tqdm import tqdm
+
+from SplitOnSilence import segment_file_name
+from audio_io import AUDIO_EXTENSIONS, CODECS, SAMPLE_RATE, AudioWriter, codec_params
+from batch_transcribe import OUTPUT_FILE, STORE_FILE, load_database
+from instrumentation import Metrics, add_metrics_arguments
+from run_manifest import RunManifest, file_content_hash
+from transcription_cache import add_cache_arguments, cache_from_args, transcription_params
+from transcription_store import TranscriptionStore
+from whisper_model import DEFAULT_MODEL, add_model_arguments, load_whisper_model, resolve_precision, set_threads
+
+
+def longform_params(model_name, language, max_segment_duration, min_segment_duration, pad_ms):
+    return {
+        "mode": "longform",
+        "model": model_name,
+        "language": language,
+        "max_segment_duration": max_segment_duration,
+        "min_segment_duration": min_segment_duration,
+        "pad_ms": pad_ms,
+        # Clips à la fréquence et aux canaux de la piste, comme le découpage sur les silences
+        "export": "source"
+    }
+
+def segment_words(segments):
+    """
+    Mots horodatés (début et fin en ms) des segments renvoyés par model.transcribe.
+
+    Un segment sans horodatage par mot est gardé comme un seul « mot ».
+    Le dernier mot de chaque segment est marqué : c'est une fin de phrase
+    probable, donc le meilleur endroit pour couper un clip.
+    """
+    words = []
+    for segment in segments:
+        items = segment.get("words") or [{"word": segment["text"], "start": segment["start"], "end": segment["end"]}]
+        items = [item for item in items if item["word"].strip()]
+        for i, item in enumerate(items):
+            words.append({
+                "word": item["word"],
+                "start": int(round(item["start"] * 1000)),
+                "end": int(round(item["end"] * 1000)),
+                "segment_end": i == len(items) - 1
+            })
+    return words
+
+def clips_from_words(words, length_ms, max_segment_duration=10000, min_segment_duration=1000, pad_ms=150):
+    """
+    Regroupe des mots horodatés en clips d'au plus max_segment_duration ms.
+
+    Un clip est fermé à la fin d'un segment Whisper dès qu'il atteint
+    min_segment_duration, et avant tout mot qui lui ferait dépasser
+    max_segment_duration : aucune coupe ne tombe au milieu d'un mot. Chaque clip
+    est élargi de pad_ms de part et d'autre sans empiéter sur ses voisins ni
+    dépasser max_segment_duration (seul un mot plus long que la limite, gardé
+    entier, la dépasse). Les clips encore plus courts que min_segment_duration
+    (fin de piste) sont écartés.
+
+    :return: Liste de (début en ms, fin en ms, texte).
+    """
+    groups = []
+    current = []
+    for word in words:
+        if current and word["end"] - current[0]["start"] > max_segment_duration:
+            groups.append(current)
+            current = []
+        current.append(word)
+        if word["segment_end"] and current[-1]["end"] - current[0]["start"] >= min_segment_duration:
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+
+    clips = []
+    for i, group in enumerate(groups):
+        # Marge limitée au milieu du silence qui sépare deux clips
+        previous_end = groups[i - 1][-1]["end"] if i > 0 else None
+        next_start = groups[i + 1][0]["start"] if i + 1 < len(groups) else None
+        start = group[0]["start"] - pad_ms
+        end = group[-1]["end"] + pad_ms
+        if previous_end is not None:
+            start = max(start, (previous_end + group[0]["start"]) // 2)
+        if next_start is not None:
+            end = min(end, (group[-1]["end"] + next_start) // 2)
+        start, end = max(0, start), min(length_ms, end)
+
+        # Marge réduite, d'abord de façon égale des deux côtés, si elle ferait dépasser max_segment_duration
+        excess = (end - start) - max_segment_duration
+        if excess > 0:
+            lead, trail = max(0, group[0]["start"] - start), max(0, end - group[-1]["end"])
+            cut_lead = min(lead, (excess + 1) // 2)
+            cut_trail = min(trail, excess - cut_lead)
+            cut_lead += min(lead - cut_lead, excess - cut_lead - cut_trail)
+            start, end = start + cut_lead, end - cut_trail
+
+        if end - start < min_segment_duration:
+            continue
+        clips.append((start, end, "".join(word["word"] for word in group)))
+    return clips
+
+def transcribe_longform(audio_path, output_dir, model, fp16, store, model_name=DEFAULT_MODEL, language="ht",
+                        max_segment_duration=10000, min_segment_duration=1000, pad_ms=150, codec="wav",
+                        encode_workers=4, manifest=None, metrics=None, cache=None, precision=None):
+    """
+    Transcrit une piste vocale entière en un seul appel à model.transcribe, puis en tire les clips.
+
+    Whisper avance par fenêtres de 30 s sur la piste complète : une passe de
+    l'encodeur couvre environ 30 s de parole au lieu d'un fragment de 10 s au
+    plus complété de silence. Les clips et leurs transcriptions sortent
+    ensemble des horodatages par mot.
+
+    Avec cache, le résultat horodaté de la piste est repris s'il existe : on
+    peut redécouper une piste avec d'autres durées de clips sans la retranscrire.
+
+    :param precision: Précision résolue du modèle, pour l'index du cache.
+    :return: Liste des clips écrits, ou None si la piste a déjà été traitée.
+    """
+    params = codec_params(longform_params(model_name, language, max_segment_duration, min_segment_duration, pad_ms), codec)
+    source_hash = file_content_hash(audio_path)
+
+    manifest = manifest or RunManifest(output_dir, "longform")
+    if manifest.is_done(source_hash, params):
+        print(f"⏭️ Déjà transcrit : {audio_path}")
+        return None
+
+    metrics = metrics or Metrics("longform_transcribe")
+    # Piste décodée une fois : Whisper en reçoit une copie mono à 16 kHz, les clips gardent la fréquence d'origine
+    source = AudioSegment.from_file(audio_path)
+    length_ms = len(source)
+
+    cache_key = transcription_params(model_name, precision, language, word_timestamps=True)
+    result = cache.get(source_hash, cache_key) if cache is not None else None
+    if result is None:
+        with metrics.stage("transcribe", audio_path, length_ms / 1000.0):
+            mono = source.set_channels(1).set_frame_rate(SAMPLE_RATE).set_sample_width(2)
+            # Même conversion int16 -> float32 que whisper.load_audio
+            samples = np.frombuffer(mono.raw_data, dtype='<i2').astype(np.float32) / 32768.0
+            del mono
+            result = model.transcribe(samples, language=language, fp16=fp16, word_timestamps=True)
+        if cache is not None:
+            cache.put(source_hash, cache_key, result)
+
+    clips = clips_from_words(segment_words(result["segments"]), length_ms, max_segment_duration, min_segment_duration, pad_ms)
+    windows = len({segment["seek"] for segment in result["segments"]})
+    print(f"🪟 {os.path.basename(audio_path)} : {windows} fenêtres de 30 s pour {len(clips)} clips")
+
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = []
+    with metrics.stage("export", audio_path, length_ms / 1000.0):
+        with AudioWriter(encode_workers) as writer:
+            for start, end, _ in clips:
+                clip_path = os.path.join(output_dir, segment_file_name(source_hash, start, end, params, codec))
+                writer.export(source[start:end], clip_path, codec)
+                outputs.append(clip_path)
+
+    # Transcriptions enregistrées une fois les clips sur disque
+    for clip_path, (_, _, text) in zip(outputs, clips):
+        filename = os.path.basename(clip_path)
+        if filename not in store:
+            store.append({
+                "name": filename,
+                "transcription": text,
+                "author": f"whisper-{model_name}",
+                "timestamp": datetime.utcnow().isoformat()
+            })
+
+    manifest.record(audio_path, source_hash, params, outputs)
+    return outputs
+
+def main(input_dir, output_dir, *, model_name=DEFAULT_MODEL, device=None, precision=None, language="ht",
+         max_segment_duration=10000, min_segment_duration=1000, pad_ms=150, codec="wav", encode_workers=4,
+         metrics=None, load_db=False, database_url=None, cache=None):
+    metrics = metrics or Metrics("longform_transcribe")
+    try:
+        store = TranscriptionStore(STORE_FILE, legacy_json=OUTPUT_FILE)
+        manifest = RunManifest(output_dir, "longform")
+
+        files = sorted(f for f in os.listdir(input_dir) if f.lower().endswith(AUDIO_EXTENSIONS))
+        if not files:
+            print("✅ Aucune piste à transcrire.")
+            return
+
+        with metrics.stage("model_load"):
+            model, fp16 = load_whisper_model(model_name, device, precision)
+        precision = resolve_precision(device, precision)[1]
+
+        clips = 0
+        for filename in tqdm(files):
+            audio_path = os.path.join(input_dir, filename)
+            try:
+                outputs = transcribe_longform(
+                    audio_path, output_dir, model, fp16, store, model_name, language,
+                    max_segment_duration, min_segment_duration, pad_ms, codec, encode_workers, manifest, metrics,
+                    cache, precision
+                )
+                clips += len(outputs or [])
+            except Exception as e:
+                print(f"❌ Erreur pour {filename} : {e}")
+
+        print(f"✅ {clips} clips écrits dans {output_dir}")
+        if cache is not None:
+            print(cache.summary())
+
+        # Exporter le tableau JSON attendu par update-batch.cjs
+        store.export_json(OUTPUT_FILE)
+        print("\n📄 Transcriptions sauvegardées dans :", OUTPUT_FILE)
+
+        if load_db:
+            load_database(store, database_url)
+
+    except Exception as e:
+        print(f"❌ Une erreur est survenue lors de l'exécution du script : {e}")
+    finally:
+        metrics.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Transcribe whole vocal tracks with Whisper and cut the clips from its word timestamps (replaces split-then-transcribe).')
+    parser.add_argument('input_dir', type=str, help='Directory containing the vocal tracks')
+    parser.add_argument('--output_dir', type=str, default="public/audio", help='Directory where the clips are written (at the sample rate and channels of the track)')
+    parser.add_argument('--language', type=str, default="ht", help='Transcription language')
+    parser.add_argument('--max_segment_duration', type=int, default=10000, help='Maximum clip duration in ms')
+    parser.add_argument('--min_segment_duration', type=int, default=1000, help='Minimum clip duration in ms')
+    parser.add_argument('--pad_ms', type=int, default=150, help='Audio kept before the first and after the last word of each clip')
+    parser.add_argument('--codec', type=str, choices=CODECS, default="wav", help='Output codec of the clips (flac: lossless, opus: web serving)')
+    parser.add_argument('--encode_workers', type=int, default=4, help='Number of encoding threads')
+    add_model_arguments(parser)
+    add_metrics_arguments(parser)
+    add_cache_arguments(parser)
+    parser.add_argument('--load_db', action='store_true', help='Load the transcriptions into Postgres (COPY + single merge) at the end of the run')
+    parser.add_argument('--database_url', type=str, default=None, help='Postgres URL for --load_db (default: $DATABASE_URL)')
+
+    args = parser.parse_args()
+    set_threads(args.threads, args.interop_threads)
+
+    main(
+        args.input_dir, args.output_dir,
+        model_name=args.model,
+        device=args.device,
+        precision=args.precision,
+        language=args.language,
+        max_segment_duration=args.max_segment_duration,
+        min_segment_duration=args.min_segment_duration,
+        pad_ms=args.pad_ms,
+        codec=args.codec,
+        encode_workers=args.encode_workers,
+        metrics=Metrics("longform_transcribe", args.metrics, args.prom_file),
+        load_db=args.load_db,
+        database_url=args.database_url,
+        cache=cache_from_args(args)
+    )
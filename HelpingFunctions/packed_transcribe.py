@@ -0,0 +1,258 @@
+import argparse
+import os
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from tqdm import tqdm
+
+from audio_io import AUDIO_EXTENSIONS
+from instrumentation import Metrics
+from whisper_model import add_model_arguments, load_whisper_model, set_threads
+
+# Fréquence des signaux décodés par Whisper
+SAMPLE_RATE = 16000
+
+# Contenu maximal d'une fenêtre : un peu moins de 30 s pour que le dernier horodatage tienne dans la fenêtre
+WINDOW_SECONDS = 28.0
+GAP_SECONDS = 1.0
+
+
+def pack_durations(durations, window=WINDOW_SECONDS, gap=GAP_SECONDS):
+    """
+    Répartit des clips en fenêtres, dans l'ordre, sans dépasser window secondes (silences compris).
+
+    Un clip plus long que window forme une fenêtre à lui seul.
+
+    :param durations: Durées des clips en secondes.
+    :return: Liste de fenêtres, chacune une liste d'indices dans durations.
+    """
+    windows = []
+    current = []
+    filled = 0.0
+    for i, duration in enumerate(durations):
+        needed = duration + (gap if current else 0.0)
+        if current and filled + needed > window:
+            windows.append(current)
+            current, filled, needed = [], 0.0, duration
+        current.append(i)
+        filled += needed
+    if current:
+        windows.append(current)
+    return windows
+
+def assign_words(segments, bounds):
+    """
+    Rend à chaque clip les mots dont le milieu tombe dans sa zone de la fenêtre.
+
+    :param bounds: (début, fin) de chaque clip dans la fenêtre, en secondes.
+    :return: Liste de textes (None pour un clip sans aucun mot).
+    """
+    # Frontière entre deux clips : milieu du silence qui les sépare
+    limits = [(bounds[i][1] + bounds[i + 1][0]) / 2 for i in range(len(bounds) - 1)]
+    words = [[] for _ in bounds]
+    for segment in segments:
+        items = segment.get("words") or [{"word": segment["text"], "start": segment["start"], "end": segment["end"]}]
+        for item in items:
+            middle = (item["start"] + item["end"]) / 2
+            words[int(np.searchsorted(limits, middle))].append(item["word"])
+    return ["".join(clip_words) if clip_words else None for clip_words in words]
+
+class PackedTranscriber:
+    """
+    Transcrit plusieurs clips courts dans une seule fenêtre de 30 s.
+
+    Les clips sont mis bout à bout, séparés par gap secondes de silence, et la
+    fenêtre est transcrite une fois avec les horodatages par mot. Chaque mot
+    est rendu au clip dont il vient. Un clip pour lequel Whisper ne renvoie
+    aucun mot est retranscrit seul, comme dans batch_transcribe.
+    """
+
+    def __init__(self, model, language="ht", fp16=None, window=WINDOW_SECONDS, gap=GAP_SECONDS):
+        self.model = model
+        self.language = language
+        self.fp16 = fp16
+        self.window = window
+        self.gap = gap
+
+    def transcribe_single(self, audio):
+        return self.model.transcribe(audio, language=self.language, fp16=self.fp16)
+
+    def transcribe_window(self, audios):
+        """
+        :param audios: Signaux float32 à 16 kHz tenant ensemble dans une fenêtre.
+        :return: Liste de dicts {"text": ...} dans l'ordre des clips.
+        """
+        if len(audios) == 1:
+            return [self.transcribe_single(audios[0])]
+
+        silence = np.zeros(int(self.gap * SAMPLE_RATE), dtype=np.float32)
+        parts = []
+        bounds = []
+        position = 0
+        for i, audio in enumerate(audios):
+            if i:
+                parts.append(silence)
+                position += len(silence)
+            parts.append(audio)
+            bounds.append((position / SAMPLE_RATE, (position + len(audio)) / SAMPLE_RATE))
+            position += len(audio)
+
+        # Pas de conditionnement sur le texte précédent : chaque clip est indépendant
+        result = self.model.transcribe(
+            np.concatenate(parts), language=self.language, fp16=self.fp16,
+            word_timestamps=True, condition_on_previous_text=False
+        )
+        texts = assign_words(result["segments"], bounds)
+        return [
+            {"text": text, "language": self.language} if text is not None else self.transcribe_single(audio)
+            for text, audio in zip(texts, audios)
+        ]
+
+    def transcribe_audios(self, audios):
+        """
+        Transcrit une liste de signaux fenêtre par fenêtre.
+
+        :return: Liste de dicts {"text": ...} dans l'ordre de audios.
+        """
+        results = [None] * len(audios)
+        for indices in pack_durations([len(audio) / SAMPLE_RATE for audio in audios], self.window, self.gap):
+            for i, result in zip(indices, self.transcribe_window([audios[i] for i in indices])):
+                results[i] = result
+        return results
+
+    def transcribe_paths(self, audio_paths, metrics=None, decode_workers=2, group=64):
+        """
+        Décode les fichiers par groupes de group (sur decode_workers threads), puis les transcrit par fenêtres.
+
+        :param metrics: Metrics qui reçoit le temps de décodage par fichier et d'inférence par fenêtre.
+        :return: Générateur de (chemin, résultat, erreur).
+        """
+        import whisper
+
+        metrics = metrics or Metrics("packed_transcribe")
+
+        def decode(audio_path):
+            try:
+                with metrics.stage("decode", audio_path) as record:
+                    audio = whisper.load_audio(audio_path)
+                    record["audio_seconds"] = len(audio) / SAMPLE_RATE
+                return audio, None
+            except Exception as e:
+                return None, e
+
+        with ThreadPoolExecutor(max_workers=max(1, decode_workers)) as executor:
+            for i in range(0, len(audio_paths), group):
+                paths = []
+                audios = []
+                for audio_path, (audio, error) in zip(audio_paths[i:i + group], executor.map(decode, audio_paths[i:i + group])):
+                    if error is not None:
+                        yield audio_path, None, error
+                    else:
+                        paths.append(audio_path)
+                        audios.append(audio)
+
+                for indices in pack_durations([len(audio) / SAMPLE_RATE for audio in audios], self.window, self.gap):
+                    window_paths = [paths[j] for j in indices]
+                    try:
+                        with metrics.stage("inference", audio_seconds=sum(len(audios[j]) for j in indices) / SAMPLE_RATE):
+                            results = self.transcribe_window([audios[j] for j in indices])
+                    except Exception as e:
+                        for audio_path in window_paths:
+                            yield audio_path, None, e
+                        continue
+                    for audio_path, result in zip(window_paths, results):
+                        yield audio_path, result, None
+
+def normalize_text(text):
+    # Comparaison insensible à la casse et à la ponctuation
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+def edit_distance(reference, hypothesis):
+    """
+    Distance de Levenshtein entre deux séquences (mots ou caractères).
+    """
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_item in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_item in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_item != hyp_item)))
+        previous = current
+    return previous[-1]
+
+def error_rates(references, hypotheses):
+    """
+    WER et CER du corpus (erreurs cumulées / longueur cumulée des références).
+    """
+    word_errors = word_total = char_errors = char_total = 0
+    for reference, hypothesis in zip(references, hypotheses):
+        ref_words, hyp_words = normalize_text(reference), normalize_text(hypothesis)
+        word_errors += edit_distance(ref_words, hyp_words)
+        word_total += len(ref_words)
+        ref_chars, hyp_chars = " ".join(ref_words), " ".join(hyp_words)
+        char_errors += edit_distance(ref_chars, hyp_chars)
+        char_total += len(ref_chars)
+    return {
+        "wer": word_errors / word_total if word_total else 0.0,
+        "cer": char_errors / char_total if char_total else 0.0
+    }
+
+def evaluate(transcriber, audio_paths, sample_size=100, seed=0):
+    """
+    Compare la transcription par fenêtres groupées à la transcription fichier par fichier sur un échantillon.
+
+    La transcription fichier par fichier sert de référence : le WER/CER mesure
+    l'écart introduit par le regroupement, pas l'erreur absolue du modèle.
+    """
+    import whisper
+
+    paths = sorted(audio_paths)
+    random.Random(seed).shuffle(paths)
+    paths = paths[:sample_size]
+    audios = [whisper.load_audio(path) for path in paths]
+    audio_seconds = sum(len(audio) for audio in audios) / SAMPLE_RATE
+
+    start = time.perf_counter()
+    references = [transcriber.transcribe_single(audio)["text"] for audio in tqdm(audios)]
+    single_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    hypotheses = [result["text"] for result in transcriber.transcribe_audios(audios)]
+    packed_elapsed = time.perf_counter() - start
+
+    windows = len(pack_durations([len(audio) / SAMPLE_RATE for audio in audios], transcriber.window, transcriber.gap))
+    return {
+        "files": len(paths),
+        "windows": windows,
+        "audio_seconds": audio_seconds,
+        "single_elapsed": single_elapsed,
+        "packed_elapsed": packed_elapsed,
+        "speedup": single_elapsed / packed_elapsed if packed_elapsed else None,
+        **error_rates(references, hypotheses)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare packed-window transcription with file-by-file transcription on a held-out sample.')
+    parser.add_argument('--audio_dir', type=str, default="public/audio", help='Directory containing the clips')
+    parser.add_argument('--sample_size', type=int, default=100, help='Number of clips in the held-out sample')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the sample')
+    parser.add_argument('--language', type=str, default="ht", help='Transcription language')
+    parser.add_argument('--gap', type=float, default=GAP_SECONDS, help='Silence inserted between two clips of a window (seconds)')
+    add_model_arguments(parser)
+
+    args = parser.parse_args()
+    set_threads(args.threads, args.interop_threads)
+
+    audio_paths = [os.path.join(args.audio_dir, f) for f in os.listdir(args.audio_dir) if f.lower().endswith(AUDIO_EXTENSIONS)]
+    model, fp16 = load_whisper_model(args.model, args.device, args.precision)
+    transcriber = PackedTranscriber(model, args.language, fp16, gap=args.gap)
+
+    report = evaluate(transcriber, audio_paths, args.sample_size, args.seed)
+    print(f"📊 {report['files']} clips ({report['audio_seconds']:.0f} s d'audio) en {report['windows']} fenêtres")
+    print(f"⏱️ Fichier par fichier : {report['single_elapsed']:.1f} s, par fenêtres : {report['packed_elapsed']:.1f} s (x{report['speedup']:.2f})")
+    print(f"🎯 Écart avec la transcription fichier par fichier : WER {report['wer']:.2%}, CER {report['cer']:.2%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+import argparse
+import os
+import queue
+import threading
+
+import numpy as np
+import soundfile as sf
+from pydub import AudioSegment
+from tqdm import tqdm
+
+from SplitOnSilence import segment_file_name, split_chunks, split_params
+from audio_io import AUDIO_EXTENSIONS, CODECS, AudioWriter, codec_params
+from batch_transcribe import OUTPUT_FILE, STORE_FILE, load_database, save_transcription
+from run_manifest import RunManifest, file_content_hash
+from transcription_cache import add_cache_arguments, cache_from_args, transcription_params
+from transcription_store import TranscriptionStore
+from whisper_model import DEFAULT_MODEL, add_model_arguments, load_whisper_model, resolve_precision, set_threads
+
+SAMPLE_RATE = 16000
+
+# Marque de fin de flux dans les files entre étapes
+_DONE = object()
+
+
+def to_int16(waveform):
+    # Même conversion que ffmpeg de float vers s16 : arrondi puis écrêtage
+    return np.clip(np.rint(waveform * 32768.0), -32768, 32767).astype(np.int16)
+
+def to_whisper_audio(segment):
+    """
+    Signal float32 mono à 16 kHz attendu par Whisper, à partir d'un AudioSegment 16 bits.
+    """
+    samples = np.frombuffer(segment.raw_data, dtype='<i2').reshape(-1, segment.channels)
+    # Mixage mono par moyenne des canaux, arrondi en 16 bits comme whisper.load_audio
+    mono = np.rint(samples.astype(np.float32).mean(axis=1)).astype(np.int16)
+    return mono.astype(np.float32) / 32768.0
+
+def _run_stage(name, func, inbox, outbox, errors, workers=1):
+    """
+    Lance workers threads qui appliquent func à chaque tâche de inbox et passent le résultat à outbox.
+
+    Une erreur sur une tâche est comptée et la tâche abandonnée ; les autres continuent.
+    """
+    remaining = [workers]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            job = inbox.get()
+            if job is _DONE:
+                # Laisser la marque de fin aux autres threads de l'étape
+                inbox.put(_DONE)
+                break
+            try:
+                result = func(job)
+            except Exception as e:
+                tqdm.write(f"❌ [{name}] {os.path.basename(job['source'])} : {type(e).__name__}: {e}")
+                # Plusieurs threads d'une étape (split_workers) peuvent échouer en même temps
+                with lock:
+                    errors[name] = errors.get(name, 0) + 1
+                continue
+            if result is not None:
+                outbox.put(result)
+
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                outbox.put(_DONE)
+
+    threads = [threading.Thread(target=worker, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+class AudioPipeline:
+    """
+    Enchaîne extraction vocale, découpage, filtre des segments courts, transcription et chargement en base.
+
+    Chaque étape tourne dans ses propres threads, reliées par des files bornées :
+    pendant que Spleeter sépare un fichier, le précédent est découpé et
+    l'avant-dernier transcrit. La piste vocale et les segments passent d'une
+    étape à l'autre en mémoire ; ils sont aussi écrits sur disque, ce qui sert
+    de point de reprise. Les journaux RunManifest (voix, découpage) et le
+    stockage des transcriptions indiquent pour chaque fichier où reprendre : une
+    étape déjà faite relit ses sorties au lieu de recalculer. Avec cache, un
+    segment dont le contenu a déjà été transcrit n'est pas renvoyé au modèle.
+    """
+
+    def __init__(self, work_dir, audio_dir, vocals=True, silence_thresh=-40, min_silence_len=500, max_segment_duration=10000,
+                 min_segment_duration=1000, min_duration=0.5, model_name=DEFAULT_MODEL, device=None, precision=None,
+                 batch_size=1, split_workers=2, queue_size=2, store_file=STORE_FILE, codec="wav", cache=None):
+        self.vocals_dir = os.path.join(work_dir, "vocals")
+        self.audio_dir = audio_dir
+        self.vocals = vocals
+        self.codec = codec
+        self.split_params = split_params(silence_thresh, min_silence_len, max_segment_duration, min_segment_duration)
+        self.segment_params = codec_params(self.split_params, codec)
+        self.min_duration = min_duration
+        self.model_name = model_name
+        self.device = device
+        self.precision = precision
+        self.batch_size = batch_size
+        self.cache = cache
+        self.cache_key = None
+        self.split_workers = split_workers
+        self.queue_size = queue_size
+
+        os.makedirs(self.vocals_dir, exist_ok=True)
+        os.makedirs(self.audio_dir, exist_ok=True)
+        self.vocals_manifest = RunManifest(self.vocals_dir, "vocals")
+        self.split_manifest = RunManifest(self.audio_dir, "split")
+        self.store = TranscriptionStore(store_file, legacy_json=OUTPUT_FILE)
+
+        # Modèles chargés à la première tâche qui en a besoin
+        self._lock = threading.Lock()
+        self._engine = None
+        self._model = None
+        self._transcriber = None
+        self.fp16 = None
+
+    def engine(self):
+        with self._lock:
+            if self._engine is None:
+                from batch_vocal_extract import SpleeterEngine
+                self._engine = SpleeterEngine(SAMPLE_RATE)
+            return self._engine
+
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                self._model, self.fp16 = load_whisper_model(self.model_name, self.device, self.precision)
+                if self.batch_size > 1:
+                    from whisper_batch import BatchedTranscriber
+                    self._transcriber = BatchedTranscriber(self._model, language="ht", fp16=self.fp16)
+            return self._model
+
+    # Étape 1 : décodage de la source (seulement si la voix reste à extraire)
+    def load(self, job):
+        job["source_hash"] = file_content_hash(job["source"])
+        if not self.vocals:
+            return job
+
+        entry = self.vocals_manifest.get(job["source_hash"], self.engine_params())
+        if entry is not None:
+            job["vocals_path"] = os.path.join(self.vocals_dir, entry["outputs"][0])
+            return job
+
+        job["waveform"] = self.engine().load(job["source"])
+        return job
+
+    def engine_params(self):
+        from batch_vocal_extract import separation_params
+        return separation_params(sample_rate=SAMPLE_RATE)
+
+    # Étape 2 : extraction de la voix, gardée en mémoire pour le découpage
+    def separate(self, job):
+        waveform = job.pop("waveform", None)
+        if waveform is None:
+            return job
+
+        engine = self.engine()
+        vocals = to_int16(engine.separate_batch([waveform])[0])
+
+        # Point de reprise : la piste écrite est exactement celle découpée en mémoire
+        vocals_path = os.path.join(self.vocals_dir, engine.output_name(job["source_hash"]))
+        sf.write(vocals_path, vocals, SAMPLE_RATE, subtype="PCM_16")
+        self.vocals_manifest.record(job["source"], job["source_hash"], engine.params, [vocals_path])
+
+        job["vocals_path"] = vocals_path
+        job["vocals"] = vocals
+        return job
+
+    # Étapes 3 et 4 : découpage sur les silences et filtre des segments trop courts
+    def split(self, job):
+        split_source = job.get("vocals_path", job["source"])
+        split_hash = file_content_hash(split_source) if self.vocals else job["source_hash"]
+
+        entry = self.split_manifest.get(split_hash, self.segment_params)
+        if entry is not None:
+            job.pop("vocals", None)
+            job["segments"] = [(os.path.join(self.audio_dir, output), None) for output in entry["outputs"]]
+            return job
+
+        vocals = job.pop("vocals", None)
+        if vocals is not None:
+            audio = AudioSegment(vocals.tobytes(), frame_rate=SAMPLE_RATE, sample_width=2, channels=vocals.shape[1])
+        else:
+            audio = AudioSegment.from_file(split_source)
+
+        segments = []
+        with AudioWriter() as writer:
+            for offset, chunk in split_chunks(audio, **self.split_params):
+                # Filtre des segments courts (remove_short_wav) avant toute écriture
+                if len(chunk) / 1000.0 < self.min_duration:
+                    continue
+                segment_path = os.path.join(self.audio_dir, segment_file_name(split_hash, offset, offset + len(chunk), self.segment_params, self.codec))
+                writer.export(chunk, segment_path, self.codec)
+                # La piste vocale est déjà à 16 kHz en 16 bits : Whisper la reçoit en mémoire, sinon il relit le fichier
+                segments.append((segment_path, to_whisper_audio(chunk) if vocals is not None else None))
+
+        self.split_manifest.record(split_source, split_hash, self.segment_params, [path for path, _ in segments])
+        job["segments"] = segments
+        return job
+
+    def cached(self, pending):
+        """
+        Enregistre les segments dont le contenu est déjà dans le cache de transcription.
+
+        :return: Segments restant à transcrire, avec le hash de leur contenu.
+        """
+        if self.cache_key is None:
+            self.cache_key = transcription_params(self.model_name, resolve_precision(self.device, self.precision)[1], "ht")
+
+        misses = []
+        for path, audio in pending:
+            # Le segment vient d'être écrit (ou relu par le manifest) : son hash est celui que verra batch_transcribe
+            content_hash = file_content_hash(path)
+            result = self.cache.get(content_hash, self.cache_key)
+            if result is None:
+                misses.append((path, audio, content_hash))
+            else:
+                save_transcription(self.store, os.path.basename(path), result, self.model_name)
+        return misses
+
+    def save(self, path, content_hash, result):
+        save_transcription(self.store, os.path.basename(path), result, self.model_name)
+        if self.cache is not None:
+            self.cache.put(content_hash, self.cache_key, result)
+
+    # Étape 5 : transcription des segments absents du stockage
+    def transcribe(self, job):
+        pending = [(path, audio) for path, audio in job.pop("segments") if os.path.basename(path) not in self.store]
+        job["transcribed"] = 0
+        if self.cache is not None:
+            pending = self.cached(pending)
+        else:
+            pending = [(path, audio, None) for path, audio in pending]
+        if not pending:
+            return job
+
+        model = self.model()
+        if self._transcriber is not None:
+            import whisper
+
+            for i in range(0, len(pending), self.batch_size):
+                batch = pending[i:i + self.batch_size]
+                features = [self._transcriber.audio_features(whisper.load_audio(path) if audio is None else audio) for path, audio, _ in batch]
+                for (path, _, content_hash), result in zip(batch, self._transcriber.transcribe_features(features)):
+                    self.save(path, content_hash, result)
+                    job["transcribed"] += 1
+        else:
+            for path, audio, content_hash in pending:
+                result = model.transcribe(path if audio is None else audio, language="ht", fp16=self.fp16)
+                self.save(path, content_hash, result)
+                job["transcribed"] += 1
+
+        return job
+
+    def run(self, audio_paths):
+        """
+        Fait passer chaque source par toutes les étapes.
+
+        :return: Nombre de segments transcrits et nombre d'erreurs par étape.
+        """
+        stages = [("load", self.load, 1), ("separate", self.separate, 1), ("split", self.split, self.split_workers), ("transcribe", self.transcribe, 1)]
+        # Files bornées entre étapes : une étape lente freine les précédentes au lieu d'accumuler en mémoire
+        queues = [queue.Queue()] + [queue.Queue(maxsize=self.queue_size) for _ in stages[1:]] + [queue.Queue()]
+
+        errors = {}
+        threads = []
+        for (name, func, workers), inbox, outbox in zip(stages, queues, queues[1:]):
+            threads += _run_stage(name, func, inbox, outbox, errors, workers)
+
+        for audio_path in audio_paths:
+            queues[0].put({"source": audio_path})
+        queues[0].put(_DONE)
+
+        transcribed = 0
+        progress = tqdm(total=len(audio_paths))
+        while True:
+            job = queues[-1].get()
+            if job is _DONE:
+                break
+            transcribed += job["transcribed"]
+            progress.update(1)
+            progress.set_postfix({name: q.qsize() for (name, _, _), q in zip(stages[1:], queues[1:-1])}, transcribed=transcribed)
+        progress.close()
+
+        for thread in threads:
+            thread.join()
+
+        return transcribed, errors
+
+def main():
+    parser = argparse.ArgumentParser(description='Run vocal extraction, silence splitting, short segment filtering, transcription and database load in one pass.')
+    parser.add_argument('input_dir', type=str, help='Directory containing the source recordings (mp3/wav)')
+    parser.add_argument('--work_dir', type=str, default="pipeline_work", help='Directory for intermediate vocal tracks and their manifest')
+    parser.add_argument('--audio_dir', type=str, default="public/audio", help='Directory where the segments are written')
+    parser.add_argument('--no_vocals', action='store_true', help='Sources are already vocal tracks: skip the Spleeter stage')
+    parser.add_argument('--silence_thresh', type=int, default=-40, help='Silence threshold in dB')
+    parser.add_argument('--min_silence_len', type=int, default=500, help='Minimum silence length in ms')
+    parser.add_argument('--max_segment_duration', type=int, default=10000, help='Maximum segment duration in ms')
+    parser.add_argument('--min_segment_duration', type=int, default=1000, help='Minimum segment duration in ms')
+    parser.add_argument('--min_duration', type=float, default=0.5, help='Segments shorter than this (seconds) are dropped')
+    parser.add_argument('--batch_size', '--batch-size', type=int, default=1, help='Number of clips decoded together in one encoder pass (1 = file by file)')
+    parser.add_argument('--split_workers', type=int, default=2, help='Number of threads splitting and writing segments')
+    parser.add_argument('--queue_size', type=int, default=2, help='Maximum number of files waiting between two stages')
+    parser.add_argument('--codec', type=str, choices=CODECS, default="wav", help='Output codec of the segments (flac: lossless, opus: web serving)')
+    parser.add_argument('--load_db', action='store_true', help='Load the transcriptions into Postgres (COPY + single merge) at the end')
+    parser.add_argument('--database_url', type=str, default=None, help='Postgres URL for --load_db (default: $DATABASE_URL)')
+    add_model_arguments(parser)
+    add_cache_arguments(parser)
+
+    args = parser.parse_args()
+    set_threads(args.threads, args.interop_threads)
+
+    audio_paths = [os.path.join(args.input_dir, f) for f in sorted(os.listdir(args.input_dir)) if f.lower().endswith(AUDIO_EXTENSIONS)]
+
+    pipeline = AudioPipeline(
+        args.work_dir,
+        args.audio_dir,
+        vocals=not args.no_vocals,
+        silence_thresh=args.silence_thresh,
+        min_silence_len=args.min_silence_len,
+        max_segment_duration=args.max_segment_duration,
+        min_segment_duration=args.min_segment_duration,
+        min_duration=args.min_duration,
+        model_name=args.model,
+        device=args.device,
+        precision=args.precision,
+        batch_size=args.batch_size,
+        split_workers=args.split_workers,
+        queue_size=args.queue_size,
+        codec=args.codec,
+        cache=cache_from_args(args)
+    )
+    transcribed, errors = pipeline.run(audio_paths)
+    print(f"✅ {len(audio_paths)} fichiers, {transcribed} segments transcrits, erreurs : {errors or 'aucune'}")
+    if pipeline.cache is not None:
+        print(pipeline.cache.summary())
+
+    pipeline.store.export_json(OUTPUT_FILE)
+    if args.load_db:
+        load_database(pipeline.store, args.database_url)
+
+if __name__ == "__main__":
+    main()
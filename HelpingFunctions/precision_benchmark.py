@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from audio_io import AUDIO_EXTENSIONS
+from benchmark import git_revision
+from instrumentation import peak_memory
+from packed_transcribe import error_rates
+from whisper_model import DEFAULT_MODEL, PRECISIONS
+
+
+def _transcribe_sample(audio_paths, model_name, device, precision, threads, interop_threads, language):
+    # Exécuté dans un processus neuf : threads, mémoire et temps de chargement propres à chaque configuration
+    sys.stdout = open(os.devnull, "w")
+    import whisper
+    from whisper_model import load_whisper_model, set_threads
+
+    set_threads(threads, interop_threads)
+    start = time.perf_counter()
+    model, fp16 = load_whisper_model(model_name, device, precision)
+    load_seconds = time.perf_counter() - start
+
+    audios = [whisper.load_audio(path) for path in audio_paths]
+    start = time.perf_counter()
+    texts = [model.transcribe(audio, language=language, fp16=fp16)["text"] for audio in audios]
+    elapsed = time.perf_counter() - start
+
+    return {
+        "texts": texts,
+        "audio_seconds": sum(len(audio) for audio in audios) / whisper.audio.SAMPLE_RATE,
+        "elapsed": elapsed,
+        "load_seconds": load_seconds,
+        **peak_memory()
+    }
+
+def run_precisions(audio_paths, precisions, model_name=DEFAULT_MODEL, device="cpu", threads=None, interop_threads=None, language="ht"):
+    """
+    Transcrit le même échantillon avec chaque précision et compare au résultat FP32.
+
+    La première précision de la liste doit être la référence (fp32) : la dérive
+    (WER/CER) de chaque configuration est mesurée par rapport à son texte.
+
+    :return: Générateur de dicts (une ligne JSON par configuration).
+    """
+    revision = git_revision()
+    context = get_context("spawn")
+    baseline = None
+    for precision in precisions:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(_transcribe_sample, audio_paths, model_name, device, precision, threads, interop_threads, language).result()
+
+        texts = result.pop("texts")
+        if baseline is None:
+            baseline = texts
+        yield {
+            "model": model_name,
+            "precision": precision,
+            "device": device,
+            "threads": threads,
+            "interop_threads": interop_threads,
+            "revision": revision,
+            "files": len(audio_paths),
+            **result,
+            "rtf": result["elapsed"] / result["audio_seconds"],
+            **error_rates(baseline, texts)
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare Whisper inference precisions on CPU: real-time factor and drift against the FP32 baseline.')
+    parser.add_argument('--audio_dir', type=str, default="public/audio", help='Directory containing the clips')
+    parser.add_argument('--sample_size', type=int, default=50, help='Number of clips in the sample')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the sample')
+    parser.add_argument('--model', type=str, default=DEFAULT_MODEL, help='Whisper model name')
+    parser.add_argument('--device', type=str, default="cpu", help='Device used for inference')
+    parser.add_argument('--precisions', type=str, default="fp32,int8", help=f'Comma-separated precisions, baseline first ({", ".join(PRECISIONS)})')
+    parser.add_argument('--threads', type=int, default=None, help='Number of PyTorch intra-op threads')
+    parser.add_argument('--interop_threads', type=int, default=None, help='Number of PyTorch inter-op threads')
+    parser.add_argument('--language', type=str, default="ht", help='Transcription language')
+    parser.add_argument('--output', type=str, default=None, help='Append JSON lines to this file (default: stdout)')
+
+    args = parser.parse_args()
+
+    precisions = [precision for precision in args.precisions.split(",") if precision]
+    unknown = [precision for precision in precisions if precision not in PRECISIONS]
+    if unknown:
+        parser.error(f"Précisions inconnues : {', '.join(unknown)}")
+
+    audio_paths = sorted(os.path.join(args.audio_dir, f) for f in os.listdir(args.audio_dir) if f.lower().endswith(AUDIO_EXTENSIONS))
+    random.Random(args.seed).shuffle(audio_paths)
+    audio_paths = audio_paths[:args.sample_size]
+
+    output = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for result in run_precisions(audio_paths, precisions, args.model, args.device, args.threads, args.interop_threads, args.language):
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            print(f"⏱️ {result['precision']} : RTF {result['rtf']:.3f}, WER {result['wer']:.2%}, CER {result['cer']:.2%} par rapport à {precisions[0]}, pic RSS {result['peak_rss_mb']:.0f} Mo", file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+if __name__ == "__main__":
+    main()
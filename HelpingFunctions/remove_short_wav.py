@@ -1,20 +1,25 @@
 import os
-import librosa
 import sys
 
+from audio_index import AudioIndex
+from audio_io import CODECS
+
+# Segments écrits par les étapes précédentes, quel que soit le codec choisi
+SEGMENT_EXTENSIONS = tuple(f".{codec}" for codec in CODECS)
+
 def remove_short_wav_files(directory, min_duration=0.5):
-    for filename in os.listdir(directory):
-        if filename.endswith(".wav"):
+    # Les durées viennent de l'index (en-têtes uniquement, fichiers inchangés jamais relus)
+    with AudioIndex(directory) as index:
+        index.scan(extensions=SEGMENT_EXTENSIONS)
+
+        for entry in index.files(max_duration=min_duration, extensions=SEGMENT_EXTENSIONS):
+            filename = entry["name"]
             file_path = os.path.join(directory, filename)
             try:
-                # Charger le fichier audio
-                y, sr = librosa.load(file_path, sr=None)
-                duration = librosa.get_duration(y=y, sr=sr)
-
                 # Supprimer le fichier si la durée est inférieure à min_duration
-                if duration < min_duration:
-                    os.remove(file_path)
-                    print(f"Supprimé: {filename} (durée: {duration:.2f} secondes)")
+                os.remove(file_path)
+                index.remove(filename)
+                print(f"Supprimé: {filename} (durée: {entry['duration']:.2f} secondes)")
             except Exception as e:
                 print(f"Erreur lors du traitement de {filename}: {e}")
 
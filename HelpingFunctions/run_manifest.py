@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+
+MANIFEST_FILE = ".manifest.jsonl"
+
+
+def file_content_hash(file_path, chunk_size=1 << 20):
+    """
+    Hash SHA-256 du contenu d'un fichier, lu par blocs.
+    """
+    hash_object = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            hash_object.update(block)
+    return hash_object.hexdigest()
+
+def generate_content_hash(source_hash, *parts, length=8):
+    """
+    Nom déterministe d'une sortie : hash du contenu source, des positions et des paramètres.
+
+    Relancer une étape sur la même source avec les mêmes paramètres redonne donc
+    exactement les mêmes noms de fichiers.
+    """
+    payload = json.dumps([source_hash, *parts], sort_keys=True, separators=(",", ":"))
+    hash_object = hashlib.sha256(payload.encode())
+    return hash_object.hexdigest()[:length]
+
+class RunManifest:
+    """
+    Journal JSONL des sources déjà traitées par une étape, stocké dans son répertoire de sortie.
+
+    Chaque ligne indique la source, son hash, les paramètres et les fichiers
+    produits. Une source est considérée comme faite si une ligne existe pour
+    le même hash et les mêmes paramètres et que tous ses fichiers existent encore.
+    """
+
+    def __init__(self, output_dir, stage, filename=MANIFEST_FILE):
+        self.output_dir = output_dir
+        self.stage = stage
+        self.path = os.path.join(output_dir, filename)
+        self.entries = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Dernière ligne tronquée par un arrêt brutal
+                        continue
+                    if entry.get("stage") == stage:
+                        self.entries[entry["key"]] = entry
+
+    @staticmethod
+    def make_key(source_hash, params):
+        return generate_content_hash(source_hash, params, length=64)
+
+    def get(self, source_hash, params):
+        """
+        Retourne l'entrée d'une source déjà traitée, ou None s'il faut la (re)traiter.
+        """
+        entry = self.entries.get(self.make_key(source_hash, params))
+        if entry is None:
+            return None
+        if not all(os.path.exists(os.path.join(self.output_dir, output)) for output in entry["outputs"]):
+            return None
+        return entry
+
+    def is_done(self, source_hash, params):
+        return self.get(source_hash, params) is not None
+
+    def record(self, source_path, source_hash, params, outputs):
+        """
+        Ajoute une ligne au journal une fois que tous les fichiers de la source sont écrits.
+
+        :param outputs: Chemins produits (relatifs au répertoire de sortie ou absolus).
+        """
+        entry = {
+            "stage": self.stage,
+            "key": self.make_key(source_hash, params),
+            "source": os.path.basename(source_path),
+            "source_hash": source_hash,
+            "params": params,
+            "outputs": [os.path.relpath(output, self.output_dir) for output in outputs],
+            "timestamp": datetime.utcnow().isoformat()
+        }
+
+        # Une seule écriture en mode ajout : plusieurs processus peuvent partager le journal
+        os.makedirs(self.output_dir, exist_ok=True)
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        self.entries[entry["key"]] = entry
+        return entry
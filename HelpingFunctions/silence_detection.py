@@ -0,0 +1,170 @@
+import argparse
+
+import numpy as np
+from pydub import AudioSegment, silence
+
+
+def audio_to_samples(audio):
+    """
+    Retourne les échantillons entrelacés d'un AudioSegment sous forme de tableau NumPy signé.
+    """
+    data = audio.raw_data
+    if audio.sample_width == 3:
+        # 24 bits : compléter chaque échantillon à 32 bits puis décaler pour garder le signe
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        padded = np.zeros((raw.shape[0], 4), dtype=np.uint8)
+        padded[:, 1:] = raw
+        return padded.view('<i4').reshape(-1) >> 8
+
+    dtype = {1: np.int8, 2: '<i2', 4: '<i4'}[audio.sample_width]
+    return np.frombuffer(data, dtype=dtype)
+
+def silence_threshold(silence_thresh, sample_width):
+    """
+    Convertit un seuil en dBFS vers une amplitude RMS, comme pydub.
+    """
+    max_possible_amplitude = (2 ** (sample_width * 8)) / 2
+    return (10 ** (silence_thresh / 20)) * max_possible_amplitude
+
+def ms_energies(samples, frame_rate, channels, n_ms):
+    """
+    Somme des carrés des échantillons pour chaque milliseconde.
+
+    La milliseconde m couvre les trames [int(m * frame_rate / 1000), int((m + 1) * frame_rate / 1000)),
+    exactement les bornes utilisées par le découpage des AudioSegment. Les trames
+    manquantes en fin de fichier comptent comme du silence, comme dans pydub.
+    """
+    # Entiers 64 bits tant que possible pour des sommes cumulées exactes sur plusieurs heures
+    dtype = np.int64 if samples.dtype.itemsize <= 2 else np.float64
+    frames = samples.reshape(-1, channels).astype(dtype)
+    frame_energy = np.square(frames).sum(axis=1)
+
+    bounds = (np.arange(n_ms + 1) * (frame_rate / 1000.0)).astype(np.int64)
+    cumulative = np.concatenate((np.zeros(1, dtype=dtype), np.cumsum(frame_energy)))
+    bounds_clipped = np.minimum(bounds, len(frame_energy))
+    return np.diff(cumulative[bounds_clipped]), np.diff(bounds) * channels
+
+def silent_window_starts(energies, counts, min_silence_len, threshold, seek_step=1):
+    """
+    Indices (en ms) des fenêtres de min_silence_len ms dont le RMS est sous le seuil.
+
+    Les fenêtres glissantes sont évaluées d'un coup par sommes cumulées sur les
+    énergies par milliseconde, au lieu d'un calcul audioop par position.
+    """
+    seg_len = len(energies)
+    if seg_len < min_silence_len:
+        return np.array([], dtype=np.int64)
+
+    last_slice_start = seg_len - min_silence_len
+    starts = np.arange(0, last_slice_start + 1, seek_step)
+    if last_slice_start % seek_step:
+        starts = np.append(starts, last_slice_start)
+
+    energy_sum = np.concatenate((np.zeros(1, dtype=energies.dtype), np.cumsum(energies)))
+    count_sum = np.concatenate((np.zeros(1, dtype=np.int64), np.cumsum(counts)))
+    window_energy = energy_sum[starts + min_silence_len] - energy_sum[starts]
+    window_count = count_sum[starts + min_silence_len] - count_sum[starts]
+
+    # audioop.rms tronque la racine à l'entier inférieur
+    rms = np.floor(np.sqrt(window_energy / np.maximum(window_count, 1)))
+    return starts[rms <= threshold]
+
+def merge_silent_starts(silence_starts, min_silence_len, seek_step=1):
+    """
+    Regroupe les débuts de fenêtres silencieuses en plages [début, fin], comme pydub.
+
+    Une nouvelle plage commence quand deux débuts consécutifs ne sont ni contigus
+    ni à moins de min_silence_len l'un de l'autre.
+    """
+    if len(silence_starts) == 0:
+        return []
+
+    silence_starts = np.asarray(silence_starts, dtype=np.int64)
+    steps = np.diff(silence_starts)
+    breaks = np.nonzero((steps != seek_step) & (steps > min_silence_len))[0]
+
+    range_starts = np.concatenate((silence_starts[:1], silence_starts[breaks + 1]))
+    range_ends = np.concatenate((silence_starts[breaks], silence_starts[-1:])) + min_silence_len
+
+    return [[int(start), int(end)] for start, end in zip(range_starts, range_ends)]
+
+def detect_silence(audio, min_silence_len=1000, silence_thresh=-16, seek_step=1):
+    """
+    Remplace pydub.silence.detect_silence en vectorisant le calcul du RMS avec NumPy.
+
+    Retourne exactement les mêmes plages [début_ms, fin_ms] que pydub.
+    """
+    seg_len = len(audio)
+    if seg_len < min_silence_len:
+        return []
+
+    samples = audio_to_samples(audio)
+    energies, counts = ms_energies(samples, audio.frame_rate, audio.channels, seg_len)
+    threshold = silence_threshold(silence_thresh, audio.sample_width)
+
+    silence_starts = silent_window_starts(energies, counts, min_silence_len, threshold, seek_step)
+    return merge_silent_starts(silence_starts, min_silence_len, seek_step)
+
+def segment_ranges(audio_len, silent_ranges, max_segment_duration=10000, min_segment_duration=1000):
+    """
+    Plages [début_ms, fin_ms] des segments entre les silences, découpés en
+    morceaux d'au plus max_segment_duration et filtrés par min_segment_duration.
+    """
+    bounds = []
+    start = 0
+    for start_silence, end_silence in silent_ranges:
+        bounds.append((start, start_silence))
+        start = end_silence
+    # Ajouter le dernier morceau
+    bounds.append((start, audio_len))
+
+    ranges = []
+    for chunk_start, chunk_end in bounds:
+        chunk_len = chunk_end - chunk_start
+        # Diviser le morceau en segments de max_segment_duration
+        for i in range(0, max(chunk_len, 0), max_segment_duration):
+            segment_len = min(max_segment_duration, chunk_len - i)
+            if segment_len >= min_segment_duration:
+                ranges.append((chunk_start + i, chunk_start + i + segment_len))
+
+    return ranges
+
+def split_ranges(audio, silence_thresh=-40, min_silence_len=500, max_segment_duration=10000, min_segment_duration=1000):
+    """
+    Plages des segments que split_audio_on_silence exporte pour cet AudioSegment.
+    """
+    silent_ranges = detect_silence(audio, min_silence_len=min_silence_len, silence_thresh=silence_thresh)
+    return segment_ranges(len(audio), silent_ranges, max_segment_duration, min_segment_duration)
+
+def check_parity(audio_path, silence_thresh=-40, min_silence_len=500):
+    """
+    Compare les plages de silence détectées avec celles de pydub sur un fichier.
+
+    :return: (plages NumPy, plages pydub)
+    """
+    audio = AudioSegment.from_file(audio_path)
+    fast = detect_silence(audio, min_silence_len=min_silence_len, silence_thresh=silence_thresh)
+    reference = silence.detect_silence(audio, min_silence_len=min_silence_len, silence_thresh=silence_thresh)
+    return fast, reference
+
+def main():
+    parser = argparse.ArgumentParser(description='Vérifier la détection de silence NumPy contre pydub.')
+    parser.add_argument('audio_paths', type=str, nargs='+', help='Fichiers audio à comparer')
+    parser.add_argument('--silence_thresh', type=int, default=-40, help='Silence threshold in dB')
+    parser.add_argument('--min_silence_len', type=int, default=500, help='Minimum silence length in ms')
+
+    args = parser.parse_args()
+
+    mismatches = 0
+    for audio_path in args.audio_paths:
+        fast, reference = check_parity(audio_path, args.silence_thresh, args.min_silence_len)
+        if fast == reference:
+            print(f"✅ {audio_path} : {len(fast)} plages identiques")
+        else:
+            mismatches += 1
+            print(f"❌ {audio_path} : NumPy {fast} != pydub {reference}")
+
+    raise SystemExit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
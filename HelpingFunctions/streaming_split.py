@@ -0,0 +1,266 @@
+import os
+import subprocess
+import wave
+
+import numpy as np
+from pydub.utils import get_encoder_name, mediainfo
+
+from audio_io import AudioWriter
+from silence_detection import silence_threshold
+
+SAMPLE_WIDTH = 2
+
+
+def read_pcm_blocks(audio_path, block_ms=10000):
+    """
+    Décode un fichier avec ffmpeg et le lit par blocs de block_ms millisecondes.
+
+    :return: (frame_rate, channels, générateur de blocs int16 (trames, canaux))
+    """
+    info = mediainfo(audio_path)
+    frame_rate = int(info['sample_rate'])
+    channels = int(info['channels'])
+
+    def blocks():
+        command = [get_encoder_name(), '-v', 'error', '-i', audio_path,
+                   '-f', 's16le', '-acodec', 'pcm_s16le', '-']
+        process = subprocess.Popen(command, stdout=subprocess.PIPE)
+        block_bytes = max(1, int(frame_rate * block_ms / 1000)) * channels * SAMPLE_WIDTH
+        try:
+            while True:
+                data = process.stdout.read(block_bytes)
+                if not data:
+                    break
+                # Ne garder que des trames complètes
+                usable = len(data) - len(data) % (channels * SAMPLE_WIDTH)
+                yield np.frombuffer(data[:usable], dtype='<i2').reshape(-1, channels)
+        finally:
+            process.stdout.close()
+            process.wait()
+
+    return frame_rate, channels, blocks()
+
+class StreamingSilenceSplitter:
+    """
+    Découpe un flux PCM sur les silences avec une mémoire bornée.
+
+    Reproduit split_audio_on_silence (fenêtres de min_silence_len ms évaluées à
+    chaque milliseconde, fusion des plages de silence, découpe en segments d'au
+    plus max_segment_duration) mais ne garde en mémoire que les dernières
+    max_segment_duration + min_silence_len millisecondes environ. L'état du
+    silence est conservé d'un bloc à l'autre et chaque segment est rendu dès
+    qu'il est fermé.
+    """
+
+    def __init__(self, frame_rate, channels, silence_thresh=-40, min_silence_len=500, max_segment_duration=10000, min_segment_duration=1000):
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.min_silence_len = min_silence_len
+        self.max_segment_duration = max_segment_duration
+        self.min_segment_duration = min_segment_duration
+        self.threshold = silence_threshold(silence_thresh, SAMPLE_WIDTH)
+
+        # Audio conservé à partir de la trame buffer_start
+        self.buffer = np.zeros((0, channels), dtype=np.int16)
+        self.buffer_start = 0
+        self.total_frames = 0
+
+        # Énergies par milliseconde à partir de energy_start, jusqu'à next_ms (exclu)
+        self.energies = np.zeros(0, dtype=np.int64)
+        self.energy_start = 0
+        self.next_ms = 0
+        # Prochaine fenêtre à évaluer
+        self.next_window = 0
+
+        # Plage de silence en cours : (début, dernier début de fenêtre silencieuse)
+        self.open_range = None
+        # Morceau parlé en cours : prochain segment à émettre à partir de next_piece
+        self.next_piece = 0
+
+    def _frame(self, ms):
+        return int(ms * (self.frame_rate / 1000.0))
+
+    def _slice(self, start_ms, end_ms):
+        start = self._frame(start_ms) - self.buffer_start
+        end = self._frame(end_ms) - self.buffer_start
+        segment = self.buffer[start:end]
+        missing = (end - start) - len(segment)
+        if missing:
+            # Comme pydub, compléter par du silence au-delà de la fin du fichier
+            segment = np.concatenate((segment, np.zeros((missing, self.channels), dtype=np.int16)))
+        return segment
+
+    def _pieces(self, end_ms, final):
+        """
+        Émet les segments du morceau en cours jusqu'à end_ms.
+        Si final est faux, seuls les segments complets sont émis.
+        """
+        pieces = []
+        while self.next_piece < end_ms:
+            piece_end = self.next_piece + self.max_segment_duration
+            if piece_end > end_ms:
+                if not final:
+                    break
+                piece_end = end_ms
+            if piece_end - self.next_piece >= self.min_segment_duration:
+                pieces.append((self.next_piece, piece_end, self._slice(self.next_piece, piece_end)))
+            self.next_piece = piece_end
+        if final:
+            self.next_piece = None
+        return pieces
+
+    def _compute_energies(self, n_ms):
+        if n_ms <= self.next_ms:
+            return
+        ms = np.arange(self.next_ms, n_ms + 1)
+        bounds = (ms * (self.frame_rate / 1000.0)).astype(np.int64)
+        bounds = np.minimum(bounds, self.total_frames) - self.buffer_start
+
+        frames = self.buffer[bounds[0]:bounds[-1]].astype(np.int64)
+        frame_energy = np.square(frames).sum(axis=1)
+        cumulative = np.concatenate((np.zeros(1, dtype=np.int64), np.cumsum(frame_energy)))
+
+        self.energies = np.concatenate((self.energies, np.diff(cumulative[bounds - bounds[0]])))
+        self.next_ms = n_ms
+
+    def _evaluate_windows(self, last_window):
+        """
+        Évalue les fenêtres next_window..last_window et fait avancer l'état du silence.
+        """
+        pieces = []
+        if last_window < self.next_window:
+            return pieces
+
+        length = self.min_silence_len
+        starts = np.arange(self.next_window, last_window + 1)
+        offset = self.energy_start
+
+        energy_sum = np.concatenate((np.zeros(1, dtype=np.int64), np.cumsum(self.energies)))
+        window_energy = energy_sum[starts - offset + length] - energy_sum[starts - offset]
+        window_frames = (((starts + length) * (self.frame_rate / 1000.0)).astype(np.int64)
+                         - (starts * (self.frame_rate / 1000.0)).astype(np.int64))
+        window_count = window_frames * self.channels
+        rms = np.floor(np.sqrt(window_energy / np.maximum(window_count, 1)))
+        silent = starts[rms <= self.threshold]
+
+        for start, prev in self._merge(silent):
+            if self.open_range is None or start != self.open_range[0]:
+                # Une nouvelle plage de silence ferme le morceau parlé en cours
+                if self.next_piece is not None:
+                    pieces.extend(self._pieces(start, final=True))
+            self.open_range = (start, prev)
+
+            if prev + length < last_window + 1:
+                # Plus aucune fenêtre silencieuse ne peut prolonger cette plage
+                self.open_range = None
+                self.next_piece = prev + length
+
+        self.next_window = last_window + 1
+
+        if self.next_piece is not None:
+            pieces.extend(self._pieces(self.next_window, final=False))
+
+        return pieces
+
+    def _merge(self, silent):
+        """
+        Regroupe les fenêtres silencieuses en plages (début, dernier début de fenêtre),
+        en prolongeant la plage ouverte du bloc précédent si besoin.
+        """
+        if self.open_range is not None:
+            silent = np.concatenate(([self.open_range[1]], silent))
+            first_start = self.open_range[0]
+        elif len(silent):
+            first_start = int(silent[0])
+        else:
+            return []
+
+        steps = np.diff(silent)
+        breaks = np.nonzero((steps != 1) & (steps > self.min_silence_len))[0]
+        range_starts = [first_start] + [int(s) for s in silent[breaks + 1]]
+        range_prevs = [int(s) for s in silent[breaks]] + [int(silent[-1])]
+        return list(zip(range_starts, range_prevs))
+
+    def _trim(self):
+        # Garder seulement l'audio encore nécessaire aux segments et aux fenêtres à venir
+        keep_ms = self.next_window if self.next_piece is None else min(self.next_piece, self.next_window)
+        keep_frame = min(self._frame(keep_ms), self._frame(self.next_ms))
+        drop = keep_frame - self.buffer_start
+        if drop > 0:
+            self.buffer = self.buffer[drop:]
+            self.buffer_start = keep_frame
+
+        drop_ms = self.next_window - self.energy_start
+        if drop_ms > 0:
+            self.energies = self.energies[drop_ms:]
+            self.energy_start = self.next_window
+
+    def feed(self, frames):
+        """
+        Ajoute un bloc de trames int16 (trames, canaux).
+
+        :return: Liste des segments fermés (début_ms, fin_ms, trames).
+        """
+        self.buffer = np.concatenate((self.buffer, frames))
+        self.total_frames += len(frames)
+
+        # Millisecondes complètes disponibles
+        n_ms = int(self.total_frames * 1000 // self.frame_rate)
+        while n_ms > 0 and self._frame(n_ms) > self.total_frames:
+            n_ms -= 1
+        self._compute_energies(n_ms)
+
+        pieces = self._evaluate_windows(self.next_ms - self.min_silence_len)
+        self._trim()
+        return pieces
+
+    def finish(self):
+        """
+        Termine le flux et retourne les derniers segments.
+        """
+        seg_len = round(1000 * (self.total_frames / self.frame_rate))
+        self._compute_energies(seg_len)
+
+        pieces = self._evaluate_windows(seg_len - self.min_silence_len)
+        if self.open_range is not None:
+            self.next_piece = self.open_range[1] + self.min_silence_len
+            self.open_range = None
+        if self.next_piece is not None:
+            pieces.extend(self._pieces(seg_len, final=True))
+        return pieces
+
+def write_wav(path, frames, frame_rate):
+    with wave.open(path, 'wb') as wav_file:
+        wav_file.setnchannels(frames.shape[1])
+        wav_file.setsampwidth(SAMPLE_WIDTH)
+        wav_file.setframerate(frame_rate)
+        wav_file.writeframes(frames.astype('<i2').tobytes())
+    return path
+
+def stream_split_on_silence(audio_path, output_path, name_segment, silence_thresh=-40, min_silence_len=500, max_segment_duration=10000, min_segment_duration=1000, block_ms=10000, codec="wav", encode_workers=4):
+    """
+    Version en flux de split_audio_on_silence : la mémoire reste constante quelle
+    que soit la durée du fichier et chaque segment est écrit dès sa fermeture.
+
+    :param name_segment: Fonction (début_ms, fin_ms) -> nom du fichier de sortie.
+    :param codec: wav, flac ou opus ; l'encodage se fait sur encode_workers threads.
+    :return: Liste des chemins écrits.
+    """
+    frame_rate, channels, blocks = read_pcm_blocks(audio_path, block_ms)
+    splitter = StreamingSilenceSplitter(frame_rate, channels, silence_thresh, min_silence_len, max_segment_duration, min_segment_duration)
+
+    # Le nombre d'écritures en attente est borné : la mémoire reste constante
+    with AudioWriter(encode_workers) as writer:
+        def export(pieces):
+            for start_ms, end_ms, frames in pieces:
+                segment_path = os.path.join(output_path, name_segment(start_ms, end_ms))
+                if codec == "wav":
+                    writer.submit(write_wav, segment_path, frames, frame_rate)
+                else:
+                    writer.write(segment_path, frames.astype('<i2'), frame_rate, codec)
+
+        for block in blocks:
+            export(splitter.feed(block))
+        export(splitter.finish())
+
+    return writer.written
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Les scripts de HelpingFunctions s'importent entre eux par leur nom, comme lancés depuis ce répertoire
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
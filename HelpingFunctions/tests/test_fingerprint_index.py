@@ -0,0 +1,44 @@
+import numpy as np
+
+from benchmark import synthetic_speech
+from fingerprint_index import BER_THRESHOLD, FingerprintAccumulator, bit_error_rate, fingerprint
+
+
+def _paused_clip(duration, rng):
+    """
+    Clip surtout silencieux : une seule phrase sur un cinquième de la durée, le reste au bruit de fond.
+    """
+    speech = synthetic_speech(duration, rng)
+    mask = np.zeros(len(speech), dtype=np.float32)
+    start = rng.integers(0, len(speech) * 4 // 5)
+    mask[start:start + len(speech) // 5] = 1
+    return speech * mask + rng.normal(0, 1e-4, len(speech)).astype(np.float32)
+
+def test_unrelated_clips_with_pauses_stay_above_threshold():
+    rng = np.random.default_rng(0)
+    for duration in (1.5, 5, 40):
+        fingerprints = [fingerprint(clip) for clip in [_paused_clip(duration, rng) for _ in range(4)] + [synthetic_speech(duration, rng) for _ in range(4)]]
+        for i, first in enumerate(fingerprints):
+            for second in fingerprints[i + 1:]:
+                assert bit_error_rate(first, second) > BER_THRESHOLD
+
+def test_altered_copy_stays_below_threshold():
+    rng = np.random.default_rng(1)
+    for clip in (synthetic_speech(5, rng), _paused_clip(20, rng)):
+        copy = np.clip(0.5 * clip + rng.normal(0, 0.002, len(clip)), -1, 1).astype(np.float32)
+        assert bit_error_rate(fingerprint(clip), fingerprint(copy)) < BER_THRESHOLD
+
+def test_streaming_matches_whole_clip():
+    rng = np.random.default_rng(2)
+    # Assez long pour que les compartiments de trames soient fusionnés
+    clip = synthetic_speech(90, rng)
+    accumulator = FingerprintAccumulator()
+    position = 0
+    while position < len(clip):
+        size = int(rng.integers(1, 40000))
+        accumulator.update(clip[position:position + size])
+        position += size
+    assert accumulator.digest() == fingerprint(clip)
+
+def test_silence_has_no_fingerprint():
+    assert fingerprint(np.zeros(16000, dtype=np.float32)) is None
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from pydub import AudioSegment, silence
+
+from silence_detection import detect_silence, split_ranges
+
+SILENCE_THRESH = -40
+MIN_SILENCE_LEN = 300
+
+
+def _synthetic_audio(sample_width, channels, frame_rate, seed):
+    """
+    AudioSegment de 3 s : rafales de bruit séparées de pauses, certaines juste au-dessus ou en dessous du seuil.
+    """
+    rng = np.random.default_rng(seed)
+    frames = 3 * frame_rate
+    full_scale = 2 ** (8 * sample_width - 1) - 1
+    level = np.zeros(frames)
+    position = 0
+    while position < frames:
+        length = int(rng.uniform(0.05, 0.6) * frame_rate)
+        # Parole, silence franc ou bruit de fond proche du seuil de -40 dBFS
+        level[position:position + length] = rng.choice([10 ** (-6 / 20), 0.0, 10 ** (-41 / 20), 10 ** (-39 / 20)])
+        position += length
+    samples = rng.normal(0, 1, (frames, channels)) * level[:, None] * full_scale
+    samples = np.clip(np.round(samples), -full_scale, full_scale)
+    dtype = {1: np.int8, 2: "<i2", 4: "<i4"}[sample_width]
+    return AudioSegment(data=samples.astype(dtype).tobytes(), sample_width=sample_width, frame_rate=frame_rate, channels=channels)
+
+def _reference_split_ranges(audio, max_segment_duration, min_segment_duration):
+    # Découpage historique de split_audio_on_silence, sur les silences de pydub et les tranches d'AudioSegment
+    ranges = []
+    start = 0
+    silent_ranges = silence.detect_silence(audio, min_silence_len=MIN_SILENCE_LEN, silence_thresh=SILENCE_THRESH)
+    for start_silence, end_silence in silent_ranges + [(len(audio), None)]:
+        chunk = audio[start:start_silence]
+        for i in range(0, len(chunk), max_segment_duration):
+            segment = chunk[i:i + max_segment_duration]
+            if len(segment) >= min_segment_duration:
+                ranges.append((start + i, start + i + len(segment)))
+        start = end_silence
+    return ranges
+
+@pytest.mark.parametrize("frame_rate", [8000, 16000, 22050, 44100])
+@pytest.mark.parametrize("channels", [1, 2])
+@pytest.mark.parametrize("sample_width", [1, 2, 4])
+def test_matches_pydub(sample_width, channels, frame_rate):
+    audio = _synthetic_audio(sample_width, channels, frame_rate, seed=sample_width * 100 + channels * 10 + frame_rate)
+
+    reference = silence.detect_silence(audio, min_silence_len=MIN_SILENCE_LEN, silence_thresh=SILENCE_THRESH)
+    assert reference, "le clip doit contenir des silences pour que la comparaison ait un sens"
+    assert detect_silence(audio, min_silence_len=MIN_SILENCE_LEN, silence_thresh=SILENCE_THRESH) == reference
+
+    expected = _reference_split_ranges(audio, max_segment_duration=700, min_segment_duration=200)
+    assert split_ranges(audio, SILENCE_THRESH, MIN_SILENCE_LEN, max_segment_duration=700, min_segment_duration=200) == expected
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+
+CACHE_DIR = ".transcription_cache"
+CACHE_MAX_MB = 512
+
+
+def transcription_params(model_name, precision, language, **options):
+    """
+    Tout ce qui, en plus du contenu audio, détermine le texte produit par Whisper.
+
+    :param precision: Précision résolue (resolve_precision) : fp16, fp32 et int8 ne donnent pas exactement le même texte.
+    :param options: Options de décodage (word_timestamps, mode de regroupement, seuils de cascade...).
+    """
+    return {"model": model_name, "precision": precision, "language": language, **options}
+
+def _to_json(value):
+    # Scalaires et tableaux NumPy présents dans les segments (probabilités des mots...)
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Type non sérialisable : {type(value).__name__}")
+
+class TranscriptionCache:
+    """
+    Cache disque des résultats de model.transcribe, indexés par le hash du contenu audio et les paramètres de transcription.
+
+    Un clip déjà transcrit avec le même modèle, la même précision, la même
+    langue et les mêmes options n'est jamais renvoyé au modèle, quel que soit
+    son nom ou le script qui le transcrit. Chaque entrée est un petit fichier
+    JSON écrit de façon atomique : plusieurs processus peuvent partager le
+    même répertoire. Les entrées les moins récemment utilisées sont supprimées
+    dès que le cache dépasse max_bytes.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        # Taille tenue à jour à chaque écriture : le répertoire n'est reparcouru que pour évincer
+        self.total = sum(size for _, size, _ in self._entries())
+
+    def _path(self, content_hash, params):
+        payload = json.dumps([content_hash, params], sort_keys=True, separators=(",", ":"))
+        return os.path.join(self.cache_dir, f"{hashlib.sha256(payload.encode()).hexdigest()}.json")
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return entries
+
+    def get(self, content_hash, params):
+        """
+        :return: Résultat enregistré pour ce contenu et ces paramètres, ou None.
+        """
+        path = self._path(content_hash, params)
+        try:
+            with open(path, encoding="utf-8") as f:
+                result = json.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except ValueError:
+            # Fichier illisible : le clip sera retranscrit et l'entrée réécrite
+            self.misses += 1
+            return None
+
+        # La date de modification sert d'horodatage d'utilisation pour l'éviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return result
+
+    def put(self, content_hash, params, result):
+        path = self._path(content_hash, params)
+        data = json.dumps(result, ensure_ascii=False, default=_to_json).encode("utf-8")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        self.total += len(data)
+        if self.total > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Supprime les entrées les moins récemment utilisées jusqu'à repasser sous max_bytes.
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self.total = total
+
+    def summary(self):
+        return f"💾 Cache de transcription : {self.hits} résultats repris, {self.misses} transcrits"
+
+def add_cache_arguments(parser):
+    """
+    Options du cache de transcription : répertoire, taille maximale, désactivation.
+    """
+    parser.add_argument('--cache_dir', type=str, default=CACHE_DIR, help='Directory of the transcription result cache (can be shared between runs and scripts)')
+    parser.add_argument('--cache_max_mb', type=int, default=CACHE_MAX_MB, help='Maximum size of the transcription cache in MB (least recently used results are evicted)')
+    parser.add_argument('--no_cache', action='store_true', help='Always run the model, without reading or writing the transcription cache')
+
+def cache_from_args(args):
+    """
+    Cache décrit par les options de add_cache_arguments, ou None avec --no_cache.
+    """
+    if args.no_cache:
+        return None
+    return TranscriptionCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
@@ -0,0 +1,142 @@
+import queue
+import threading
+import time
+
+from tqdm import tqdm
+
+from instrumentation import Metrics
+
+# Fréquence des signaux décodés par Whisper
+SAMPLE_RATE = 16000
+
+# Marque de fin de flux dans les files
+_DONE = object()
+
+
+class TranscriptionPipeline:
+    """
+    Transcription en trois étages reliés par des files bornées.
+
+    - décodage : plusieurs threads décodent (ffmpeg) et calculent les fenêtres
+      log-mel des fichiers suivants pendant que le modèle travaille ;
+    - inférence : le thread principal vide la file de préchargement en continu
+      et transcrit par lots de batch_size ;
+    - écriture : un thread dédié enregistre les résultats (on_result), dans
+      l'ordre où ils sortent du modèle.
+
+    Les files bornées limitent la mémoire : les décodeurs attendent quand le
+    modèle a prefetch fichiers d'avance.
+    """
+
+    def __init__(self, transcriber, batch_size=1, decode_workers=2, prefetch=8, metrics=None):
+        """
+        :param transcriber: BatchedTranscriber (load_features, transcribe_single, transcribe_features).
+        :param metrics: Metrics qui reçoit les temps de décodage, d'inférence et d'écriture.
+        """
+        self.metrics = metrics or Metrics("transcription_pipeline")
+        self.transcriber = transcriber
+        self.batch_size = max(1, batch_size)
+        self.decode_workers = max(1, decode_workers)
+        self.prefetch = max(self.batch_size, prefetch)
+
+    def _decode(self, paths, features):
+        while True:
+            try:
+                path = paths.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                with self.metrics.stage("decode", path) as record:
+                    feature = self.transcriber.load_features(path)
+                    record["audio_seconds"] = len(feature["audio"]) / SAMPLE_RATE
+                features.put((path, feature, None))
+            except Exception as e:
+                features.put((path, None, e))
+        features.put(_DONE)
+
+    def _write(self, results, features, on_result, progress):
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            try:
+                with self.metrics.stage("write", item[0]):
+                    on_result(*item)
+            except Exception as e:
+                print(f"❌ Erreur lors de l'enregistrement de {item[0]} : {e}")
+            progress.update(1)
+            progress.set_postfix(prefetch=features.qsize(), write=results.qsize())
+
+    def _transcribe(self, batch):
+        if self.batch_size == 1:
+            # Même appel que le chemin fichier par fichier
+            return [self.transcriber.transcribe_single(feature["audio"]) for feature in batch]
+        return self.transcriber.transcribe_features(batch)
+
+    def run(self, audio_paths, on_result):
+        """
+        Transcrit audio_paths et appelle on_result(chemin, résultat, erreur) depuis le thread d'écriture.
+
+        :return: dict de statistiques (fichiers, temps total, temps d'attente du modèle).
+        """
+        paths = queue.Queue()
+        for path in audio_paths:
+            paths.put(path)
+        features = queue.Queue(maxsize=self.prefetch)
+        results = queue.Queue(maxsize=self.prefetch)
+
+        progress = tqdm(total=len(audio_paths))
+        decoders = [threading.Thread(target=self._decode, args=(paths, features), daemon=True) for _ in range(self.decode_workers)]
+        writer = threading.Thread(target=self._write, args=(results, features, on_result, progress), daemon=True)
+        for thread in decoders:
+            thread.start()
+        writer.start()
+
+        start = time.perf_counter()
+        idle = 0.0
+        running = self.decode_workers
+
+        while running:
+            # Attendre au moins un fichier prêt, puis compléter le lot avec ce qui est déjà décodé
+            wait_start = time.perf_counter()
+            item = features.get()
+            idle += time.perf_counter() - wait_start
+
+            batch_paths = []
+            batch = []
+            while True:
+                if item is _DONE:
+                    running -= 1
+                elif item[2] is not None:
+                    results.put(item)
+                else:
+                    batch_paths.append(item[0])
+                    batch.append(item[1])
+
+                if len(batch) >= self.batch_size or not running:
+                    break
+                try:
+                    item = features.get_nowait()
+                except queue.Empty:
+                    break
+
+            if not batch:
+                continue
+
+            try:
+                with self.metrics.stage("inference", audio_seconds=sum(len(feature["audio"]) for feature in batch) / SAMPLE_RATE):
+                    outputs = self._transcribe(batch)
+            except Exception as e:
+                for path in batch_paths:
+                    results.put((path, None, e))
+                continue
+
+            for path, output in zip(batch_paths, outputs):
+                results.put((path, output, None))
+
+        results.put(_DONE)
+        writer.join()
+        progress.close()
+
+        elapsed = time.perf_counter() - start
+        return {"files": len(audio_paths), "elapsed": elapsed, "model_idle": idle}
@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+
+STORE_FILE = "transcription_batch.jsonl"
+EXPORT_FILE = "transcription_batch.json"
+
+
+class TranscriptionStore:
+    """
+    Stockage des transcriptions en JSONL, en ajout seul.
+
+    Chaque transcription est une ligne écrite en une seule opération puis
+    synchronisée sur disque (fsync) : un arrêt brutal ne peut perdre ou tronquer
+    que la dernière ligne, jamais les précédentes. Les noms déjà transcrits sont
+    gardés dans un index en mémoire construit en une passe à l'ouverture.
+    """
+
+    def __init__(self, path=STORE_FILE, legacy_json=EXPORT_FILE):
+        self.path = path
+        self.names = set()
+
+        # Première utilisation : reprendre le contenu de l'ancien fichier JSON
+        if not os.path.exists(self.path) and legacy_json and os.path.exists(legacy_json):
+            with open(legacy_json, "r", encoding="utf-8") as f:
+                legacy = json.load(f)
+            self._write_lines(self.path, legacy)
+
+        self._drop_truncated_tail()
+        for entry in self.entries():
+            self.names.add(entry["name"])
+
+    def _drop_truncated_tail(self):
+        # Une ligne sans retour à la ligne final vient d'une écriture interrompue : la retirer
+        # pour que le prochain ajout ne soit pas collé à ses restes
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                step = min(4096, position)
+                f.seek(position - step)
+                block = f.read(step)
+                newline = block.rfind(b"\n")
+                if newline != -1:
+                    position = position - step + newline + 1
+                    break
+                position -= step
+            if position != end:
+                f.truncate(position)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    def entries(self):
+        """
+        Parcourt les transcriptions stockées, en ignorant une éventuelle dernière ligne tronquée.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def append(self, entry):
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.names.add(entry["name"])
+
+    def latest(self):
+        """
+        Dernière transcription de chaque fichier, dans l'ordre de première apparition.
+        """
+        results = {}
+        for entry in self.entries():
+            results[entry["name"]] = entry
+        return list(results.values())
+
+    def export_json(self, output_file=EXPORT_FILE):
+        """
+        Écrit le tableau JSON lu par update-batch.cjs, de façon atomique.
+        """
+        tmp_file = output_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.latest(), f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, output_file)
+        return output_file
+
+    def compact(self):
+        """
+        Réécrit le JSONL sans doublons ni ligne tronquée.
+        """
+        self._write_lines(self.path, self.latest())
+
+    @staticmethod
+    def _write_lines(path, entries):
+        tmp_file = path + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Exporter ou compacter le stockage JSONL des transcriptions.')
+    parser.add_argument('command', choices=['export', 'compact'], help='export : écrit le JSON pour update-batch.cjs ; compact : réécrit le JSONL')
+    parser.add_argument('--store', type=str, default=STORE_FILE, help='Fichier JSONL des transcriptions')
+    parser.add_argument('--output', type=str, default=EXPORT_FILE, help='Fichier JSON exporté')
+
+    args = parser.parse_args()
+
+    store = TranscriptionStore(args.store)
+    if args.command == 'compact':
+        store.compact()
+        print(f"📦 {len(store)} transcriptions compactées dans : {args.store}")
+    else:
+        store.export_json(args.output)
+        print(f"📄 {len(store)} transcriptions exportées dans : {args.output}")
+
+if __name__ == "__main__":
+    main()
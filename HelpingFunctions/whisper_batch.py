@@ -0,0 +1,169 @@
+import torch
+import whisper
+from whisper.audio import SAMPLE_RATE
+from whisper.audio import N_FRAMES, N_SAMPLES, log_mel_spectrogram, pad_or_trim
+from whisper.decoding import DecodingOptions
+from whisper.tokenizer import get_tokenizer
+
+from instrumentation import Metrics
+
+# Seuils par défaut de model.transcribe
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+
+def load_features(audio_path, n_mels):
+    """
+    Décode un fichier et calcule sa fenêtre log-mel de 30 s exactement comme model.transcribe.
+
+    :return: dict avec l'audio (gardé pour un éventuel repli), la fenêtre mel et le nombre de trames utiles.
+    """
+    return audio_features(whisper.load_audio(audio_path), n_mels)
+
+def audio_features(audio, n_mels):
+    """
+    Comme load_features, pour un signal déjà en mémoire (float32 mono à 16 kHz).
+    """
+    mel = log_mel_spectrogram(audio, n_mels, padding=N_SAMPLES)
+    content_frames = mel.shape[-1] - N_FRAMES
+    segment_size = min(N_FRAMES, content_frames)
+    return {
+        "audio": audio,
+        "mel": pad_or_trim(mel[:, :segment_size], N_FRAMES),
+        "content_frames": content_frames
+    }
+
+class BatchedTranscriber:
+    """
+    Transcrit plusieurs clips courts (une seule fenêtre de 30 s chacun) en un passage de l'encodeur.
+
+    Les fenêtres log-mel des clips sont empilées puis décodées ensemble en
+    greedy, avec les mêmes options que la première fenêtre de model.transcribe.
+    Un résultat n'est gardé que si model.transcribe se serait arrêté là : pas
+    de repli en température, pas de fenêtre suivante, pas de segment vidé. Les
+    autres clips sont retranscrits un par un avec model.transcribe, ce qui
+    garantit un texte identique au chemin fichier par fichier.
+    """
+
+    def __init__(self, model, language="ht", fp16=None):
+        self.model = model
+        self.language = language
+        # Même choix que model.transcribe : FP16 sauf sur CPU
+        self.fp16 = model.device.type != "cpu" if fp16 is None else fp16
+        self.dtype = torch.float16 if self.fp16 else torch.float32
+        self.tokenizer = get_tokenizer(
+            model.is_multilingual,
+            num_languages=model.num_languages,
+            language=language,
+            task="transcribe"
+        )
+        self.options = DecodingOptions(language=language, fp16=self.fp16, prompt=[], temperature=0.0)
+        self.input_stride = N_FRAMES // model.dims.n_audio_ctx
+
+    def load_features(self, audio_path):
+        return load_features(audio_path, self.model.dims.n_mels)
+
+    def audio_features(self, audio):
+        return audio_features(audio, self.model.dims.n_mels)
+
+    def transcribe_single(self, audio):
+        return self.model.transcribe(audio, language=self.language, fp16=self.fp16)
+
+    def _accept(self, result, content_frames):
+        """
+        Retourne le texte de model.transcribe si la fenêtre décodée suffit, sinon None.
+        """
+        if result.compression_ratio > COMPRESSION_RATIO_THRESHOLD or result.avg_logprob < LOGPROB_THRESHOLD:
+            return None
+        if result.no_speech_prob > NO_SPEECH_THRESHOLD:
+            return None
+
+        tokens = torch.tensor(result.tokens)
+        timestamp_begin = self.tokenizer.timestamp_begin
+        timestamp_tokens = tokens.ge(timestamp_begin)
+        single_timestamp_ending = timestamp_tokens[-2:].tolist() == [False, True]
+        consecutive = (torch.where(timestamp_tokens[:-1] & timestamp_tokens[1:])[0] + 1).tolist()
+
+        if consecutive:
+            slices = consecutive + ([len(tokens)] if single_timestamp_ending else [])
+            if slices[-1] != len(tokens):
+                # Des tokens après le dernier horodatage seraient ignorés par transcribe
+                return None
+            if not single_timestamp_ending:
+                last_timestamp_pos = tokens[slices[-1] - 1].item() - timestamp_begin
+                if last_timestamp_pos * self.input_stride < content_frames:
+                    # transcribe décoderait une fenêtre de plus à partir de ce point
+                    return None
+
+            last_slice = 0
+            for current_slice in slices:
+                sliced_tokens = tokens[last_slice:current_slice]
+                start = sliced_tokens[0].item() - timestamp_begin
+                end = sliced_tokens[-1].item() - timestamp_begin
+                if start == end or self.tokenizer.decode(sliced_tokens.tolist()).strip() == "":
+                    # transcribe viderait ce segment
+                    return None
+                last_slice = current_slice
+        elif self.tokenizer.decode(result.tokens).strip() == "":
+            return None
+
+        return self.tokenizer.decode(result.tokens)
+
+    def transcribe_features(self, features):
+        """
+        Transcrit un lot de fenêtres préparées par load_features.
+
+        :return: Liste de dicts {"text": ...} dans l'ordre du lot.
+        """
+        results = [None] * len(features)
+        batch_indices = [i for i, feature in enumerate(features) if feature["content_frames"] <= N_FRAMES]
+
+        if batch_indices:
+            mel = torch.stack([features[i]["mel"] for i in batch_indices]).to(self.model.device).to(self.dtype)
+            decoded = whisper.decode(self.model, mel, self.options)
+            for i, result in zip(batch_indices, decoded):
+                text = self._accept(result, features[i]["content_frames"])
+                if text is not None:
+                    results[i] = {"text": text, "language": self.language}
+
+        # Clips longs ou fenêtres qui demandent plus qu'un passage : chemin fichier par fichier
+        for i, feature in enumerate(features):
+            if results[i] is None:
+                results[i] = self.transcribe_single(feature["audio"])
+
+        return results
+
+    def transcribe_paths(self, audio_paths, batch_size=8, metrics=None):
+        """
+        Transcrit des fichiers par lots de batch_size.
+
+        :param metrics: Metrics qui reçoit le temps de décodage par fichier et d'inférence par lot.
+        :return: Générateur de (chemin, résultat, erreur).
+        """
+        metrics = metrics or Metrics("whisper_batch")
+        for i in range(0, len(audio_paths), batch_size):
+            batch_paths = []
+            features = []
+            for audio_path in audio_paths[i:i + batch_size]:
+                try:
+                    with metrics.stage("decode", audio_path) as record:
+                        features.append(self.load_features(audio_path))
+                        record["audio_seconds"] = len(features[-1]["audio"]) / SAMPLE_RATE
+                    batch_paths.append(audio_path)
+                except Exception as e:
+                    yield audio_path, None, e
+
+            if not features:
+                continue
+
+            try:
+                with metrics.stage("inference", audio_seconds=sum(len(feature["audio"]) for feature in features) / SAMPLE_RATE):
+                    results = self.transcribe_features(features)
+            except Exception as e:
+                for audio_path in batch_paths:
+                    yield audio_path, None, e
+                continue
+
+            for audio_path, result in zip(batch_paths, results):
+                yield audio_path, result, None
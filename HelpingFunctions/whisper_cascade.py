@@ -0,0 +1,83 @@
+from instrumentation import Metrics
+from whisper_model import DEFAULT_MODEL, load_whisper_model
+
+# Seuils d'escalade, plus stricts que les seuils de repli de model.transcribe (-1.0, 2.4, 0.6)
+LOGPROB_THRESHOLD = -0.6
+COMPRESSION_RATIO_THRESHOLD = 2.2
+NO_SPEECH_THRESHOLD = 0.5
+
+
+def escalation_reason(result, logprob_threshold=LOGPROB_THRESHOLD, compression_ratio_threshold=COMPRESSION_RATIO_THRESHOLD,
+                      no_speech_threshold=NO_SPEECH_THRESHOLD):
+    """
+    Raison de retranscrire un résultat de model.transcribe avec le grand modèle, ou None s'il est jugé fiable.
+
+    Un seul segment douteux suffit : faible log-probabilité moyenne, taux de
+    compression élevé (texte répétitif) ou forte probabilité d'absence de parole.
+    """
+    segments = result.get("segments") or []
+    if not segments or not result["text"].strip():
+        return "empty"
+    for segment in segments:
+        if segment["avg_logprob"] < logprob_threshold:
+            return "avg_logprob"
+        if segment["compression_ratio"] > compression_ratio_threshold:
+            return "compression_ratio"
+        if segment["no_speech_prob"] > no_speech_threshold:
+            return "no_speech_prob"
+    return None
+
+class CascadeTranscriber:
+    """
+    Transcrit d'abord avec un petit modèle et ne relance le grand modèle que sur les clips douteux.
+
+    Le grand modèle n'est chargé qu'à la première escalade. Chaque résultat
+    porte le nom du modèle qui l'a produit ("model") et, s'il y a eu escalade,
+    la raison ("escalated").
+    """
+
+    def __init__(self, model, model_name, fp16=None, escalation_model=DEFAULT_MODEL, device=None, precision=None,
+                 language="ht", logprob_threshold=LOGPROB_THRESHOLD, compression_ratio_threshold=COMPRESSION_RATIO_THRESHOLD,
+                 no_speech_threshold=NO_SPEECH_THRESHOLD, metrics=None):
+        self.model = model
+        self.model_name = model_name
+        self.fp16 = fp16
+        self.escalation_model = escalation_model
+        self.device = device
+        self.precision = precision
+        self.language = language
+        self.thresholds = (logprob_threshold, compression_ratio_threshold, no_speech_threshold)
+        self.metrics = metrics or Metrics("whisper_cascade")
+        self.large = None
+        self.large_fp16 = None
+        self.counts = {"files": 0, "escalated": 0}
+
+    def _load_large(self):
+        if self.large is None:
+            with self.metrics.stage("model_load"):
+                self.large, self.large_fp16 = load_whisper_model(self.escalation_model, self.device, self.precision)
+        return self.large
+
+    def transcribe(self, audio, audio_seconds=None, file=None):
+        """
+        :param audio: Chemin ou signal float32 à 16 kHz, comme pour model.transcribe.
+        :return: Résultat de model.transcribe complété de "model" (et "escalated" le cas échéant).
+        """
+        self.counts["files"] += 1
+        with self.metrics.stage("first_pass", file, audio_seconds):
+            result = self.model.transcribe(audio, language=self.language, fp16=self.fp16)
+
+        reason = escalation_reason(result, *self.thresholds)
+        if reason is None:
+            return dict(result, model=self.model_name)
+
+        self.counts["escalated"] += 1
+        large = self._load_large()
+        with self.metrics.stage("escalation", file, audio_seconds):
+            result = large.transcribe(audio, language=self.language, fp16=self.large_fp16)
+        return dict(result, model=self.escalation_model, escalated=reason)
+
+    def summary(self):
+        files, escalated = self.counts["files"], self.counts["escalated"]
+        share = f" ({escalated / files:.0%})" if files else ""
+        return f"🪜 {files} clips transcrits avec {self.model_name}, {escalated}{share} relancés avec {self.escalation_model}"
@@ -0,0 +1,100 @@
+import time
+
+DEFAULT_MODEL = "large-v3"
+# int8 : quantification dynamique des couches linéaires, pour les machines sans GPU
+PRECISIONS = ("fp16", "fp32", "int8")
+
+
+def resolve_device(device=None):
+    """
+    Device demandé, ou CUDA s'il est disponible et CPU sinon.
+    """
+    if device:
+        return device
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def set_threads(threads=None, interop_threads=None):
+    """
+    Nombre de threads de PyTorch dans une opération (intra-op) et entre opérations (inter-op).
+
+    À appeler au démarrage : le nombre de threads inter-op ne peut plus
+    changer une fois qu'un calcul parallèle a eu lieu.
+    """
+    if not threads and not interop_threads:
+        return
+    import torch
+
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        torch.set_num_interop_threads(interop_threads)
+    print(f"🧵 Threads PyTorch : {torch.get_num_threads()} intra-op, {torch.get_num_interop_threads()} inter-op")
+
+def quantize_int8(model):
+    """
+    Quantifie en int8 (poids, activations quantifiées à la volée) toutes les couches linéaires d'un modèle Whisper sur CPU.
+
+    Les convolutions d'entrée, les normalisations et la projection finale sur
+    le vocabulaire (produit avec la matrice d'embedding) restent en FP32.
+    """
+    import torch
+    import whisper.model
+
+    # whisper.model.Linear ne fait que convertir ses poids au type de l'entrée :
+    # en FP32 sur CPU, c'est un nn.Linear, que quantize_dynamic sait remplacer
+    for module in model.modules():
+        if type(module) is whisper.model.Linear:
+            module.__class__ = torch.nn.Linear
+
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def resolve_precision(device=None, precision=None):
+    """
+    Device et précision effectivement utilisés par load_whisper_model.
+
+    :return: (device, précision) ; la précision par défaut est FP16 sauf sur CPU.
+    """
+    # La quantification dynamique n'a de noyaux que sur CPU
+    device = resolve_device("cpu" if precision == "int8" and device is None else device)
+    if precision == "int8" and device != "cpu":
+        raise ValueError(f"La précision int8 n'est disponible que sur CPU (device demandé : {device})")
+    if precision is None:
+        precision = "fp32" if device == "cpu" else "fp16"
+    if precision not in PRECISIONS:
+        raise ValueError(f"Précision inconnue : {precision} (attendu : {', '.join(PRECISIONS)})")
+    return device, precision
+
+def load_whisper_model(model_name=DEFAULT_MODEL, device=None, precision=None):
+    """
+    Charge un modèle Whisper et affiche le temps de chargement.
+
+    torch et whisper ne sont importés qu'ici : un script qui n'a rien à
+    transcrire (ou --help) ne paie jamais leur import ni le chargement.
+
+    :param precision: "fp16", "fp32", "int8" (CPU seulement), ou None pour FP16 sauf sur CPU (comme model.transcribe).
+    :return: (modèle, fp16) où fp16 est à passer à model.transcribe.
+    """
+    import whisper
+
+    device, precision = resolve_precision(device, precision)
+
+    print(f"Using device: {device}")
+    start = time.perf_counter()
+    # Le point de contrôle FP32 déjà en cache (~/.cache/whisper) sert de base à la version int8
+    model = whisper.load_model(model_name, device=device)
+    if precision == "int8":
+        model = quantize_int8(model)
+    print(f"🧠 Modèle {model_name} ({precision}) chargé en {time.perf_counter() - start:.1f} s")
+
+    return model, precision == "fp16"
+
+def add_model_arguments(parser):
+    """
+    Options communes aux scripts de transcription : modèle, device et précision.
+    """
+    parser.add_argument('--model', type=str, default=DEFAULT_MODEL, help='Whisper model name (tiny, small, medium, large-v3...)')
+    parser.add_argument('--device', type=str, default=None, help='Device used for inference (cuda, cpu...; default: cuda if available)')
+    parser.add_argument('--precision', type=str, choices=PRECISIONS, default=None, help='Inference precision (default: fp16 on GPU, fp32 on CPU; int8: dynamically quantized CPU model)')
+    parser.add_argument('--threads', type=int, default=None, help='Number of PyTorch intra-op threads (default: PyTorch choice)')
+    parser.add_argument('--interop_threads', type=int, default=None, help='Number of PyTorch inter-op threads (default: PyTorch choice)')